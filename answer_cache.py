@@ -0,0 +1,193 @@
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+import metrics
+from metadata_index import filter_key
+from query_cache import normalize_query
+
+ANSWER_CACHE_FILENAME = "answers.pkl"
+DEFAULT_MAX_SIZE = 256
+# Cosinuslikhet som krävs för att två frågor ska räknas som samma fråga
+DEFAULT_THRESHOLD = 0.92
+
+# Frågor som syftar tillbaka på tidigare frågor betyder olika saker beroende på historiken.
+# Vanliga ord som det/den/de/då förekommer i de flesta fristående frågor ("Vad kostar det att ..."),
+# så pronomen och "då"/"sedan" räknas bara som sista ord ("Vad kostar den?", "Och hus då?").
+_REFERRING_WORDS = re.compile(r"\b(samma|också|även|igen|dess|denna|detta|dessa|same|also|again|its)\b")
+_REFERRING_END = re.compile(
+    r"\b(det|den|dem|de|dessa|han|hon|då|sen|sedan|annars|it|that|this|those|these|them|they|then|else)\W*$"
+)
+_FOLLOW_UP_START = re.compile(r"^(och|men|eller|så|and|but|or|so|what about|how about|vad sägs om)\b")
+
+
+def depends_on_history(query: str, history: Sequence) -> bool:
+    """Om frågan kan betyda något annat med den här historiken, t.ex. "och hotell då?".
+
+    Utan historik är varje fråga fristående. Med historik räknas frågor som börjar
+    som en fortsättning ("och ...", "men ..."), syftar tillbaka ("samma", "också",
+    "denna"), slutar med ett pronomen eller "då" ("Vad kostar den?") eller är för
+    korta för att stå för sig själva som beroende av historiken.
+    Regeln är hellre för försiktig: en onödig miss kostar en sökning, en felaktig
+    träff ger svaret på en annan fråga.
+    """
+    if not history:
+        return False
+    text = normalize_query(query)
+    return len(text.split()) < 3 or bool(
+        _FOLLOW_UP_START.search(text) or _REFERRING_WORDS.search(text) or _REFERRING_END.search(text)
+    )
+
+
+class SemanticAnswerCache:
+    """LRU-cache för färdiga svar, nycklad på frågans inbäddning.
+
+    En ny fråga får det sparade svaret om någon sparad fråga har cosinuslikhet
+    minst threshold med den, samma metadatafilter och samma korpusversion.
+    Poster från en äldre korpusversion tas bort vid första uppslaget efter bytet.
+    Inbäddningarna hålls som en normaliserad matris så att uppslaget är en
+    enda matris-vektorprodukt. Med path sparas cachen till disk mellan sessioner.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, threshold: float = DEFAULT_THRESHOLD,
+                 path: Optional[str] = None):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    @classmethod
+    def from_env(cls, cache_dir: Optional[str]) -> Optional["SemanticAnswerCache"]:
+        """Cache enligt RAG_ANSWER_CACHE (0 stänger av), RAG_ANSWER_CACHE_THRESHOLD och RAG_ANSWER_CACHE_SIZE"""
+        if os.environ.get("RAG_ANSWER_CACHE", "1").lower() in ("0", "false", "no"):
+            return None
+        return cls(
+            max_size=int(os.environ.get("RAG_ANSWER_CACHE_SIZE", DEFAULT_MAX_SIZE)),
+            threshold=float(os.environ.get("RAG_ANSWER_CACHE_THRESHOLD", DEFAULT_THRESHOLD)),
+            path=os.path.join(cache_dir, ANSWER_CACHE_FILENAME) if cache_dir else None,
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(query: str, where: Optional[dict]) -> tuple:
+        return normalize_query(query), filter_key(where)
+
+    def _normalized_matrix(self):
+        """(nycklar, matris) med en normaliserad rad per post; byggs om bara när posterna ändras"""
+        if self._matrix is None:
+            keys = list(self._entries)
+            vectors = [self._entries[key]["embedding"] for key in keys]
+            self._matrix = (keys, np.vstack(vectors) if vectors else None)
+        return self._matrix
+
+    def lookup(self, embedding, corpus_version: str, where: Optional[dict] = None) -> Optional[dict]:
+        """Det sparade svaret för den mest lika frågan, eller None.
+
+        Returnerar {"query", "answer", "sources", "similarity"}.
+        """
+        query_vector = _normalize(embedding)
+        wanted_filter = filter_key(where)
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry["corpus_version"] != corpus_version]
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                self._matrix = None
+
+            best_key, best_similarity = None, self.threshold
+            keys, matrix = self._normalized_matrix()
+            if matrix is not None:
+                similarities = matrix @ query_vector
+                for row in np.argsort(-similarities):
+                    if similarities[row] < best_similarity:
+                        break
+                    if keys[row][1] == wanted_filter:
+                        best_key, best_similarity = keys[row], float(similarities[row])
+                        break
+
+            if best_key is None:
+                self.misses += 1
+                result = None
+            else:
+                self.hits += 1
+                self._entries.move_to_end(best_key)
+                entry = self._entries[best_key]
+                result = {"query": entry["query"], "answer": entry["answer"], "sources": list(entry["sources"]),
+                          "similarity": best_similarity}
+        metrics.count("cache_hits" if result else "cache_misses", cache="answers")
+        return result
+
+    def store(self, query: str, embedding, answer: str, sources: List[dict], corpus_version: str,
+              where: Optional[dict] = None):
+        """Sparar svaret och källorna (metadata för de chunks som användes) för frågan"""
+        key = self._key(query, where)
+        with self._lock:
+            self._entries[key] = {
+                "query": query,
+                "embedding": _normalize(embedding),
+                "answer": answer,
+                "sources": list(sources),
+                "corpus_version": corpus_version,
+                "stored_at": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def save(self):
+        """Sparar cachen atomiskt om en sökväg har angetts"""
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with self._lock:
+            items = list(self._entries.items())
+        with open(tmp_path, "wb") as f:
+            pickle.dump(items, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                items = pickle.load(f)
+        except Exception as e:
+            print(f"⚠️ Kunde inte läsa svarscachen {self.path}: {str(e)}")
+            return
+        with self._lock:
+            self._entries = OrderedDict(items[-self.max_size:])
+            self._matrix = None
+
+
+def _normalize(embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
@@ -0,0 +1,99 @@
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from database_manager import DatabaseManager
+from ivfpq_index import DEFAULT_TRAIN_SIZE, IVFPQIndex
+from vector_store import normalize_rows
+
+CHROMA_PATH = "chroma"
+
+
+def exact_top_k(matrix: np.ndarray, queries: np.ndarray, k: int):
+    """Exakt top-k per fråga (en matrisprodukt per fråga) och latens i sekunder per fråga"""
+    results, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        scores = matrix @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        results.append(set(top[np.argsort(-scores[top])].tolist()))
+        latencies.append(time.perf_counter() - started)
+    return results, latencies
+
+
+def ann_top_k(index: IVFPQIndex, matrix: np.ndarray, queries: np.ndarray, k: int, nprobe: int,
+              rerank_factor: int):
+    """IVF-PQ top-k per fråga, med valfri exakt omräkning av kortlistan"""
+    positions = {doc_id: i for i, doc_id in enumerate(index.ids)}
+    results, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        ids, scores = index.search(query, k * rerank_factor if rerank_factor else k, nprobe)
+        rows = np.asarray([positions[doc_id] for doc_id in ids], dtype=np.int64)
+        if rerank_factor and len(rows):
+            scores = matrix[rows] @ query
+        results.append(set(rows[np.argsort(-np.asarray(scores), kind="stable")[:k]].tolist()))
+        latencies.append(time.perf_counter() - started)
+    return results, latencies
+
+
+def recall(found, expected) -> float:
+    return float(np.mean([len(f & e) / max(len(e), 1) for f, e in zip(found, expected)]))
+
+
+def percentile_ms(latencies, q: float) -> float:
+    return float(np.percentile(latencies, q)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k och latens för IVF-PQ jämfört med exakt sökning")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200,
+                        help="Antal frågor; vektorer från korpusen med lite brus.")
+    parser.add_argument("--nprobe", nargs="+", type=int, default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--rerank", nargs="+", type=int, default=[0, 4],
+                        help="Kortlistans storlek i multiplar av k (0 = ingen exakt omräkning).")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--m", type=int, default=None, help="Antal byte per vektor i PQ-koden.")
+    parser.add_argument("--train-size", type=int, default=DEFAULT_TRAIN_SIZE)
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager(CHROMA_PATH)
+    ids, matrix = db_manager.get_embedding_matrix()
+    if len(ids) <= args.k:
+        print("❌ Databasen har för få chunks, kör populate_database.py först")
+        return
+    matrix = normalize_rows(matrix)
+
+    rng = np.random.default_rng(0)
+    sample = matrix[rng.choice(len(matrix), min(args.train_size, len(matrix)), replace=False)]
+    started = time.perf_counter()
+    index = IVFPQIndex(nlist=args.nlist, m=args.m)
+    index.train(sample)
+    train_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    index.add(ids, matrix)
+    add_seconds = time.perf_counter() - started
+
+    queries = matrix[rng.choice(len(matrix), args.queries)]
+    queries = normalize_rows(queries + rng.normal(scale=0.05, size=queries.shape).astype(np.float32))
+    expected, exact_latencies = exact_top_k(matrix, queries, args.k)
+
+    print(f"\n=== 🔎 IVF-PQ mot exakt sökning: {len(ids)} chunks, {args.queries} frågor, k={args.k} ===")
+    print(f"Listor: {index.nlist}, kod: {index.m} byte/vektor (float32: {matrix.shape[1] * 4} byte), "
+          f"träning {train_seconds:.1f}s, tillägg {add_seconds:.1f}s")
+    print(f"\n{'nprobe':>6} {'Rerank':>6} {'Recall@k':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    print(f"{'exakt':>6} {'-':>6} {1.0:>9.3f} {percentile_ms(exact_latencies, 50):>8.2f} "
+          f"{percentile_ms(exact_latencies, 95):>8.2f}")
+    for nprobe in args.nprobe:
+        for rerank_factor in args.rerank:
+            found, latencies = ann_top_k(index, matrix, queries, args.k, nprobe, rerank_factor)
+            print(f"{nprobe:>6} {rerank_factor or '-':>6} {recall(found, expected):>9.3f} "
+                  f"{percentile_ms(latencies, 50):>8.2f} {percentile_ms(latencies, 95):>8.2f}")
+    print(f"\nMedianlatens exakt: {statistics.median(exact_latencies) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import time
+from itertools import islice
+
+import numpy as np
+
+from database_manager import DatabaseManager
+from get_embedding_function import DEFAULT_QUANTIZATION, EMBEDDING_BACKENDS, LazyEmbeddings
+
+CHROMA_PATH = "chroma"
+
+
+def load_corpus(limit: int):
+    """Hämtar upp till limit chunks från databasen så att mätningen görs på vår egen korpus"""
+    db_manager = DatabaseManager(CHROMA_PATH)
+    return [text for _id, text in islice(db_manager._iter_documents(), limit)]
+
+
+def embed(model: LazyEmbeddings, texts, warmup: int = 8):
+    """Bäddar in texterna och returnerar (matris, texter per sekund) efter en uppvärmning"""
+    model.embed_documents(texts[:warmup])
+    started = time.perf_counter()
+    vectors = np.asarray(model.embed_documents(texts), dtype=np.float32)
+    return vectors, len(texts) / max(time.perf_counter() - started, 1e-9)
+
+
+def cosine_agreement(vectors: np.ndarray, reference: np.ndarray):
+    """Medel- och minsta cosinuslikhet mellan samma text inbäddad med två modeller"""
+    a = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    b = reference / np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12)
+    cosines = np.einsum("ij,ij->i", a, b)
+    return float(cosines.mean()), float(cosines.min())
+
+
+def neighbour_overlap(vectors: np.ndarray, reference: np.ndarray, k: int = 10) -> float:
+    """Andel av referensmodellens k närmaste grannar (chunk mot chunk) som modellen också hittar"""
+    k = min(k, len(vectors) - 1)
+    if k <= 0:
+        return 1.0
+    overlaps = []
+    for matrix in (vectors, reference):
+        scores = matrix @ matrix.T
+        np.fill_diagonal(scores, -np.inf)
+        overlaps.append(np.argpartition(-scores, k - 1, axis=1)[:, :k])
+    return float(np.mean([len(set(x) & set(y)) / k for x, y in zip(*overlaps)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Jämför embedding-backends på korpusen i databasen")
+    parser.add_argument("--backends", nargs="+", default=list(EMBEDDING_BACKENDS), choices=EMBEDDING_BACKENDS)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[32])
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--max-seq-length", type=int, default=None)
+    parser.add_argument("--quantization", default=DEFAULT_QUANTIZATION,
+                        help="arm64, avx2, avx512 eller avx512_vnni för onnx-int8.")
+    parser.add_argument("--limit", type=int, default=2000, help="Max antal chunks att bädda in.")
+    args = parser.parse_args()
+
+    texts = load_corpus(args.limit)
+    if not texts:
+        print("❌ Databasen är tom, kör populate_database.py först")
+        return
+    print(f"\n=== ⏱️ Embedding-backends på {len(texts)} chunks ===")
+
+    # Referensen är PyTorch-modellen med standardinställningar
+    reference, reference_rate = embed(LazyEmbeddings(threads=args.threads), texts)
+    print(f"\n{'Backend':<12} {'Batch':>5} {'Texter/s':>10} {'Speedup':>8} {'Cos medel':>10} "
+          f"{'Cos min':>8} {'Grannar@10':>10}")
+    for backend in args.backends:
+        for batch_size in args.batch_sizes:
+            model = LazyEmbeddings(backend=backend, batch_size=batch_size, threads=args.threads,
+                                   max_seq_length=args.max_seq_length, quantization=args.quantization)
+            try:
+                vectors, rate = embed(model, texts)
+            except Exception as e:
+                print(f"{backend:<12} {batch_size:>5} ❌ {e}")
+                continue
+            mean_cos, min_cos = cosine_agreement(vectors, reference)
+            print(f"{backend:<12} {batch_size:>5} {rate:>10.1f} {rate / reference_rate:>7.2f}x "
+                  f"{mean_cos:>10.4f} {min_cos:>8.4f} {neighbour_overlap(vectors, reference):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
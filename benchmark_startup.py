@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Tunga moduler som inte ska laddas förrän de behövs
+HEAVY_MODULES = ("torch", "transformers", "sentence_transformers", "nltk", "langchain_openai",
+                 "langchain_huggingface", "chromadb", "pandas")
+
+# Körs i en ny process per mätning: import, uppstart av huvudobjekten och valfritt en första fråga
+_PROBES = {
+    "query_data": """
+import query_data
+t_import = time.perf_counter()
+db_manager = query_data.DatabaseManager(query_data.CHROMA_PATH)
+engine = query_data.SearchEngine(query_data.CHAT_PROMPT, db_manager.embedding_function,
+                                 system_prompt=query_data.SYSTEM_PROMPT, db_manager=db_manager,
+                                 cache_dir=query_data.CACHE_PATH)
+t_ready = time.perf_counter()
+if QUESTION:
+    engine.search_legs(QUESTION)
+t_first = time.perf_counter()
+engine.close()
+""",
+    "populate_database": """
+import populate_database
+t_import = time.perf_counter()
+db_manager = populate_database.DatabaseManager(populate_database.CHROMA_PATH)
+doc_processor = populate_database.DocumentProcessor(populate_database.DATA_PATH)
+if os.path.isdir(populate_database.DATA_PATH):
+    doc_processor.list_files()
+t_ready = time.perf_counter()
+t_first = t_ready
+""",
+}
+
+
+def _probe_source(entry_point: str, question: str) -> str:
+    return f"""
+import json, os, sys, time
+QUESTION = {question!r}
+t_start = time.perf_counter()
+{_PROBES[entry_point]}
+print(json.dumps({{
+    "import": t_import - t_start,
+    "ready": t_ready - t_start,
+    "first_query": t_first - t_start,
+    "modules": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+def measure(entry_point: str, runs: int, question: str = "") -> dict:
+    """Startar entry_point i nya processer och returnerar medianer över runs körningar"""
+    samples = []
+    for _ in range(runs):
+        process = subprocess.run(
+            [sys.executable, "-c", _probe_source(entry_point, question)],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        if process.returncode != 0:
+            raise RuntimeError(f"{entry_point} kunde inte starta:\n{process.stderr}")
+        samples.append(json.loads(process.stdout.strip().splitlines()[-1]))
+    return {
+        "import": statistics.median(s["import"] for s in samples),
+        "ready": statistics.median(s["ready"] for s in samples),
+        "first_query": statistics.median(s["first_query"] for s in samples),
+        "modules": samples[-1]["modules"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mäter kallstarten för query_data.py och populate_database.py")
+    parser.add_argument("--runs", type=int, default=5, help="Antal nya processer per entry point.")
+    parser.add_argument("--question", default="",
+                        help="Kör även en första sökning (laddar embeddingmodell och Chroma).")
+    parser.add_argument("--offline", action="store_true", help="Mät med RAG_OFFLINE=1.")
+    args = parser.parse_args()
+
+    if args.offline:
+        os.environ["RAG_OFFLINE"] = "1"
+
+    print(f"\n=== ⏱️ Kallstart ({args.runs} körningar, median) ===")
+    for entry_point in _PROBES:
+        result = measure(entry_point, args.runs, args.question if entry_point == "query_data" else "")
+        print(f"\n{entry_point}:")
+        print(f"   Import:        {result['import'] * 1000:8.0f} ms")
+        print(f"   Redo:          {result['ready'] * 1000:8.0f} ms")
+        if entry_point == "query_data" and args.question:
+            print(f"   Första sökning: {result['first_query'] * 1000:7.0f} ms")
+        print(f"   Tunga moduler: {', '.join(result['modules']) or 'inga'}")
+
+
+if __name__ == "__main__":
+    main()
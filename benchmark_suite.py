@@ -0,0 +1,184 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import numpy as np
+
+from database_manager import DatabaseManager
+from document_processor import DocumentProcessor, file_hash
+from ingestion_pipeline import IngestionPipeline
+from llm_client import LLMClient
+from query_data import create_search_engine, query_rag
+from stub_llm_server import StubCompletionServer
+from synthetic_corpus import generate_corpus, sample_questions
+
+RESULTS_DIR = "benchmarks"
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    """Percentiler och medel i millisekunder"""
+    ms = np.asarray(seconds) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def ingest(data_path: str, chroma_path: str, batch_size: int, workers: int):
+    """Läser in hela datamappen som populate_database.py gör; returnerar (mätvärden, db_manager)"""
+    db_manager = DatabaseManager(chroma_path, batch_size=batch_size)
+    doc_processor = DocumentProcessor(data_path, workers=workers,
+                                      structured_store_path=db_manager.structured_store_path)
+    files = doc_processor.list_files()
+    hashes = {file: file_hash(os.path.join(data_path, file)) for file in files}
+    manifest = db_manager.load_manifest()
+
+    started = time.perf_counter()
+    # Inläsningen skriver ut en rad per fil; den delen hör inte till resultatet
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = IngestionPipeline(doc_processor, db_manager, batch_size=batch_size).run(files, hashes, manifest)
+    db_manager.save_manifest(manifest)
+    pipeline_seconds = time.perf_counter() - started
+    db_manager.refresh_indexes()
+    total_seconds = time.perf_counter() - started
+    return {
+        "files": stats["files"],
+        "chunks": stats["chunks"],
+        "pipeline_seconds": pipeline_seconds,
+        "index_seconds": total_seconds - pipeline_seconds,
+        "total_seconds": total_seconds,
+        "chunks_per_second": stats["chunks"] / max(total_seconds, 1e-9),
+    }, db_manager
+
+
+def measure_search(search_engine, questions: List[str], top_k: int, warmup: int = 3) -> dict:
+    """Latens för SearchEngine.search per fråga; cacherna är avstängda så varje fråga söks på riktigt"""
+    for question in questions[:warmup]:
+        search_engine.search(question, top_k_each=top_k)
+    latencies, hits = [], []
+    for question in questions:
+        started = time.perf_counter()
+        results = search_engine.search(question, top_k_each=top_k)
+        latencies.append(time.perf_counter() - started)
+        hits.append(len(results))
+    return {"top_k": top_k, "mean_hits": float(np.mean(hits)), **latency_summary(latencies)}
+
+
+def measure_end_to_end(db_manager, questions: List[str], llm_latency: float) -> dict:
+    """query_rag mot en lokal stub-server med fast svarslatens"""
+    with StubCompletionServer(latency=llm_latency) as server:
+        llm_client = LLMClient(base_url=server.base_url)
+        search_engine = create_search_engine(db_manager, cache_dir=None, cache_size=0, llm_client=llm_client)
+        try:
+            query_rag(questions[0], search_engine)
+            latencies = []
+            for question in questions:
+                started = time.perf_counter()
+                query_rag(question, search_engine)
+                latencies.append(time.perf_counter() - started)
+        finally:
+            search_engine.close()
+        # Klienten skickar prompten som en lista med en sträng
+        prompt_chars = [len("".join(request.get("prompt", ""))) for request in server.requests]
+    return {"llm_latency_ms": llm_latency * 1000, "mean_prompt_chars": float(np.mean(prompt_chars)),
+            **latency_summary(latencies)}
+
+
+def run_size(work_dir: str, pages: int, args) -> dict:
+    """Genererar, läser in och mäter en korpusstorlek"""
+    data_path = os.path.join(work_dir, f"pages_{pages}", "data")
+    chroma_path = os.path.join(work_dir, f"pages_{pages}", "chroma")
+    shutil.rmtree(os.path.dirname(data_path), ignore_errors=True)
+    pdf_files = max(1, pages // args.pages_per_file)
+    corpus = generate_corpus(data_path, pdf_files=pdf_files, pages_per_file=args.pages_per_file,
+                             table_files=args.tables, rows_per_table=args.rows_per_table, seed=args.seed)
+    print(f"\n📄 {corpus['pdf_pages']} sidor + {corpus['table_rows']} tabellrader: läser in...")
+    ingest_result, db_manager = ingest(data_path, chroma_path, args.batch_size, args.workers)
+    print(f"   {ingest_result['chunks']} chunks på {ingest_result['total_seconds']:.1f}s "
+          f"({ingest_result['chunks_per_second']:.1f} chunks/s)")
+
+    questions = sample_questions(args.queries, seed=args.seed + 1)
+    search_engine = create_search_engine(db_manager, cache_dir=None, cache_size=0)
+    try:
+        search_results = []
+        for top_k in args.top_k:
+            result = measure_search(search_engine, questions, top_k)
+            search_results.append(result)
+            print(f"   search top_k={top_k}: p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms")
+    finally:
+        search_engine.close()
+
+    result = {"pdf_pages": pages, "corpus": corpus, "ingest": ingest_result, "search": search_results}
+    if args.end_to_end:
+        result["end_to_end"] = measure_end_to_end(db_manager, questions[:args.end_to_end_queries],
+                                                  args.llm_latency)
+        print(f"   end-to-end: p50 {result['end_to_end']['p50_ms']:.1f} ms, "
+              f"p95 {result['end_to_end']['p95_ms']:.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Mäter inläsning, söklatens och end-to-end-latens på syntetiska korpusar"
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000], help="Antal PDF-sidor per korpus.")
+    parser.add_argument("--pages-per-file", type=int, default=50)
+    parser.add_argument("--tables", type=int, default=2)
+    parser.add_argument("--rows-per-table", type=int, default=1000)
+    parser.add_argument("--top-k", nargs="+", type=int, default=[3, 6, 20])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--end-to-end", action="store_true", help="Kör även query_rag mot en stub-server.")
+    parser.add_argument("--end-to-end-queries", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Stub-serverns svarstid i sekunder.")
+    parser.add_argument("--no-embedding-cache", action="store_true",
+                        help="Bädda in allt på nytt i stället för att läsa från embedding-cachen.")
+    parser.add_argument("--work-dir", default=os.path.join(RESULTS_DIR, "work"))
+    parser.add_argument("--output", default=None, help="JSON-fil för resultatet.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.no_embedding_cache:
+        os.environ["RAG_EMBEDDING_CACHE"] = ""
+
+    started_at = datetime.now(timezone.utc)
+    report = {
+        "revision": git_revision(),
+        "started_at": started_at.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "work_dir")},
+        "environment": {key: value for key, value in os.environ.items() if key.startswith("RAG_")},
+        "results": [run_size(args.work_dir, pages, args) for pages in args.sizes],
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"results-{started_at:%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 Resultat sparat i {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+import os
+import re
+from collections import Counter
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import metrics
+
+INDEX_FILENAME = "bm25_index.npz"
+
+# Max antal celler i en (frågor x dokument)-poängmatris vid batchsökning
+MAX_BLOCK_CELLS = 1 << 23
+
+# Enkel unicode-medveten tokenisering (hanterar å, ä, ö) utan NLTK-data
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Delar upp text i ord med gemener för BM25"""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+    """Väljer de k bästa (kolumn, poäng) > 0 per rad med argpartition i stället för full sortering"""
+    n_rows, n_cols = scores.shape
+    k = min(k, n_cols)
+    if k <= 0:
+        return [[] for _ in range(n_rows)]
+    if k < n_cols:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(n_cols), (n_rows, 1))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    candidates = np.take_along_axis(candidates, order, axis=1)
+    candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+    return [
+        [(int(col), float(score)) for col, score in zip(row_cols, row_scores) if score > 0]
+        for row_cols, row_scores in zip(candidates, candidate_scores)
+    ]
+
+
+class BM25Index:
+    """Inverterat BM25-index (Okapi) lagrat i CSR-format.
+
+    Postings för term t ligger i doc_indices/term_freqs[indptr[t]:indptr[t+1]].
+    Poängsättningen rör bara postings för termerna i frågan, inte hela korpusen.
+    """
+
+    def __init__(self, ids: Sequence[str], vocabulary: Sequence[str], indptr: np.ndarray,
+                 doc_indices: np.ndarray, term_freqs: np.ndarray, doc_lengths: np.ndarray,
+                 idf: np.ndarray, k1: float = 1.5, b: float = 0.75):
+        self.ids = list(ids)
+        self.vocabulary = list(vocabulary)
+        self.indptr = indptr
+        self.doc_indices = doc_indices
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.idf = idf
+        self.k1 = k1
+        self.b = b
+        self.term_ids = {term: i for i, term in enumerate(self.vocabulary)}
+        self.weights = self._compute_weights()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids: Sequence[str], documents: Sequence[str], k1: float = 1.5,
+              b: float = 0.75, epsilon: float = 0.25) -> "BM25Index":
+        """Bygger indexet från råtext"""
+        return cls.build_from_stream(zip(ids, documents), k1, b, epsilon)
+
+    @classmethod
+    def build_from_stream(cls, pairs: Iterable[Tuple[str, str]], k1: float = 1.5,
+                          b: float = 0.75, epsilon: float = 0.25) -> "BM25Index":
+        """Bygger indexet från (id, text)-par utan att hela korpusens text behöver ligga i minnet"""
+        vocab = {}
+        ids = []
+        posting_terms = []
+        posting_docs = []
+        posting_tfs = []
+        doc_lengths = []
+
+        for doc_idx, (doc_id, text) in enumerate(pairs):
+            counts = Counter(tokenize(text or ""))
+            ids.append(doc_id)
+            doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                posting_terms.append(vocab.setdefault(term, len(vocab)))
+                posting_docs.append(doc_idx)
+                posting_tfs.append(tf)
+
+        posting_terms = np.asarray(posting_terms, dtype=np.int64)
+        # Stabil sortering behåller dokumentordningen inom varje term
+        order = np.argsort(posting_terms, kind="stable")
+        doc_freqs = np.bincount(posting_terms, minlength=len(vocab))
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(doc_freqs, out=indptr[1:])
+
+        vocabulary = [None] * len(vocab)
+        for term, term_id in vocab.items():
+            vocabulary[term_id] = term
+
+        return cls(
+            ids=ids,
+            vocabulary=vocabulary,
+            indptr=indptr,
+            doc_indices=np.asarray(posting_docs, dtype=np.int32)[order],
+            term_freqs=np.asarray(posting_tfs, dtype=np.int32)[order],
+            doc_lengths=np.asarray(doc_lengths, dtype=np.int32),
+            idf=cls._compute_idf(doc_freqs, len(ids), epsilon),
+            k1=k1,
+            b=b,
+        )
+
+    def update(self, removed: Iterable[str], added: Iterable[Tuple[str, str]],
+               epsilon: float = 0.25) -> "BM25Index":
+        """Nytt index utan removed och med added; dokument i added som redan finns ersätts.
+
+        Bara de tillagda dokumenten tokeniseras. De befintliga postings filtreras och
+        slås ihop med de nya som arrayer, utan att korpusens text läses igen. Resultatet
+        poängsätter likadant som ett index byggt från grunden över samma dokument,
+        med de kvarvarande dokumenten först och de tillagda sist.
+        """
+        delta = BM25Index.build_from_stream(added, self.k1, self.b, epsilon)
+        drop = set(removed) | set(delta.ids)
+        keep = np.fromiter((doc_id not in drop for doc_id in self.ids), dtype=bool, count=len(self.ids))
+        new_positions = np.cumsum(keep) - 1
+        n_kept = int(keep.sum())
+
+        # Befintliga postings för dokument som finns kvar, omnumrerade till de nya positionerna
+        live = keep[self.doc_indices]
+        old_terms = np.repeat(np.arange(len(self.vocabulary)), np.diff(self.indptr))[live]
+
+        vocabulary = list(self.vocabulary)
+        term_ids = dict(self.term_ids)
+        for term in delta.vocabulary:
+            if term not in term_ids:
+                term_ids[term] = len(vocabulary)
+                vocabulary.append(term)
+        delta_term_ids = np.asarray([term_ids[term] for term in delta.vocabulary], dtype=np.int64)
+        delta_terms = delta_term_ids[np.repeat(np.arange(len(delta.vocabulary)), np.diff(delta.indptr))]
+
+        terms = np.concatenate([old_terms, delta_terms])
+        doc_indices = np.concatenate([new_positions[self.doc_indices[live]], delta.doc_indices + n_kept])
+        term_freqs = np.concatenate([self.term_freqs[live], delta.term_freqs])
+
+        # Termer som inte längre finns i något dokument tas bort ur vokabulären
+        doc_freqs = np.bincount(terms, minlength=len(vocabulary))
+        alive = doc_freqs > 0
+        terms = (np.cumsum(alive) - 1)[terms]
+        doc_freqs = doc_freqs[alive]
+        # Båda delarna är redan sorterade på term, så den stabila sorteringen är i praktiken en sammanslagning
+        order = np.argsort(terms, kind="stable")
+        indptr = np.zeros(len(doc_freqs) + 1, dtype=np.int64)
+        np.cumsum(doc_freqs, out=indptr[1:])
+
+        ids = [doc_id for doc_id, kept in zip(self.ids, keep) if kept] + delta.ids
+        return BM25Index(
+            ids=ids,
+            vocabulary=[term for term, is_alive in zip(vocabulary, alive) if is_alive],
+            indptr=indptr,
+            doc_indices=doc_indices.astype(np.int32)[order],
+            term_freqs=term_freqs.astype(np.int32)[order],
+            doc_lengths=np.concatenate([self.doc_lengths[keep], delta.doc_lengths]).astype(np.int32),
+            idf=self._compute_idf(doc_freqs, len(ids), epsilon),
+            k1=self.k1,
+            b=self.b,
+        )
+
+    @staticmethod
+    def _compute_idf(doc_freqs: np.ndarray, corpus_size: int, epsilon: float) -> np.ndarray:
+        """Beräknar IDF på samma sätt som rank_bm25.BM25Okapi"""
+        if doc_freqs.size == 0:
+            return np.zeros(0, dtype=np.float64)
+        idf = np.log(corpus_size - doc_freqs + 0.5) - np.log(doc_freqs + 0.5)
+        # Negativa IDF-värden ersätts med en andel av medel-IDF
+        idf[idf < 0] = epsilon * idf.mean()
+        return idf
+
+    def _compute_weights(self) -> np.ndarray:
+        """Förberäknar BM25-vikten för varje posting"""
+        if self.doc_indices.size == 0:
+            return np.zeros(0, dtype=np.float32)
+        avgdl = self.doc_lengths.mean() if self.doc_lengths.size else 0.0
+        doc_norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / max(avgdl, 1e-9))
+        term_of_posting = np.repeat(np.arange(len(self.vocabulary)), np.diff(self.indptr))
+        tf = self.term_freqs.astype(np.float64)
+        weights = self.idf[term_of_posting] * tf * (self.k1 + 1) / (tf + doc_norm[self.doc_indices])
+        return weights.astype(np.float32)
+
+    def _query_term_ids(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Returnerar unika term-id:n i frågan och hur många gånger de förekommer"""
+        term_ids = [self.term_ids[t] for t in tokenize(query) if t in self.term_ids]
+        if not term_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.unique(np.asarray(term_ids, dtype=np.int64), return_counts=True)
+
+    def score(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Poängsätter de dokument som innehåller någon av frågans termer.
+
+        Returnerar (dokumentpositioner, poäng) för berörda dokument.
+        """
+        unique_terms, counts = self._query_term_ids(query)
+        if unique_terms.size == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+        starts = self.indptr[unique_terms]
+        lengths = self.indptr[unique_terms + 1] - starts
+        postings = np.concatenate([np.arange(s, s + n) for s, n in zip(starts, lengths)])
+
+        # Upprepade termer i frågan räknas flera gånger, precis som i BM25Okapi
+        weights = self.weights[postings] * np.repeat(counts, lengths)
+        touched, inverse = np.unique(self.doc_indices[postings], return_inverse=True)
+        return touched, np.bincount(inverse, weights=weights)
+
+    def get_scores(self, query: str) -> np.ndarray:
+        """Returnerar poäng för alla dokument (motsvarar BM25Okapi.get_scores)"""
+        scores = np.zeros(len(self.ids), dtype=np.float64)
+        positions, touched_scores = self.score(query)
+        scores[positions] = touched_scores
+        return scores
+
+    def top_k(self, query: str, k: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Returnerar de k bästa (position, poäng) med poäng > 0.
+
+        allowed är en valfri bitmask över dokumenten (se MetadataIndex); bara de
+        dokument som släpps igenom rangordnas.
+        """
+        positions, scores = self.score(query)
+        if allowed is not None:
+            keep = allowed[positions]
+            positions, scores = positions[keep], scores[keep]
+        metrics.count("documents_scored", positions.size, leg="bm25")
+        if positions.size == 0 or k <= 0:
+            return []
+        if positions.size > k:
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(positions.size)
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(positions[i]), float(scores[i])) for i in candidates if scores[i] > 0]
+
+    def top_k_many(self, queries: Sequence[str], k: int,
+                   allowed: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        """Som top_k men för många frågor på en gång.
+
+        Frågornas postings samlas till en gles (fråga, dokument, vikt)-matris som
+        summeras med en enda bincount per block av frågor.
+        """
+        n_docs = len(self.ids)
+        if n_docs == 0 or k <= 0:
+            return [[] for _ in queries]
+        block_size = max(1, MAX_BLOCK_CELLS // n_docs)
+        results = []
+        for start in range(0, len(queries), block_size):
+            scores = self._score_block(queries[start:start + block_size])
+            if allowed is not None:
+                scores[:, ~allowed] = 0
+            if metrics.enabled():
+                metrics.count("documents_scored", int(np.count_nonzero(scores)), leg="bm25")
+            results.extend(top_k_rows(scores, k))
+        return results
+
+    def _score_block(self, queries: Sequence[str]) -> np.ndarray:
+        """Returnerar en (len(queries) x antal dokument)-matris med BM25-poäng"""
+        n_docs = len(self.ids)
+        posting_ranges = []
+        rows = []
+        repeats = []
+        for row, query in enumerate(queries):
+            unique_terms, counts = self._query_term_ids(query)
+            for term_id, count in zip(unique_terms, counts):
+                start, end = self.indptr[term_id], self.indptr[term_id + 1]
+                posting_ranges.append(np.arange(start, end))
+                rows.append(np.full(end - start, row, dtype=np.int64))
+                repeats.append(np.full(end - start, count, dtype=np.float64))
+
+        if not posting_ranges:
+            return np.zeros((len(queries), n_docs), dtype=np.float64)
+        postings = np.concatenate(posting_ranges)
+        flat = np.concatenate(rows) * n_docs + self.doc_indices[postings]
+        weights = self.weights[postings] * np.concatenate(repeats)
+        scores = np.bincount(flat, weights=weights, minlength=len(queries) * n_docs)
+        return scores.reshape(len(queries), n_docs)
+
+    def save(self, path: str):
+        """Sparar indexet atomiskt till en .npz-fil"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                ids=np.asarray(self.ids, dtype=str),
+                vocabulary=np.asarray(self.vocabulary, dtype=str),
+                indptr=self.indptr,
+                doc_indices=self.doc_indices,
+                term_freqs=self.term_freqs,
+                doc_lengths=self.doc_lengths,
+                idf=self.idf,
+                params=np.asarray([self.k1, self.b]),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Laddar ett index som sparats med save()"""
+        with np.load(path, allow_pickle=False) as data:
+            k1, b = data["params"]
+            return cls(
+                ids=data["ids"].tolist(),
+                vocabulary=data["vocabulary"].tolist(),
+                indptr=data["indptr"],
+                doc_indices=data["doc_indices"],
+                term_freqs=data["term_freqs"],
+                doc_lengths=data["doc_lengths"],
+                idf=data["idf"],
+                k1=float(k1),
+                b=float(b),
+            )
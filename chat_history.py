@@ -0,0 +1,127 @@
+import os
+from typing import Callable, List, Optional, Tuple
+
+import metrics
+from context_builder import estimate_tokens
+
+DEFAULT_TOKEN_BUDGET = 800
+DEFAULT_SUMMARY_TOKENS = 200
+# Vid överskridande krymps fönstret till den här andelen av budgeten, så att historiken
+# (och därmed promptens början) är oförändrad i flera turer mellan komprimeringarna
+COMPACT_RATIO = 0.5
+
+SUMMARY_PROMPT = """Sammanfatta samtalet nedan kortfattat på svenska. Behåll frågor, fakta och siffror
+som kan behövas för att förstå följdfrågor. Svara endast med sammanfattningen.
+
+Tidigare sammanfattning:
+{summary}
+
+Samtal:
+{turns}
+
+Sammanfattning:"""
+
+Turn = Tuple[str, str]
+
+
+def format_turns(turns: List[Turn]) -> str:
+    return "\n".join(f"Användare: {q}\nAssistent: {a}" for q, a in turns)
+
+
+def _clip(text: str, max_tokens: int) -> str:
+    """Kortar text till ungefär max_tokens tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max(0, max_tokens * 4 - 1)].rstrip() + "…"
+
+
+class LLMSummarizer:
+    """Sammanfattar bortplockade turer med språkmodellen"""
+
+    def __init__(self, llm_client, max_tokens: int = DEFAULT_SUMMARY_TOKENS):
+        self.llm_client = llm_client
+        self.max_tokens = max_tokens
+
+    def __call__(self, summary: str, turns: List[Turn]) -> str:
+        prompt = SUMMARY_PROMPT.format(summary=summary or "-", turns=format_turns(turns))
+        try:
+            with metrics.span("history.summarize", turns=len(turns)):
+                return self.llm_client.complete(prompt, temperature=0.0, max_tokens=self.max_tokens)
+        except Exception as e:
+            print(f"⚠️ Kunde inte sammanfatta historiken: {str(e)}")
+            return summary
+
+
+class ChatHistory:
+    """Chatthistorik begränsad till en tokenbudget.
+
+    När turerna inte längre ryms plockas de äldsta bort tills fönstret är nere i
+    COMPACT_RATIO av budgeten. Med en summarizer slås de bortplockade turerna ihop
+    med den tidigare sammanfattningen, som läggs först i historiken.
+    """
+
+    def __init__(self, token_budget: int = DEFAULT_TOKEN_BUDGET,
+                 summarizer: Optional[Callable[[str, List[Turn]], str]] = None,
+                 summary_tokens: int = DEFAULT_SUMMARY_TOKENS):
+        self.token_budget = token_budget
+        self.summarizer = summarizer
+        self.summary_tokens = summary_tokens
+        self.summary = ""
+        self.turns: List[Turn] = []
+        self._turn_tokens: List[int] = []
+
+    @classmethod
+    def from_env(cls, llm_client=None) -> "ChatHistory":
+        """Historik enligt RAG_HISTORY_TOKENS och RAG_HISTORY_SUMMARY (1 sammanfattar äldre turer)"""
+        summarize = os.environ.get("RAG_HISTORY_SUMMARY", "0").lower() in ("1", "true", "yes")
+        summary_tokens = int(os.environ.get("RAG_HISTORY_SUMMARY_TOKENS", DEFAULT_SUMMARY_TOKENS))
+        return cls(
+            token_budget=int(os.environ.get("RAG_HISTORY_TOKENS", DEFAULT_TOKEN_BUDGET)),
+            summarizer=LLMSummarizer(llm_client, summary_tokens) if summarize and llm_client else None,
+            summary_tokens=summary_tokens,
+        )
+
+    def __len__(self):
+        return len(self.turns)
+
+    def __bool__(self):
+        return bool(self.turns or self.summary)
+
+    def __iter__(self):
+        return iter(self.turns)
+
+    def tokens(self) -> int:
+        return sum(self._turn_tokens)
+
+    def append(self, question: str, answer: str):
+        """Lägger till en tur och komprimerar om fönstret blir större än budgeten"""
+        # En enskild tur får aldrig ta mer än hela budgeten
+        answer = _clip(answer, max(1, self.token_budget - estimate_tokens(format_turns([(question, "")])) - 1))
+        self.turns.append((question, answer))
+        self._turn_tokens.append(estimate_tokens(format_turns([(question, answer)])))
+        if self.tokens() > self.token_budget:
+            self._compact()
+
+    def _compact(self):
+        target = self.token_budget * COMPACT_RATIO
+        evicted = []
+        while len(self.turns) > 1 and self.tokens() > target:
+            evicted.append(self.turns.pop(0))
+            self._turn_tokens.pop(0)
+        metrics.count("history_turns_evicted", len(evicted))
+        if evicted and self.summarizer is not None:
+            self.summary = _clip(self.summarizer(self.summary, evicted).strip(), self.summary_tokens)
+
+    def clear(self):
+        self.summary = ""
+        self.turns = []
+        self._turn_tokens = []
+
+    def render(self) -> str:
+        """Historiken som den skickas i prompten"""
+        parts = []
+        if self.summary:
+            parts.append(f"Sammanfattning av tidigare samtal: {self.summary}")
+        if self.turns:
+            parts.append(format_turns(self.turns))
+        return "\n\n".join(parts)
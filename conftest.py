@@ -0,0 +1,41 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+import database_manager
+
+
+class HashEmbeddings:
+    """Deterministiska inbäddningar från ordhashar, så att testerna inte behöver modellen"""
+    model_name = "hash"
+
+    def __init__(self):
+        self.embedded = []
+
+    def _embed(self, text):
+        vector = np.zeros(16)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 16] += 1
+        return (vector / (np.linalg.norm(vector) or 1)).tolist()
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+@pytest.fixture(scope="session")
+def hash_embeddings():
+    """Klassen HashEmbeddings, för fixturer med bredare scope än embeddings"""
+    return HashEmbeddings
+
+
+@pytest.fixture
+def embeddings(monkeypatch):
+    """HashEmbeddings i stället för embeddingmodellen i DatabaseManager"""
+    model = HashEmbeddings()
+    monkeypatch.setattr(database_manager, "get_embedding_function", lambda *args, **kwargs: model)
+    return model
@@ -0,0 +1,93 @@
+import math
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Chunkaren slår ihop meningar med mellanslag, så vi delar tillbaka efter meningsslut
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+DEFAULT_SEPARATOR = "\n\n---\n\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Grov uppskattning av antal tokens (ca fyra tecken per token)"""
+    return math.ceil(len(text) / 4)
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_BOUNDARY.split(text) if s.strip()]
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def reciprocal_rank_fusion(ranked_lists: Sequence[List[Tuple[Dict, float]]], k: int = 60) -> List[Tuple[Dict, float]]:
+    """Slår ihop rankade listor med Reciprocal Rank Fusion.
+
+    Samma chunk i flera listor slås ihop till en post vars poäng är summan av 1 / (k + rang).
+    """
+    fused = {}
+    for results in ranked_lists:
+        for rank, (doc, _score) in enumerate(results, 1):
+            key = _normalize(doc["page_content"])
+            if key not in fused:
+                fused[key] = [doc, 0.0]
+            fused[key][1] += 1.0 / (k + rank)
+    return sorted(((doc, score) for doc, score in fused.values()), key=lambda item: item[1], reverse=True)
+
+
+class ContextAssembler:
+    """Packar hybridträffar till en kontext inom en tokenbudget.
+
+    Listorna slås ihop med RRF, dubbletter och meningar som redan finns i kontexten
+    (t.ex. överlappet mellan grann-chunks) tas bort, och chunks läggs till i
+    rangordning så länge de ryms i budgeten.
+    """
+
+    def __init__(self, token_budget: int = 1500, rrf_k: int = 60, separator: str = DEFAULT_SEPARATOR,
+                 token_counter: Optional[Callable[[str], int]] = None):
+        self.token_budget = token_budget
+        self.rrf_k = rrf_k
+        self.separator = separator
+        self.token_counter = token_counter or estimate_tokens
+
+    def assemble(self, ranked_lists: Sequence[List[Tuple[Dict, float]]]) -> Tuple[str, List[Tuple[Dict, float]]]:
+        """Returnerar (kontexttext, valda (doc, poäng)) där doc bara innehåller den text som skickas"""
+        selected = []
+        parts = []
+        seen_sentences = set()
+        used_tokens = 0
+        separator_tokens = self.token_counter(self.separator)
+
+        for doc, score in reciprocal_rank_fusion(ranked_lists, self.rrf_k):
+            sentences = split_sentences(doc["page_content"])
+            new_sentences = [s for s in sentences if _normalize(s) not in seen_sentences]
+            if not new_sentences:
+                continue
+
+            text = " ".join(new_sentences)
+            cost = self.token_counter(text) + (separator_tokens if parts else 0)
+            if used_tokens + cost > self.token_budget:
+                if parts:
+                    continue
+                # Första chunken är större än budgeten - korta den hellre än att skicka tom kontext
+                text = self._truncate(new_sentences, self.token_budget)
+                cost = self.token_counter(text)
+            if not text:
+                # Inte ens första meningen ryms - skicka hellre ingenting än en tom post med källa
+                continue
+
+            parts.append(text)
+            used_tokens += cost
+            seen_sentences.update(_normalize(s) for s in split_sentences(text))
+            selected.append(({"page_content": text, "metadata": doc["metadata"]}, score))
+
+        return self.separator.join(parts), selected
+
+    def _truncate(self, sentences: List[str], budget: int) -> str:
+        kept = []
+        for sentence in sentences:
+            if self.token_counter(" ".join(kept + [sentence])) > budget:
+                break
+            kept.append(sentence)
+        return " ".join(kept)
@@ -1,35 +1,112 @@
 import os
+import json
+import logging
+import hashlib
 import shutil
-from langchain.schema.document import Document
-from langchain_chroma import Chroma
+from langchain_core.documents import Document
 from get_embedding_function import get_embedding_function
-import chromadb
+from bm25_index import BM25Index, INDEX_FILENAME, MAX_BLOCK_CELLS, top_k_rows
+from structured_store import StructuredStore, STRUCTURED_STORE_FILENAME
+from vector_store import (MEMMAP_DIRNAME, VECTOR_BACKENDS, MemmapVectorStore, create_vector_store,
+                          normalize_rows)
+from metadata_index import FILTER_FIELDS, METADATA_INDEX_FILENAME, MetadataIndex
+from ivfpq_index import DEFAULT_NPROBE, DEFAULT_TRAIN_SIZE, IVFPQ_DIRNAME, IVFPQIndex
 import time
-from langchain_community.vectorstores.utils import filter_complex_metadata
+import uuid
+import numpy as np
 from typing import Dict, Any
+import metrics
+
+CORPUS_VERSION_FILENAME = "corpus_version"
+MANIFEST_FILENAME = "manifest.json"
+# exact = sök bland alla vektorer i vektorlagret, ivfpq = approximativt IVF-PQ-index
+DENSE_INDEXES = ("exact", "ivfpq")
+# Kortlistan från IVF-PQ är så här många gånger k innan den räknas om exakt (0 = ingen omräkning)
+DEFAULT_RERANK_FACTOR = 4
+# Större andel ändrade chunks än så byggs BM25-indexet om från grunden i stället för att uppdateras
+INCREMENTAL_MAX_RATIO = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+def chunk_id(metadata: Dict[str, Any], content: str) -> str:
+    """Deterministiskt chunk-ID som bara beror på källan och chunkens innehåll"""
+    source = metadata.get("source", "unknown")
+    if metadata.get("type") == "structured_data" and "row_start" in metadata:
+        sheet = metadata.get("sheet", "main")
+        return f"{source}:{sheet}:{metadata.get('row_start')}-{metadata.get('row_end', 0)}"
+    location = metadata.get("sheet", "main") if metadata.get("type") == "structured_data" else metadata.get("page", 0)
+    digest = hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+    return f"{source}:{location}:{digest}"
+
+
+def safe_filter_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Säker filtrering av metadata som behåller dictionary-strukturen"""
+    filtered = {}
+    for key, value in metadata.items():
+        if isinstance(value, (str, int, float, bool)):
+            filtered[key] = value
+        elif isinstance(value, list):
+            # Konvertera lista till sträng
+            filtered[key] = ", ".join(str(v) for v in value)
+        else:
+            # För andra typer, konvertera till sträng
+            filtered[key] = str(value)
+    return filtered
 
-COLLECTION_NAME = "documents"
 
 class DatabaseManager:
-    def __init__(self, chroma_path):
+    def __init__(self, chroma_path, batch_size: int = 256, vector_backend: str = None, vector_dtype: str = None,
+                 dense_index: str = None, nprobe: int = None, rerank_factor: int = None):
         self.chroma_path = chroma_path
+        self.batch_size = batch_size
+        self.embedding_function = get_embedding_function()
+        self.lexical_index_path = os.path.join(chroma_path, INDEX_FILENAME)
+        self.corpus_version_path = os.path.join(chroma_path, CORPUS_VERSION_FILENAME)
+        self.manifest_path = os.path.join(chroma_path, MANIFEST_FILENAME)
+        self.structured_store_path = os.path.join(chroma_path, STRUCTURED_STORE_FILENAME)
+        self.structured_store = StructuredStore(self.structured_store_path)
+        self._embedding_matrix = None
+        # chroma (standard) eller memmap; en befintlig memmap-databas väljs automatiskt
+        self.vector_backend = vector_backend or os.environ.get("RAG_VECTOR_BACKEND") or (
+            "memmap" if MemmapVectorStore.exists(os.path.join(chroma_path, MEMMAP_DIRNAME)) else "chroma")
+        if self.vector_backend not in VECTOR_BACKENDS:
+            raise ValueError(f"Okänd vektorbackend '{self.vector_backend}', välj en av: {', '.join(VECTOR_BACKENDS)}")
+        self.vector_dtype = vector_dtype or os.environ.get("RAG_VECTOR_DTYPE", "float16")
+        self.dense_index = dense_index or os.environ.get("RAG_DENSE_INDEX", "exact")
+        if self.dense_index not in DENSE_INDEXES:
+            raise ValueError(f"Okänt dense-index '{self.dense_index}', välj en av: {', '.join(DENSE_INDEXES)}")
+        self.nprobe = nprobe or int(os.environ.get("RAG_IVF_NPROBE", DEFAULT_NPROBE))
+        self.rerank_factor = rerank_factor if rerank_factor is not None else int(
+            os.environ.get("RAG_IVF_RERANK", DEFAULT_RERANK_FACTOR))
+        self.ann_index_path = os.path.join(chroma_path, IVFPQ_DIRNAME)
+        self.metadata_index_path = os.path.join(chroma_path, METADATA_INDEX_FILENAME)
+        self._metadata_index = None
+        # (korpusversion, index) så att ett index som byggts om av en annan process läses in igen
+        self._ann_index = None
+        # Chunks som skrivits eller tagits bort sedan BM25- och metadataindexet senast byggdes
+        self._pending_upserts = set()
+        self._pending_deletes = set()
         self._initialize_db()
 
+    @property
+    def db(self):
+        """Chroma-databasen (bara för chroma-backenden)"""
+        return self.vector_store.db
+
     def _initialize_db(self):
-        self.db = Chroma(
-            persist_directory=self.chroma_path,
-            embedding_function=get_embedding_function(),
-            collection_name=COLLECTION_NAME
+        self.vector_store = create_vector_store(
+            self.vector_backend, self.chroma_path, self.embedding_function, self.vector_dtype
         )
 
     def clear_database(self):
         # Stäng och rensa den befintliga databasen
-        if hasattr(self, 'db'):
-            try:
-                self.db.delete_collection()
-            except:
-                pass
-            del self.db
+        self.vector_store.close()
+        self._embedding_matrix = None
+        self._ann_index = None
+        self._metadata_index = None
+        self._pending_upserts.clear()
+        self._pending_deletes.clear()
         
         # Vänta en kort stund
         time.sleep(1)
@@ -39,122 +116,423 @@ class DatabaseManager:
             try:
                 shutil.rmtree(self.chroma_path, ignore_errors=True)
             except Exception as e:
-                print(f"Varning: Kunde inte ta bort alla filer: {e}")
+                logger.warning("Varning: Kunde inte ta bort alla filer: %s", e)
         
         # Vänta igen för att säkerställa att allt är borta
         time.sleep(1)
         
         # Återskapa databasen
         self._initialize_db()
+        self._bump_corpus_version()
 
-    def add_documents(self, chunks: list[Document]):
-        print(f"\n=== 🔍 Debug Information ===")
-        print(f"Inkommande chunks: {len(chunks)}")
-        
-        def debug_metadata(metadata: Dict[str, Any], prefix: str = ""):
-            """Hjälpfunktion för att debugga metadata"""
-            for key, value in metadata.items():
-                print(f"{prefix}{key}: ({type(value).__name__}) = {value}")
-        
-        def safe_filter_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
-            """Säker filtrering av metadata som behåller dictionary-strukturen"""
-            filtered = {}
-            for key, value in metadata.items():
-                if isinstance(value, (str, int, float, bool)):
-                    filtered[key] = value
-                elif isinstance(value, list):
-                    # Konvertera lista till sträng
-                    filtered[key] = ", ".join(str(v) for v in value)
-                else:
-                    # För andra typer, konvertera till sträng
-                    filtered[key] = str(value)
-            return filtered
+    def add_documents(self, chunks: list[Document], update_indexes: bool = True, seen_ids: set = None):
+        """Upsertar chunks i bulk och returnerar deras ID:n (None om skrivningen misslyckades).
+
+        Metadata saneras och ID:n sätts i ett svep, chunks med samma ID skrivs bara en
+        gång, och inbäddning och skrivning sker i batchar som ryms inom Chromas maxgräns.
+        Med update_indexes=False byggs BM25-index och korpusversion inte om; anroparen
+        ansvarar då för att anropa refresh_indexes() när alla ändringar är gjorda.
+        seen_ids delas mellan anrop när en fil skrivs i flera batchar.
+        """
+        seen_ids = set() if seen_ids is None else seen_ids
+        ids, texts, metadatas = [], [], []
+        skipped = duplicates = 0
         
-        # Verifiera chunks och filtrera metadata
-        valid_chunks = []
+        # Sanera metadata, sätt ID och ta bort dubbletter i ett svep
         for i, chunk in enumerate(chunks):
             if not isinstance(chunk, Document):
-                print(f"Chunk {i}: Inte ett Document-objekt, typ: {type(chunk)}")
+                logger.warning("Chunk %d: Inte ett Document-objekt, typ: %s", i, type(chunk))
+                skipped += 1
                 continue
             
-            try:
-                print(f"\nBearbetar chunk {i}:")
-                print("Original metadata:")
-                debug_metadata(chunk.metadata, "  ")
-                
-                # Använd vår egen säkra filtrering istället för filter_complex_metadata
-                filtered_metadata = safe_filter_metadata(chunk.metadata)
-                
-                print("\nEfter säker filtrering:")
-                debug_metadata(filtered_metadata, "  ")
-                
-                # Lägg till ID om det inte finns
-                if "id" not in filtered_metadata:
-                    if filtered_metadata.get("type") == "structured_data":
-                        source = filtered_metadata.get("source", "unknown")
-                        sheet = filtered_metadata.get("sheet", "main")
-                        row_start = filtered_metadata.get("row_start", 0)
-                        row_end = filtered_metadata.get("row_end", 0)
-                        filtered_metadata["id"] = f"{source}:{sheet}:{row_start}-{row_end}"
-                    else:
-                        source = filtered_metadata.get("source", "unknown")
-                        page = filtered_metadata.get("page", 0)
-                        chunk_index = getattr(self, '_chunk_index', 0)
-                        filtered_metadata["id"] = f"{source}:{page}:{chunk_index}"
-                        self._chunk_index = chunk_index + 1
-                
-                print("\nSlutlig metadata:")
-                debug_metadata(filtered_metadata, "  ")
-                
-                # Skapa ny Document med filtrerad metadata
-                valid_chunks.append(Document(
-                    page_content=chunk.page_content,
-                    metadata=filtered_metadata
-                ))
-                
-            except Exception as e:
-                print(f"⚠️ Fel vid bearbetning av chunk {i}: {str(e)}")
-                print(f"Metadata som orsakade felet:")
-                debug_metadata(chunk.metadata, "  ")
+            metadata = safe_filter_metadata(chunk.metadata)
+            if "id" not in metadata:
+                metadata["id"] = chunk_id(metadata, chunk.page_content)
+            if metadata["id"] in seen_ids:
+                duplicates += 1
                 continue
+            seen_ids.add(metadata["id"])
+            logger.debug("Chunk %d: %s", i, metadata)
+            
+            ids.append(metadata["id"])
+            texts.append(chunk.page_content)
+            metadatas.append(metadata)
         
-        if not valid_chunks:
-            print("❌ Inga giltiga chunks att lägga till")
-            return
-        
-        print(f"\n✅ Filtrerade {len(chunks)} chunks till {len(valid_chunks)} giltiga chunks")
+        if not ids:
+            logger.warning("❌ Inga giltiga chunks att lägga till")
+            return []
         
+        batch_size = min(self.batch_size, self._max_write_batch_size())
+        embed_seconds = write_seconds = 0.0
+        cache_before = self._embedding_cache_counts()
         try:
-            # Lägg till dokumenten
-            self.db.add_documents(valid_chunks)
-            print(f"✅ Lade till {len(valid_chunks)} chunks i databasen")
+            for start in range(0, len(ids), batch_size):
+                end = start + batch_size
+                
+                started = time.perf_counter()
+                with metrics.span("embed.documents", count=len(texts[start:end])):
+                    embeddings = self.embedding_function.embed_documents(texts[start:end])
+                embed_seconds += time.perf_counter() - started
+                
+                # Med explicita ID:n blir skrivningen en upsert
+                started = time.perf_counter()
+                with metrics.span("db.write", count=len(embeddings)):
+                    self.vector_store.upsert(ids[start:end], embeddings, texts[start:end], metadatas[start:end])
+                    self._pending_upserts.update(ids[start:end])
+                    self._pending_deletes.difference_update(ids[start:end])
+                    ann_index = self.ann_index
+                    if ann_index is not None and ann_index.is_trained:
+                        ann_index.add(ids[start:end], embeddings)
+                write_seconds += time.perf_counter() - started
+                metrics.count("chunks_written", len(embeddings))
         except Exception as e:
-            print(f"❌ Fel vid tillägg till databasen: {str(e)}")
-            # Visa exempel på metadata som orsakade felet
-            if valid_chunks:
-                print("\nExempel på problematisk metadata:")
-                debug_metadata(valid_chunks[0].metadata, "  ")
+            failed = ids[start:end]
+            logger.error("❌ Fel vid tillägg av chunk %d-%d av %d till databasen: %s",
+                         start + 1, start + len(failed), len(ids), e)
+            logger.error("ID:n i batchen som misslyckades: %s", ", ".join(failed))
+            # Batchen och de efterföljande skrevs inte; ett nytt försök med samma seen_ids ska skriva dem
+            seen_ids.difference_update(ids[start:])
+            return None
+        
+        total_seconds = embed_seconds + write_seconds
+        logger.info(
+            "✅ Upsertade %d chunks (%d dubbletter, %d ogiltiga) på %.2fs: "
+            "inbäddning %.2fs, skrivning %.2fs, %.1f chunks/s",
+            len(ids), duplicates, skipped, total_seconds, embed_seconds, write_seconds,
+            len(ids) / max(total_seconds, 1e-9)
+        )
+        cache_after = self._embedding_cache_counts()
+        if cache_before and cache_after:
+            hits = cache_after[0] - cache_before[0]
+            misses = cache_after[1] - cache_before[1]
+            logger.info("   Embedding-cache: %d träffar, %d inbäddade (%.0f%% träffar)",
+                        hits, misses, 100 * hits / max(hits + misses, 1))
+        if update_indexes:
+            self.refresh_indexes()
+        return ids
+
+    def _embedding_cache_counts(self):
+        """(träffar, missar) från embedding-cachen, eller None om modellen inte är cachad"""
+        if not hasattr(self.embedding_function, "stats"):
+            return None
+        return self.embedding_function.hits, self.embedding_function.misses
+
+    def _max_write_batch_size(self) -> int:
+        """Största batch som vektorlagret accepterar i en skrivning"""
+        return self.vector_store.max_batch_size()
 
     def _calculate_chunk_ids(self, chunks):
         """Beräknar unika ID:n för chunks"""
         for chunk in chunks:
-            if chunk.metadata.get("type") == "structured_data":
-                # För strukturerad data, använd befintligt ID om det finns
-                if "id" not in chunk.metadata:
-                    source = chunk.metadata.get("source", "unknown")
-                    sheet = chunk.metadata.get("sheet", "main")
-                    row_start = chunk.metadata.get("row_start", 0)
-                    row_end = chunk.metadata.get("row_end", 0)
-                    chunk.metadata["id"] = f"{source}:{sheet}:{row_start}-{row_end}"
-            else:
-                # Hantering av PDF/text-dokument som tidigare
-                source = chunk.metadata.get("source", "unknown")
-                page = chunk.metadata.get("page", 0)
-                current_chunk_index = getattr(self, '_chunk_index', 0)
-                chunk.metadata["id"] = f"{source}:{page}:{current_chunk_index}"
-                self._chunk_index = current_chunk_index + 1
+            # För strukturerad data, använd befintligt ID om det finns
+            if chunk.metadata.get("type") != "structured_data" or "id" not in chunk.metadata:
+                chunk.metadata["id"] = chunk_id(chunk.metadata, chunk.page_content)
 
         return chunks
 
-    def get_all_documents(self):
-        return self.db.get() 
\ No newline at end of file
+    @metrics.traced("db.refresh_indexes")
+    def refresh_indexes(self):
+        """Uppdaterar BM25- och metadataindexet och byter korpusversion efter ändringar i databasen.
+
+        Ändringarna sedan förra refresh slås in i de sparade indexen (se update_lexical_index);
+        bara om det inte går, t.ex. första gången, byggs de om från hela vektorlagret.
+        """
+        self.vector_store.compact(force=False)
+        if not self.update_lexical_index():
+            self.rebuild_lexical_index()
+        ann_index = self.ann_index
+        if ann_index is not None:
+            if not ann_index.is_trained:
+                ann_index = self.build_ann_index()
+            # En tom korpus ger ett otränat index; det byggs vid nästa refresh med data
+            if ann_index.is_trained:
+                ann_index.save(self.ann_index_path)
+        self._bump_corpus_version()
+        if ann_index is not None:
+            self._ann_index = (self.corpus_version, ann_index)
+
+    def delete_chunks(self, ids: list[str]):
+        """Tar bort chunks med givna ID:n"""
+        if ids:
+            self.vector_store.delete(ids)
+            self._pending_deletes.update(ids)
+            self._pending_upserts.difference_update(ids)
+            ann_index = self.ann_index
+            if ann_index is not None:
+                ann_index.remove(ids)
+
+    def load_manifest(self) -> dict:
+        """Läser manifestet över inlästa filer: filnamn -> innehållshash och chunk-ID:n"""
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"files": {}}
+
+    def save_manifest(self, manifest: dict):
+        os.makedirs(self.chroma_path, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def sync_file(self, manifest: dict, file: str, content_hash: str, chunks: list[Document]) -> bool:
+        """Upsertar en fils chunks, tar bort dess gamla chunks som inte längre finns och uppdaterar manifestet"""
+        ids = self.add_documents(chunks, update_indexes=False)
+        if ids is None:
+            return False
+        self.finish_file(manifest, file, content_hash, ids)
+        return True
+
+    def finish_file(self, manifest: dict, file: str, content_hash: str, ids: list[str]):
+        """Registrerar en färdigskriven fil i manifestet och tar bort dess inaktuella chunks"""
+        previous = manifest["files"].get(file, {}).get("chunk_ids", [])
+        self.delete_chunks(sorted(set(previous) - set(ids)))
+        manifest["files"][file] = {"hash": content_hash, "chunk_ids": ids}
+
+    def remove_file(self, manifest: dict, file: str):
+        """Tar bort alla chunks för en fil som inte längre finns i datamappen"""
+        entry = manifest["files"].pop(file, None)
+        if entry:
+            self.delete_chunks(entry["chunk_ids"])
+        self.structured_store.delete_source(file)
+
+    @metrics.traced("db.get_all_documents")
+    def get_all_documents(self, where: dict = None):
+        """Alla dokument, eller bara de som matchar filtret (se MetadataIndex)"""
+        if not where:
+            return self.vector_store.get_all()
+        if self.vector_backend == "chroma":
+            return self.vector_store.get_all(where)
+        ids = self.metadata_index.matching_ids(where) if self.metadata_index is not None else []
+        documents, metadatas = self.get_documents_by_ids(ids)
+        return {"ids": [metadata["id"] for metadata in metadatas], "documents": documents, "metadatas": metadatas}
+
+    @property
+    def corpus_version(self) -> str:
+        """Version som ändras varje gång korpusen ändras, används för att ogiltigförklara cacher"""
+        try:
+            with open(self.corpus_version_path) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return "initial"
+
+    def _bump_corpus_version(self):
+        os.makedirs(self.chroma_path, exist_ok=True)
+        with open(self.corpus_version_path, "w") as f:
+            f.write(uuid.uuid4().hex)
+
+    def get_documents_by_ids(self, ids: list[str]):
+        """Hämtar dokument och metadata i samma ordning som ids; ID:n som saknas hoppas över"""
+        if not ids:
+            return [], []
+        with metrics.span("db.get_documents", count=len(ids)):
+            return self.vector_store.get(ids)
+
+    def get_documents_by_id(self, ids: list[str]) -> dict:
+        """id -> (dokument, metadata); ID:n som inte (längre) finns i lagret saknas i svaret.
+
+        Används när träffar med poäng ska paras ihop med sina dokument, eftersom ett
+        index som ligger efter lagret (t.ex. under en inläsning) kan peka på borttagna chunks.
+        """
+        if not ids:
+            return {}
+        with metrics.span("db.get_documents", count=len(ids)):
+            return self.vector_store.get_by_id(ids)
+
+    @property
+    def ann_index(self):
+        """IVF-PQ-indexet när dense_index="ivfpq" (otränat tills refresh_indexes() bygger det), annars None"""
+        if self.dense_index != "ivfpq":
+            return None
+        version = self.corpus_version
+        if self._ann_index is None or self._ann_index[0] != version:
+            self._ann_index = (version, IVFPQIndex.load(self.ann_index_path) or IVFPQIndex())
+        return self._ann_index[1]
+
+    @metrics.traced("db.build_ann_index")
+    def build_ann_index(self, train_size: int = DEFAULT_TRAIN_SIZE, nlist: int = None, m: int = None):
+        """Tränar IVF-PQ-indexet på ett slumpurval av vektorerna och lägger sedan till alla, sida för sida"""
+        started = time.perf_counter()
+        total = self.vector_store.count()
+        index = IVFPQIndex(nlist=nlist, m=m)
+        if total:
+            rng = np.random.default_rng(0)
+            keep = min(1.0, train_size / total)
+            sample = np.concatenate([vectors[rng.random(len(vectors)) < keep]
+                                     for _ids, vectors in self.vector_store.iter_embeddings()])
+            index.train(normalize_rows(sample))
+            for ids, vectors in self.vector_store.iter_embeddings():
+                index.add(ids, vectors)
+            logger.info("✅ Byggde IVF-PQ-index över %d chunks (%d listor, %d byte/vektor, träning på %d) på %.2fs",
+                        len(index), index.nlist, index.m, len(sample), time.perf_counter() - started)
+        self._ann_index = (self.corpus_version, index)
+        return index
+
+    @metrics.traced("db.vector_search")
+    def similarity_search_by_vector(self, query_embedding, k: int, where: dict = None):
+        """Söker bland de lagrade vektorerna och returnerar (dokument, metadata, poäng).
+
+        Poängen är skalärprodukten mellan frågan och de lagrade vektorerna, samma
+        mått som tidigare beräknades genom att bädda in hela korpusen per fråga.
+        Med dense_index="ivfpq" söks i stället IVF-PQ-indexet (se _ann_search).
+        Med ett filter poängsätts bara de chunks som matchar det.
+        """
+        ann_index = self.ann_index
+        if ann_index is None or not ann_index.is_trained:
+            return self.vector_store.search(query_embedding, k, where, self._metadata_index_for(where))
+        hits = self._ann_search(ann_index, query_embedding, k, where)
+        by_id = self.get_documents_by_id([doc_id for doc_id, _score in hits])
+        hits = [(doc_id, score) for doc_id, score in hits if doc_id in by_id]
+        return ([by_id[doc_id][0] for doc_id, _score in hits], [by_id[doc_id][1] for doc_id, _score in hits],
+                [score for _doc_id, score in hits])
+
+    def _metadata_index_for(self, where: dict):
+        """Metadataindexet om filtret behöver det (Chroma tar filtret som where direkt)"""
+        if not where or self.vector_backend == "chroma" and self.dense_index == "exact":
+            return None
+        return self.metadata_index
+
+    def _ann_search(self, ann_index: IVFPQIndex, query_embedding, k: int, where: dict = None):
+        """IVF-PQ-sökning; kortlistan räknas om exakt mot vektorlagret om rerank_factor > 0"""
+        shortlist = k * self.rerank_factor if self.rerank_factor else k
+        allowed = self.filter_mask(where, ann_index.ids) if where else None
+        ids, scores = ann_index.search(query_embedding, shortlist, self.nprobe, allowed)
+        if self.rerank_factor and ids:
+            scores = self.vector_store.get_embeddings(ids) @ np.asarray(query_embedding, dtype=np.float32)
+        order = np.argsort(-np.asarray(scores), kind="stable")[:k]
+        return [(ids[i], float(scores[i])) for i in order]
+
+    @metrics.traced("db.vector_search_many")
+    def similarity_search_many(self, query_matrix: np.ndarray, k: int, where: dict = None):
+        """Top-k (id, poäng) per fråga i query_matrix.
+
+        Memmap-backenden söker direkt i de minnesmappade segmenten; för Chroma
+        används den cachade vektormatrisen. Med ett filter poängsätts bara de
+        kolumner som matchar det.
+        """
+        ann_index = self.ann_index
+        if ann_index is not None and ann_index.is_trained:
+            return [[(doc_id, score) for doc_id, score in self._ann_search(ann_index, query, k, where) if score > 0]
+                    for query in query_matrix]
+        if hasattr(self.vector_store, "search_many"):
+            return [[(doc_id, score) for doc_id, score in hits if score > 0]
+                    for hits in self.vector_store.search_many(query_matrix, k, where, self._metadata_index_for(where))]
+        results = [[] for _ in range(len(query_matrix))]
+        corpus_ids, corpus_matrix = self.get_embedding_matrix()
+        if where:
+            columns = np.flatnonzero(self.filter_mask(where, corpus_ids))
+            corpus_ids, corpus_matrix = [corpus_ids[col] for col in columns], corpus_matrix[columns]
+        if len(corpus_ids):
+            block_size = max(1, MAX_BLOCK_CELLS // len(corpus_ids))
+            for start in range(0, len(query_matrix), block_size):
+                scores = query_matrix[start:start + block_size] @ corpus_matrix.T
+                for offset, hits in enumerate(top_k_rows(scores, k)):
+                    results[start + offset] = [(corpus_ids[col], score) for col, score in hits]
+        return results
+
+    @property
+    def metadata_index(self):
+        """ID-mängder per source/type/sheet/page för filtrerad sökning, cachat per korpusversion"""
+        version = self.corpus_version
+        if self._metadata_index is None or self._metadata_index[0] != version:
+            self._metadata_index = (version, self.load_metadata_index())
+        return self._metadata_index[1]
+
+    def load_metadata_index(self):
+        """Laddar metadataindexet, bygger det (tillsammans med BM25-indexet) om det saknas"""
+        if not os.path.exists(self.metadata_index_path) and self.vector_store.count():
+            self.rebuild_lexical_index()
+        if os.path.exists(self.metadata_index_path):
+            return MetadataIndex.load(self.metadata_index_path)
+        return None
+
+    def filter_mask(self, where: dict, ids) -> np.ndarray:
+        """Bitmask över ids för de chunks som matchar filtret"""
+        index = self.metadata_index
+        if index is None:
+            return np.zeros(len(ids), dtype=bool)
+        return index.mask_for(where, ids)
+
+    def get_embedding_matrix(self):
+        """Returnerar (ids, matris) med alla lagrade vektorer, cachat per korpusversion"""
+        version = self.corpus_version
+        if self._embedding_matrix is None or self._embedding_matrix[0] != version:
+            ids, matrix = self.vector_store.embedding_matrix()
+            self._embedding_matrix = (version, ids, matrix)
+        return self._embedding_matrix[1], self._embedding_matrix[2]
+
+    def _iter_documents(self, page_size: int = 5000, include_metadata: bool = False):
+        """Går igenom samlingens (id, text) sida för sida så att hela korpusen inte laddas på en gång"""
+        return self.vector_store.iter_documents(page_size, include_metadata)
+
+    @metrics.traced("db.build_lexical_index")
+    def rebuild_lexical_index(self):
+        """Bygger om BM25-indexet från dokumenten i vektorlagret och sparar det bredvid databasen.
+
+        Metadataindexet byggs i samma svep och i samma ordning, och sparas före
+        BM25-indexet så att en sökmotor som laddar om vid ny BM25-fil ser båda.
+        """
+        filter_rows = []
+
+        def documents():
+            for doc_id, text, metadata in self._iter_documents(include_metadata=True):
+                filter_rows.append((doc_id, {field: metadata[field] for field in FILTER_FIELDS if field in metadata}))
+                yield doc_id, text
+
+        self._pending_upserts.clear()
+        self._pending_deletes.clear()
+        index = BM25Index.build_from_stream(documents())
+        MetadataIndex.build(filter_rows).save(self.metadata_index_path)
+        self._metadata_index = None
+        index.save(self.lexical_index_path)
+        logger.info("✅ Byggde BM25-index över %d chunks", len(index))
+        return index
+
+    def update_lexical_index(self) -> bool:
+        """Slår in chunks som skrivits eller tagits bort sedan förra refresh i BM25- och metadataindexet.
+
+        Bara de ändrade chunksen läses från vektorlagret och tokeniseras; de befintliga
+        indexen slås ihop med dem som arrayer (se BM25Index.update). Returnerar False när
+        en full ombyggnad behövs: indexen saknas, ändringarna är en stor del av korpusen,
+        eller det uppdaterade indexet inte stämmer med vektorlagret (t.ex. efter skrivningar
+        från en annan process).
+        """
+        if not os.path.exists(self.lexical_index_path) or not os.path.exists(self.metadata_index_path):
+            return False
+        if not self._pending_upserts and not self._pending_deletes:
+            return True
+        index = BM25Index.load(self.lexical_index_path)
+        if len(self._pending_upserts) + len(self._pending_deletes) > INCREMENTAL_MAX_RATIO * len(index):
+            return False
+
+        upserts = sorted(self._pending_upserts)
+        with metrics.span("db.get_documents", count=len(upserts)):
+            by_id = self.vector_store.get_by_id(upserts)
+        added = [(doc_id, by_id[doc_id]) for doc_id in upserts if doc_id in by_id]
+        index = index.update(self._pending_deletes, ((doc_id, text) for doc_id, (text, _meta) in added))
+        if len(index) != self.vector_store.count():
+            logger.info("BM25-indexet stämmer inte med vektorlagret, bygger om det")
+            return False
+        metadata_index = MetadataIndex.load(self.metadata_index_path).update(
+            self._pending_deletes,
+            [(doc_id, {field: meta[field] for field in FILTER_FIELDS if field in meta})
+             for doc_id, (_text, meta) in added],
+        )
+
+        metadata_index.save(self.metadata_index_path)
+        self._metadata_index = None
+        index.save(self.lexical_index_path)
+        logger.info("✅ Uppdaterade BM25-index: %d skrivna och %d borttagna chunks, %d totalt",
+                    len(added), len(self._pending_deletes), len(index))
+        self._pending_upserts.clear()
+        self._pending_deletes.clear()
+        return True
+
+    def load_lexical_index(self):
+        """Laddar BM25-indexet, bygger det om det saknas men databasen har innehåll"""
+        if os.path.exists(self.lexical_index_path):
+            return BM25Index.load(self.lexical_index_path)
+        if self.vector_store.count():
+            return self.rebuild_lexical_index()
+        return None
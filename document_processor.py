@@ -1,110 +1,244 @@
-import nltk
-from transformers import AutoTokenizer
-from langchain.schema.document import Document
-from langchain_community.document_loaders import PyPDFDirectoryLoader
-from nltk.tokenize import PunktSentenceTokenizer
+from langchain_core.documents import Document
 from structured_data_processor import StructuredDataProcessor
+import metrics
 import os
-from typing import List
-from langchain.document_loaders import CSVLoader, UnstructuredExcelLoader
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.xlsx', '.xls', '.csv')
+# Större PDF:er delas upp i sidintervall om så här många sidor i parallellt läge
+PDF_PAGES_PER_TASK = 16
+
+
+def file_hash(path: str) -> str:
+    """SHA-256 av filens innehåll, används i ingest-manifestet"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# DocumentProcessor som skapas en gång per arbetsprocess i parallellt läge
+_worker_processor = None
+
+
+def _init_worker(data_path: str, structured_store_path: Optional[str]):
+    global _worker_processor
+    # Arbetsprocesserna skriver bara JSON-loggen; Prometheus-filen är huvudprocessens
+    metrics.METRICS.configure(metrics.enabled(), metrics.METRICS.log_path)
+    _worker_processor = DocumentProcessor(data_path, structured_store_path=structured_store_path)
+
+
+def _load_file_records(file: str, pages: Optional[Tuple[int, int]] = None):
+    """Körs i en arbetsprocess: laddar och chunkar en fil (eller PDF-sidorna [start, stop)) och
+    returnerar kompakta (text, metadata)-poster"""
+    try:
+        chunks = _worker_processor.load_file(file) if pages is None else _worker_processor.load_pdf_pages(file, *pages)
+        return file, [(chunk.page_content, chunk.metadata) for chunk in chunks], None
+    except Exception as e:
+        return file, [], str(e)
+
 
 class DocumentProcessor:
-    def __init__(self, data_path):
+    def __init__(self, data_path, workers: int = 1, structured_store_path: Optional[str] = None):
         self.data_path = data_path
-        self.structured_processor = StructuredDataProcessor()
-        
-        # Använder en flerspråkig modell som stödjer både svenska och engelska
-        self.tokenizer = AutoTokenizer.from_pretrained("KBLab/sentence-bert-swedish-cased")
-        
-        # Ladda ner punkt-tokenizer data
-        nltk.download('punkt', quiet=True)
-        
-        # Skapa en generell sentence splitter
-        self.sentence_splitter = PunktSentenceTokenizer()
+        self.workers = workers
+        self.structured_store_path = structured_store_path
+        # Sheets i en arbetsbok kan läsas parallellt med samma antal processer
+        self.structured_processor = StructuredDataProcessor(sheet_workers=workers,
+                                                            table_store_path=structured_store_path)
+        self._sentence_splitter = None
+
+    @property
+    def sentence_splitter(self):
+        """Generell sentence splitter som skapas vid första användningen.
+
+        En otränad PunktSentenceTokenizer behöver ingen nedladdad punkt-data,
+        så NLTK importeras först när en PDF ska chunkas.
+        """
+        if self._sentence_splitter is None:
+            from nltk.tokenize import PunktSentenceTokenizer
+            self._sentence_splitter = PunktSentenceTokenizer()
+        return self._sentence_splitter
 
-    def load_documents(self):
+    def list_files(self) -> List[str]:
+        """Listar filerna i datamappen som kan laddas, i sorterad ordning"""
+        return sorted(f for f in os.listdir(self.data_path) if f.endswith(SUPPORTED_EXTENSIONS))
+
+    def load_documents(self, files: Optional[List[str]] = None):
         documents = []
         
         print("\n=== 📂 Laddar dokument ===")
         
-        # Ladda PDF-filer
-        pdf_files = [f for f in os.listdir(self.data_path) if f.endswith('.pdf')]
-        if pdf_files:
-            print(f"\n📄 Hittade {len(pdf_files)} PDF-filer")
-            pdf_loader = PyPDFDirectoryLoader(self.data_path)
-            try:
-                pdf_docs = pdf_loader.load()
-                print(f"   Laddade {len(pdf_docs)} PDF-dokument")
-                
-                pdf_chunks = []
-                for doc in pdf_docs:
-                    try:
-                        chunks = self._split_text_document(doc)
-                        pdf_chunks.extend(chunks)
-                    except Exception as e:
-                        print(f"   ⚠️ Fel vid chunkning av PDF: {str(e)}")
-                
-                print(f"   Skapade {len(pdf_chunks)} chunks från PDF-filer")
-                documents.extend(pdf_chunks)
-                
-            except Exception as e:
-                print(f"❌ Fel vid laddning av PDF-filer: {str(e)}")
+        for _file, chunks in self.iter_files(files):
+            documents.extend(chunks)
         
-        # Ladda Excel-filer
-        excel_files = [f for f in os.listdir(self.data_path) if f.endswith(('.xlsx', '.xls'))]
-        if excel_files:
-            print(f"\n📊 Hittade {len(excel_files)} Excel-filer")
-            for file in excel_files:
-                file_path = os.path.join(self.data_path, file)
-                print(f"\nBearbetar: {file}")
-                
-                try:
-                    # Använd UnstructuredExcelLoader utan elements mode för att få ren text
-                    excel_loader = UnstructuredExcelLoader(file_path)  # Ta bort mode="elements"
-                    excel_docs = excel_loader.load()
-                    
-                    # Lägg till metadata
-                    for doc in excel_docs:
-                        doc.metadata.update({
-                            "source": file,
-                            "type": "structured_data"
-                        })
-                    
-                    print(f"   Laddade {len(excel_docs)} element från Excel-fil")
-                    documents.extend(excel_docs)
-                    
-                except Exception as e:
-                    print(f"❌ Fel vid laddning av Excel-fil {file}: {str(e)}")
+        print(f"\n✅ Totalt laddade dokument: {len(documents)}")
         
-        # Ladda CSV-filer
-        csv_files = [f for f in os.listdir(self.data_path) if f.endswith('.csv')]
-        if csv_files:
-            print(f"\n📑 Hittade {len(csv_files)} CSV-filer")
-            for file in csv_files:
-                file_path = os.path.join(self.data_path, file)
+        return documents
+
+    def iter_files(self, files: Optional[List[str]] = None,
+                   lazy: bool = False) -> Iterator[Tuple[str, Iterable[Document]]]:
+        """Laddar och chunkar filer och returnerar (fil, chunks) i samma ordning som files.
+
+        Med workers > 1 fördelas filerna över en processpool, och PDF:er med fler än
+        PDF_PAGES_PER_TASK sidor delas upp i sidintervall som bearbetas var för sig och
+        sätts ihop i sidordning. Ett fel i en fil påverkar bara den filen. Med lazy=True
+        och seriell bearbetning är chunks en generator (se iter_file) så att stora filer
+        aldrig ligger helt i minnet.
+        """
+        files = self.list_files() if files is None else list(files)
+        if self.workers <= 1 or len(files) <= 1:
+            for file in files:
                 print(f"\nBearbetar: {file}")
-                
-                try:
-                    # Använd LangChains CSVLoader
-                    csv_loader = CSVLoader(file_path)
-                    csv_docs = csv_loader.load()
-                    
-                    # Lägg till metadata
-                    for doc in csv_docs:
-                        doc.metadata.update({
-                            "source": file,
-                            "type": "structured_data"
-                        })
-                    
-                    print(f"   Laddade {len(csv_docs)} rader från CSV-fil")
-                    documents.extend(csv_docs)
-                    
-                except Exception as e:
-                    print(f"❌ Fel vid laddning av CSV-fil {file}: {str(e)}")
+                yield file, self.iter_file(file) if lazy else self.load_file(file)
+            return
         
-        print(f"\n✅ Totalt laddade dokument: {len(documents)}")
+        print(f"\n⚙️ Bearbetar {len(files)} filer med {self.workers} processer")
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.data_path, self.structured_store_path)) as executor:
+            # Håll högst två uppgifter per process i luften så att minnet inte växer med antalet filer
+            pending = deque()
+            tasks = self._tasks(files)
+            for file, pages, last in islice(tasks, 2 * self.workers):
+                pending.append((last, executor.submit(_load_file_records, file, pages)))
+            file_records, errors = [], []
+            while pending:
+                last, future = pending.popleft()
+                file, records, error = future.result()
+                for next_file, pages, next_last in islice(tasks, 1):
+                    pending.append((next_last, executor.submit(_load_file_records, next_file, pages)))
+                file_records.extend(records)
+                if error:
+                    errors.append(error)
+                if not last:
+                    continue
+                if errors:
+                    # Ett fel i ett sidintervall gäller hela filen, hellre än att läsa in den till hälften
+                    print(f"❌ Fel vid bearbetning av {file}: {'; '.join(errors)}")
+                    file_records = []
+                yield file, [Document(page_content=content, metadata=metadata) for content, metadata in file_records]
+                file_records, errors = [], []
+
+    def _tasks(self, files: List[str]) -> Iterator[Tuple[str, Optional[Tuple[int, int]], bool]]:
+        """Uppgifterna för processpoolen som (fil, sidintervall eller None, om det är filens sista uppgift)"""
+        for file in files:
+            ranges = self._pdf_page_ranges(file) if file.endswith('.pdf') else []
+            if len(ranges) <= 1:
+                yield file, None, True
+                continue
+            for i, pages in enumerate(ranges):
+                yield file, pages, i == len(ranges) - 1
+
+    def _pdf_page_ranges(self, file: str) -> List[Tuple[int, int]]:
+        """Sidintervall [start, stop) om PDF_PAGES_PER_TASK sidor; bara sidräkningen läses här"""
+        from pypdf import PdfReader
+
+        try:
+            page_count = len(PdfReader(os.path.join(self.data_path, file)).pages)
+        except Exception:
+            # Filen laddas då som en uppgift och felet rapporteras därifrån
+            return []
+        return [(start, min(start + PDF_PAGES_PER_TASK, page_count))
+                for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+
+    def load_file(self, file: str) -> List[Document]:
+        """Laddar och chunkar en enskild fil i datamappen"""
+        try:
+            return list(self.iter_file(file))
+        except Exception:
+            # Felet har redan skrivits ut av respektive laddare
+            return []
+
+    def iter_file(self, file: str) -> Iterator[Document]:
+        """Strömmar chunks från en fil; fel i Excel- och CSV-filer skickas vidare till anroparen.
+
+        Tiden för laddning och chunkning mäts som steget docs.load_file, utan konsumentens tid.
+        """
+        return metrics.timed_iter("docs.load_file", self._iter_file(file), file=file)
+
+    def _iter_file(self, file: str) -> Iterator[Document]:
+        file_path = os.path.join(self.data_path, file)
+        if file.endswith('.pdf'):
+            yield from self._load_pdf(file, file_path)
+        elif file.endswith(('.xlsx', '.xls')):
+            self._reset_tables(file)
+            yield from self._iter_excel(file, file_path)
+        elif file.endswith('.csv'):
+            self._reset_tables(file)
+            yield from self._iter_csv(file, file_path)
+        else:
+            print(f"⚠️ Filtypen stöds inte: {file}")
+
+    def _reset_tables(self, file: str):
+        """Tar bort filens gamla rader i tabellagret innan den läses in på nytt"""
+        if self.structured_processor.table_store is not None:
+            self.structured_processor.table_store.delete_source(file)
+
+    def load_pdf_pages(self, file: str, start: int, stop: int) -> List[Document]:
+        """Laddar och chunkar sidorna [start, stop) i en PDF i datamappen"""
+        return self._load_pdf(file, os.path.join(self.data_path, file), start, stop)
+
+    @staticmethod
+    def _read_pdf_pages(file: str, file_path: str, start: int = 0, stop: Optional[int] = None) -> List[Document]:
+        """En Document per sida med samma text och sidmetadata som PyPDFLoader, men source är filnamnet
+        (som för CSV/Excel, så att filter source=fil.pdf matchar) och bara de begärda sidorna extraheras"""
+        from pypdf import PdfReader
+
+        reader = PdfReader(file_path)
+        total_pages = len(reader.pages)
+        stop = total_pages if stop is None else min(stop, total_pages)
+        return [Document(page_content=reader.pages[page].extract_text().strip(),
+                         metadata={"source": file, "total_pages": total_pages, "page": page,
+                                   "page_label": reader.page_labels[page]})
+                for page in range(start, stop)]
+
+    def _load_pdf(self, file: str, file_path: str, start: int = 0, stop: Optional[int] = None) -> List[Document]:
+        try:
+            pdf_docs = self._read_pdf_pages(file, file_path, start, stop)
+            print(f"   Laddade {len(pdf_docs)} PDF-sidor")
+        except Exception as e:
+            print(f"❌ Fel vid laddning av PDF-fil {file_path}: {str(e)}")
+            return []
         
-        return documents
+        pdf_chunks = []
+        for doc in pdf_docs:
+            try:
+                chunks = self._split_text_document(doc)
+                pdf_chunks.extend(chunks)
+            except Exception as e:
+                print(f"   ⚠️ Fel vid chunkning av PDF: {str(e)}")
+        
+        print(f"   Skapade {len(pdf_chunks)} chunks från PDF-filen")
+        return pdf_chunks
+
+    def _iter_excel(self, file: str, file_path: str) -> Iterator[Document]:
+        count = 0
+        try:
+            # Arbetsboken läses sheet för sheet i radblock i read-only-läge
+            for doc in self.structured_processor.excel_to_documents(file_path, source=file):
+                count += 1
+                yield doc
+        except Exception as e:
+            print(f"❌ Fel vid laddning av Excel-fil {file}: {str(e)}")
+            raise
+        print(f"   Skapade {count} chunks från Excel-fil")
+
+    def _iter_csv(self, file: str, file_path: str) -> Iterator[Document]:
+        count = 0
+        try:
+            # Strömma CSV-filen i block genom StructuredDataProcessor
+            for doc in self.structured_processor.csv_to_documents(file_path, source=file):
+                count += 1
+                yield doc
+        except Exception as e:
+            print(f"❌ Fel vid laddning av CSV-fil {file}: {str(e)}")
+            raise
+        print(f"   Skapade {count} chunks från CSV-fil")
 
     def _split_text_document(self, doc: Document) -> List[Document]:
         """Dela upp ett textdokument i chunks"""
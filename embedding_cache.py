@@ -0,0 +1,146 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import metrics
+
+EMBEDDING_CACHE_PATH = os.path.join("cache", "embeddings.sqlite3")
+
+# SQLite tillåter ett begränsat antal parametrar per fråga
+_LOOKUP_BATCH = 500
+
+
+def text_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class CachedEmbeddings(Embeddings):
+    """Innehållsadresserad diskcache framför en embeddingmodell.
+
+    Vektorerna lagras som float32 i SQLite, nycklade på (modellnyckel, SHA-256 av
+    texten), så identisk text bäddas aldrig in två gånger - inte heller efter
+    --reset eller en ny chunkning. I en batch skickas bara missarna till modellen.
+    Även nyinbäddade vektorer returneras som float32 så att resultatet är
+    detsamma oavsett om det kom från cachen eller modellen.
+    """
+
+    def __init__(self, embeddings: Embeddings, path: str = EMBEDDING_CACHE_PATH):
+        self.embeddings = embeddings
+        self.path = path
+        # Backend och inställningar som ändrar vektorerna ingår i nyckeln (se LazyEmbeddings.cache_key)
+        self.model_key = getattr(embeddings, "cache_key", None) or getattr(embeddings, "model_name", "default")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Databasen öppnas (och skapas) först vid första inbäddningen, inte när cachen skapas
+        self._conn = None
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.embeddings, "model_name", self.model_key)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Öppnar SQLite-databasen vid första anropet; anroparen håller _lock"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, hash BLOB NOT NULL, vector BLOB NOT NULL, PRIMARY KEY (model, hash))"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _lookup(self, hashes: List[bytes]) -> Dict[bytes, List[float]]:
+        found = {}
+        for start in range(0, len(hashes), _LOOKUP_BATCH):
+            batch = hashes[start:start + _LOOKUP_BATCH]
+            placeholders = ", ".join("?" for _ in batch)
+            rows = self._connection().execute(
+                f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                [self.model_key, *batch],
+            )
+            for digest, vector in rows:
+                found[digest] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return found
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        with self._lock:
+            found = self._lookup(sorted(set(hashes)))
+
+        # Unika missar bäddas in i ett anrop
+        missing = {}
+        for digest, text in zip(hashes, texts):
+            if digest not in found:
+                missing.setdefault(digest, text)
+        if missing:
+            with metrics.span("embed.model", count=len(missing)):
+                vectors = np.asarray(self.embeddings.embed_documents(list(missing.values())), dtype=np.float32)
+            with self._lock:
+                conn = self._connection()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                    [(self.model_key, digest, vector.tobytes()) for digest, vector in zip(missing, vectors)],
+                )
+                conn.commit()
+            found.update((digest, vector.tolist()) for digest, vector in zip(missing, vectors))
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        metrics.count("cache_hits", len(texts) - len(missing), cache="embedding_store")
+        metrics.count("cache_misses", len(missing), cache="embedding_store")
+        return [found[digest] for digest in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Frågor får en egen nyckel eftersom vissa modeller bäddar in frågor och dokument olika
+        digest = text_hash("query:" + text)
+        with self._lock:
+            found = self._lookup([digest])
+        if digest in found:
+            with self._lock:
+                self.hits += 1
+            metrics.count("cache_hits", cache="embedding_store")
+            return found[digest]
+        metrics.count("cache_misses", cache="embedding_store")
+        with metrics.span("embed.model", count=1):
+            vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                (self.model_key, digest, vector.tobytes()),
+            )
+            conn.commit()
+            self.misses += 1
+        return vector.tolist()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        with self._lock:
+            if self._conn is None and not os.path.exists(self.path):
+                size = 0
+            else:
+                size = self._connection().execute(
+                    "SELECT COUNT(*) FROM embeddings WHERE model = ?", (self.model_key,)
+                ).fetchone()[0]
+        return {
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,306 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+import metrics
+from benchmark_suite import latency_summary
+from context_builder import ContextAssembler, reciprocal_rank_fusion
+from llm_client import LLMClient
+from metadata_index import value_key
+
+QUESTIONS_PATH = "eval_questions.jsonl"
+JUDGE_CACHE_PATH = os.path.join("cache", "judge_verdicts.sqlite3")
+DEFAULT_K = (1, 3, 6)
+
+EVAL_PROMPT = """
+Expected Response: {expected_response}
+Actual Response: {actual_response}
+---
+(Answer with 'true' or 'false') Does the actual response match the expected response?
+"""
+
+
+def load_questions(path: str = QUESTIONS_PATH) -> List[dict]:
+    """Läser frågor från JSON lines (en fråga per rad) eller en JSON-lista.
+
+    Varje fråga har "question" och valfritt "expected" (förväntat svar för domaren),
+    "relevant" (chunks som borde hittas, se chunk_matches) och "where" (metadatafilter).
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        questions = json.loads(text)
+    else:
+        questions = [json.loads(line) for line in text.splitlines() if line.strip() and not line.startswith("#")]
+    for i, question in enumerate(questions):
+        if "question" not in question:
+            raise ValueError(f"Fråga {i + 1} i {path} saknar fältet 'question'")
+        question.setdefault("id", str(i + 1))
+    return questions
+
+
+def chunk_matches(spec: str, metadata: dict) -> bool:
+    """Om en chunk matchar en relevansangivelse.
+
+    spec kan vara ett fullständigt chunk-ID, ett filnamn ("monopoly.pdf") eller
+    filnamn och sida/blad ("monopoly.pdf:2", "priser.xlsx:Gator").
+    """
+    doc_id = str(metadata.get("id", ""))
+    source = os.path.basename(str(metadata.get("source", "")))
+    location = metadata.get("sheet") if metadata.get("type") == "structured_data" else metadata.get("page")
+    return (spec in (doc_id, source, f"{source}:{value_key(location)}")
+            or doc_id.startswith(spec + ":"))
+
+
+def retrieval_metrics(ranked_metadatas: Sequence[dict], relevant: Sequence[str], ks: Sequence[int]) -> dict:
+    """recall@k (andel relevanta angivelser som hittas bland de k första) och reciprocal rank"""
+    first_hit = {}
+    for rank, metadata in enumerate(ranked_metadatas, 1):
+        for spec in relevant:
+            if spec not in first_hit and chunk_matches(spec, metadata):
+                first_hit[spec] = rank
+    result = {f"recall@{k}": sum(rank <= k for rank in first_hit.values()) / len(relevant) for k in ks}
+    result["reciprocal_rank"] = 1.0 / min(first_hit.values()) if first_hit else 0.0
+    return result
+
+
+def parse_verdict(text: str) -> Optional[bool]:
+    text = text.strip().lower()
+    if "true" in text:
+        return True
+    if "false" in text:
+        return False
+    return None
+
+
+class JudgeCache:
+    """Domarens utlåtanden i SQLite, nycklade på hash av (modell, prompt, förväntat, faktiskt svar).
+
+    Ett svar som inte har ändrats sedan förra körningen bedöms därför aldrig igen.
+    """
+
+    def __init__(self, path: str = JUDGE_CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS verdicts (key BLOB PRIMARY KEY, verdict TEXT NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(model: str, expected: str, actual: str) -> bytes:
+        digest = hashlib.sha256()
+        for part in (model, EVAL_PROMPT, expected, actual):
+            digest.update(hashlib.sha256(part.encode("utf-8")).digest())
+        return digest.digest()
+
+    def get(self, key: bytes) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT verdict FROM verdicts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: bytes, verdict: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO verdicts (key, verdict) VALUES (?, ?)", (key, verdict))
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class Judge:
+    """Språkmodell som avgör om ett svar stämmer med det förväntade, med cachade utlåtanden"""
+
+    def __init__(self, llm_client: LLMClient, cache: Optional[JudgeCache] = None):
+        self.llm_client = llm_client
+        self.cache = cache
+
+    def __call__(self, expected: str, actual: str) -> Optional[bool]:
+        """True/False, eller None om domarens svar inte gick att tolka"""
+        key = JudgeCache.key(self.llm_client.model_name, expected, actual) if self.cache else None
+        verdict = self.cache.get(key) if self.cache else None
+        if verdict is None:
+            prompt = EVAL_PROMPT.format(expected_response=expected, actual_response=actual)
+            verdict = self.llm_client.complete(prompt, temperature=0)
+            if self.cache and parse_verdict(verdict) is not None:
+                self.cache.put(key, verdict)
+        return parse_verdict(verdict)
+
+
+class Evaluator:
+    """Kör frågorna parallellt: sökning, svar och bedömning per fråga.
+
+    Sökningen mäts alltid och ger recall@k och MRR utan någon språkmodell;
+    svar genereras bara om generate=True och bedöms bara om en domare finns.
+    Högst workers frågor körs samtidigt och alla delar sökmotorns trådpool,
+    cacher och LLM-anslutning.
+    """
+
+    def __init__(self, search_engine, judge: Optional[Judge] = None, ks: Sequence[int] = DEFAULT_K,
+                 workers: int = 4, generate: bool = True, token_budget: int = 1500):
+        self.search_engine = search_engine
+        self.judge = judge
+        self.ks = sorted(set(ks))
+        self.workers = max(1, workers)
+        self.generate = generate
+        self.context_assembler = ContextAssembler(token_budget=token_budget)
+
+    @metrics.traced("eval.question")
+    def evaluate_question(self, case: dict) -> dict:
+        """Sökning, svar och bedömning för en fråga, med tid per steg"""
+        result = {"id": case["id"], "question": case["question"]}
+        started = time.perf_counter()
+
+        # Sökningen körs alltid så att retrieval-måtten finns även för tabellfrågor
+        bm25_results, sim_results = self.search_engine.search_legs(
+            case["question"], top_k_each=max(self.ks), where=case.get("where")
+        )
+        ranked = reciprocal_rank_fusion([bm25_results, sim_results])
+        result["retrieval_seconds"] = time.perf_counter() - started
+        result["retrieved"] = [doc["metadata"].get("id") for doc, _score in ranked[:max(self.ks)]]
+        if case.get("relevant"):
+            result.update(retrieval_metrics([doc["metadata"] for doc, _score in ranked],
+                                            case["relevant"], self.ks))
+
+        if self.generate:
+            started = time.perf_counter()
+            structured = self.search_engine.answer_structured(case["question"])
+            if structured:
+                answer = structured["answer"]
+            else:
+                context_text, _results = self.context_assembler.assemble([bm25_results, sim_results])
+                answer = self.search_engine.generate_chat_response(case["question"], context_text, "")
+            result["answer"] = answer
+            result["generation_seconds"] = time.perf_counter() - started
+
+            if self.judge is not None and case.get("expected"):
+                started = time.perf_counter()
+                result["correct"] = self.judge(case["expected"], answer)
+                result["judge_seconds"] = time.perf_counter() - started
+
+        result["total_seconds"] = sum(result.get(f"{stage}_seconds", 0.0)
+                                      for stage in ("retrieval", "generation", "judge"))
+        return result
+
+    def run(self, questions: List[dict]) -> dict:
+        """Utvärderar alla frågor och returnerar {"questions": [...], "summary": {...}}"""
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="eval") as executor:
+            results = list(executor.map(self.evaluate_question, questions))
+        return {"questions": results, "summary": self.summarize(results, time.perf_counter() - started)}
+
+    def summarize(self, results: List[dict], wall_seconds: float) -> dict:
+        summary = {"questions": len(results), "wall_seconds": wall_seconds}
+        with_relevance = [r for r in results if "reciprocal_rank" in r]
+        if with_relevance:
+            for k in self.ks:
+                summary[f"recall@{k}"] = float(np.mean([r[f"recall@{k}"] for r in with_relevance]))
+            summary["mrr"] = float(np.mean([r["reciprocal_rank"] for r in with_relevance]))
+        judged = [r["correct"] for r in results if "correct" in r]
+        if judged:
+            summary["judged"] = len(judged)
+            summary["accuracy"] = sum(v is True for v in judged) / len(judged)
+            summary["invalid_verdicts"] = sum(v is None for v in judged)
+        if self.judge is not None and self.judge.cache is not None:
+            summary["judge_cache"] = {"hits": self.judge.cache.hits, "misses": self.judge.cache.misses}
+        for stage in ("retrieval", "generation", "judge", "total"):
+            seconds = [r[f"{stage}_seconds"] for r in results if f"{stage}_seconds" in r]
+            if seconds:
+                summary[f"{stage}_latency"] = latency_summary(seconds)
+        return summary
+
+
+def stub_responder(prompt: str) -> str:
+    """Svar för stub-servern: domarfrågor bedöms med textjämförelse, övriga besvaras med kontextens början"""
+    match = re.search(r"Expected Response: (.*)\nActual Response: (.*)\n---", prompt, re.S)
+    if match:
+        expected, actual = (" ".join(part.lower().split()) for part in match.groups())
+        return "true" if expected in actual else "false"
+    match = re.search(r"Kontext:\n(.*?)\n\nAnvändare:", prompt, re.S)
+    return match.group(1).strip()[:200] if match else "Jag hittar ingen information om detta i kontexten"
+
+
+def print_report(report: dict):
+    for result in report["questions"]:
+        verdict = {True: "✅", False: "❌", None: "❓"}[result["correct"]] if "correct" in result else "  "
+        rr = f"RR {result['reciprocal_rank']:.2f}" if "reciprocal_rank" in result else "RR  -  "
+        print(f"{verdict} {result['id']:>4} {rr}  {result['total_seconds'] * 1000:8.1f} ms  {result['question'][:70]}")
+
+    summary = report["summary"]
+    print(f"\n=== 📊 {summary['questions']} frågor på {summary['wall_seconds']:.1f}s ===")
+    if "mrr" in summary:
+        recalls = "  ".join(f"{key} {value:.2f}" for key, value in summary.items() if key.startswith("recall@"))
+        print(f"{recalls}  MRR {summary['mrr']:.3f}")
+    if "accuracy" in summary:
+        print(f"Rätt enligt domaren: {summary['accuracy']:.0%} av {summary['judged']} "
+              f"({summary['invalid_verdicts']} otolkbara)")
+    if "judge_cache" in summary:
+        print(f"Domar-cache: {summary['judge_cache']['hits']} träffar, {summary['judge_cache']['misses']} missar")
+    for stage in ("retrieval", "generation", "judge", "total"):
+        if f"{stage}_latency" in summary:
+            latency = summary[f"{stage}_latency"]
+            print(f"{stage:10} p50 {latency['p50_ms']:8.1f} ms  p95 {latency['p95_ms']:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Utvärderar sökning och svar för en fil med frågor")
+    parser.add_argument("questions", nargs="?", default=QUESTIONS_PATH, help="Frågefil (JSON lines eller JSON-lista).")
+    parser.add_argument("--workers", type=int, default=4, help="Antal frågor som körs samtidigt.")
+    parser.add_argument("--k", nargs="+", type=int, default=list(DEFAULT_K), help="k-värden för recall@k.")
+    parser.add_argument("--retrieval-only", action="store_true",
+                        help="Mät bara sökningen (recall@k, MRR, latens); ingen språkmodell behövs.")
+    parser.add_argument("--no-judge", action="store_true", help="Generera svar men bedöm dem inte.")
+    parser.add_argument("--llm-url", default=None, help="Bas-URL till språkmodellen (standard: LLMClient).")
+    parser.add_argument("--stub", action="store_true",
+                        help="Kör mot en lokal stub-server i stället för en riktig språkmodell.")
+    parser.add_argument("--judge-cache", default=JUDGE_CACHE_PATH, help="SQLite-fil för domarens utlåtanden.")
+    parser.add_argument("--output", default=None, help="JSON-fil för resultatet.")
+    args = parser.parse_args()
+
+    from database_manager import DatabaseManager
+    from query_data import CHROMA_PATH, create_search_engine
+    from stub_llm_server import StubCompletionServer
+
+    questions = load_questions(args.questions)
+    with StubCompletionServer(stub_responder) if args.stub else contextlib.nullcontext() as server:
+        llm_client = LLMClient(base_url=server.base_url) if server else (
+            LLMClient(base_url=args.llm_url) if args.llm_url else LLMClient())
+        search_engine = create_search_engine(DatabaseManager(CHROMA_PATH), llm_client=llm_client)
+        judge_cache = None if args.retrieval_only or args.no_judge else JudgeCache(args.judge_cache)
+        judge = Judge(llm_client, judge_cache) if judge_cache else None
+        try:
+            evaluator = Evaluator(search_engine, judge, ks=args.k, workers=args.workers,
+                                  generate=not args.retrieval_only)
+            report = evaluator.run(questions)
+        finally:
+            search_engine.close()
+            if judge_cache:
+                judge_cache.close()
+
+    print_report(report)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Resultat sparat i {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,168 @@
 from dotenv import load_dotenv
-from langchain_huggingface import HuggingFaceEmbeddings
+import importlib.util
+from langchain_core.embeddings import Embeddings
 import os
+import threading
+from typing import Optional
+from embedding_cache import CachedEmbeddings, EMBEDDING_CACHE_PATH
+from runtime_config import configure_runtime, model_cache_dir, offline_mode
 
 load_dotenv()
+configure_runtime()
 
-def get_embedding_function():
-    # Använder en modell tränad för dot product similarity
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/multi-qa-MiniLM-L6-cos-v1"
-    )
-    return embeddings
+# Använder en modell tränad för dot product similarity
+EMBEDDING_MODEL = "sentence-transformers/multi-qa-MiniLM-L6-cos-v1"
+
+# torch = PyTorch-modellen, onnx = exporterad ONNX Runtime-modell, onnx-int8 = dynamiskt int8-kvantiserad ONNX
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_BATCH_SIZE = 32
+# Instruktionsuppsättning som den kvantiserade modellen optimeras för (arm64, avx2, avx512, avx512_vnni)
+DEFAULT_QUANTIZATION = "avx2"
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def _check_onnx_dependencies(backend: str):
+    """ONNX-backendarna kräver optimum och onnxruntime, som inte följer med sentence-transformers"""
+    missing = [name for name in ("optimum", "onnxruntime") if importlib.util.find_spec(name) is None]
+    if missing:
+        raise ImportError(
+            f"Embedding-backend '{backend}' kräver paketet optimum[onnxruntime] (saknas: {', '.join(missing)}). "
+            f"Installera med: pip install \"optimum[onnxruntime]\", eller använd RAG_EMBEDDING_BACKEND=torch"
+        )
+
+
+class LazyEmbeddings(Embeddings):
+    """Embeddings som laddar modellen först vid första inbäddningen.
+
+    Att importera langchain_huggingface/torch och läsa in modellen tar flera
+    sekunder, så det görs inte förrän något faktiskt ska bäddas in. Backend,
+    batchstorlek, antal trådar och max sekvenslängd väljs vid skapandet.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, backend: str = "torch",
+                 batch_size: int = DEFAULT_BATCH_SIZE, threads: Optional[int] = None,
+                 max_seq_length: Optional[int] = None, quantization: str = DEFAULT_QUANTIZATION):
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Okänd embedding-backend '{backend}', välj en av: {', '.join(EMBEDDING_BACKENDS)}")
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.threads = threads
+        self.max_seq_length = max_seq_length
+        self.quantization = quantization
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache_key(self) -> str:
+        """Nyckel för embedding-cachen; allt som ändrar vektorerna ingår (men inte batchstorlek och trådar)"""
+        key = self.model_name
+        if self.backend == "onnx":
+            key += "|onnx"
+        elif self.backend == "onnx-int8":
+            key += f"|onnx-int8-{self.quantization}"
+        if self.max_seq_length:
+            key += f"|seq{self.max_seq_length}"
+        return key
+
+    def _get_model(self) -> Embeddings:
+        with self._lock:
+            if self._model is None:
+                try:
+                    self._model = self._load_model()
+                except OSError as e:
+                    if offline_mode():
+                        raise OSError(
+                            f"Modellen {self.model_name} finns inte i den lokala cachen och RAG_OFFLINE är satt. "
+                            f"Ladda ner den en gång med nätverk (RAG_MODEL_CACHE={model_cache_dir() or 'standard'})"
+                        ) from e
+                    raise
+            return self._model
+
+    def _load_model(self) -> Embeddings:
+        if self.backend != "torch":
+            _check_onnx_dependencies(self.backend)
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        cache_folder = os.environ.get("SENTENCE_TRANSFORMERS_HOME") if model_cache_dir() else None
+        model_name = self.model_name
+        model_kwargs = {"backend": "torch" if self.backend == "torch" else "onnx"}
+
+        if self.backend == "torch":
+            if self.threads:
+                import torch
+                torch.set_num_threads(self.threads)
+        else:
+            ort_kwargs = {"provider": "CPUExecutionProvider"}
+            if self.threads:
+                import onnxruntime
+                session_options = onnxruntime.SessionOptions()
+                session_options.intra_op_num_threads = self.threads
+                ort_kwargs["session_options"] = session_options
+            if self.backend == "onnx-int8":
+                model_name, ort_kwargs["file_name"] = self._quantized_model(cache_folder)
+            model_kwargs["model_kwargs"] = ort_kwargs
+
+        embeddings = HuggingFaceEmbeddings(
+            model_name=model_name,
+            cache_folder=cache_folder,
+            model_kwargs=model_kwargs,
+            encode_kwargs={"batch_size": self.batch_size},
+        )
+        if self.max_seq_length:
+            # Kortare sekvenser ger snabbare inbäddning men trunkerar långa chunks
+            embeddings._client.max_seq_length = self.max_seq_length
+        return embeddings
+
+    def _quantized_model(self, cache_folder: Optional[str]):
+        """Returnerar (lokal modellkatalog, filnamn) för den int8-kvantiserade modellen och exporterar den vid behov.
+
+        Exporten görs en gång från ONNX-modellen och sparas lokalt, så den fungerar
+        även offline så länge grundmodellen finns i cachen.
+        """
+        from sentence_transformers import SentenceTransformer
+        from sentence_transformers.backend import export_dynamic_quantized_onnx_model
+
+        path = os.path.join(model_cache_dir() or "models", "onnx-int8", self.model_name.replace("/", "__"))
+        file_name = f"onnx/model_qint8_{self.quantization}.onnx"
+        if not os.path.exists(os.path.join(path, file_name)):
+            print(f"⚙️ Kvantiserar {self.model_name} till int8 ({self.quantization}), sparas i {path}")
+            model = SentenceTransformer(self.model_name, backend="onnx", cache_folder=cache_folder,
+                                        model_kwargs={"provider": "CPUExecutionProvider"})
+            model.save(path)
+            export_dynamic_quantized_onnx_model(model, self.quantization, path)
+        return path, file_name
+
+    def embed_documents(self, texts):
+        return self._get_model().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self._get_model().embed_query(text)
+
+
+def embedding_model_from_env(**overrides) -> LazyEmbeddings:
+    """Skapar modellen med inställningar från RAG_EMBEDDING_BACKEND, _BATCH_SIZE, _THREADS,
+    _MAX_SEQ_LENGTH och _QUANTIZATION; argument som inte är None går före miljövariablerna"""
+    settings = {
+        "backend": os.environ.get("RAG_EMBEDDING_BACKEND", "torch"),
+        "batch_size": _env_int("RAG_EMBEDDING_BATCH_SIZE") or DEFAULT_BATCH_SIZE,
+        "threads": _env_int("RAG_EMBEDDING_THREADS"),
+        "max_seq_length": _env_int("RAG_EMBEDDING_MAX_SEQ_LENGTH"),
+        "quantization": os.environ.get("RAG_EMBEDDING_QUANTIZATION", DEFAULT_QUANTIZATION),
+    }
+    settings.update({key: value for key, value in overrides.items() if value is not None})
+    return LazyEmbeddings(**settings)
+
+
+def get_embedding_function(cache_path: Optional[str] = None, **settings):
+    """Embeddingmodellen bakom en diskcache; RAG_EMBEDDING_CACHE="" stänger av cachen"""
+    if cache_path is None:
+        cache_path = os.environ.get("RAG_EMBEDDING_CACHE", EMBEDDING_CACHE_PATH)
+    embeddings = embedding_model_from_env(**settings)
+    if not cache_path:
+        return embeddings
+    return CachedEmbeddings(embeddings, cache_path)
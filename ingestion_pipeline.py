@@ -0,0 +1,117 @@
+import queue
+import threading
+import time
+from itertools import islice
+from typing import Dict, List
+
+from database_manager import DatabaseManager
+from document_processor import DocumentProcessor
+
+# Markörer som skickas genom kön mellan stegen
+_BATCH = "batch"
+_FILE_DONE = "file_done"
+_FILE_FAILED = "file_failed"
+_ERROR = "error"
+_END = "end"
+
+
+class IngestionPipeline:
+    """Strömmande ingest: ladda -> chunka -> bädda in -> skriv i batchar av fast storlek.
+
+    Laddning och chunkning körs i en producenttråd som lämnar batchar i en begränsad
+    kö, så att högst queue_size batchar ligger i minnet oavsett korpusens storlek.
+    Varje batch skrivs direkt till databasen, och när en fil är helt skriven
+    registreras den i manifestet. En avbruten körning kan därför återupptas med
+    --incremental: färdiga filer hoppas över och halvfärdiga skrivs om (upsert).
+    """
+
+    def __init__(self, doc_processor: DocumentProcessor, db_manager: DatabaseManager,
+                 batch_size: int = 256, queue_size: int = 4):
+        self.doc_processor = doc_processor
+        self.db_manager = db_manager
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+    def run(self, files: List[str], hashes: Dict[str, str], manifest: dict, inspect: bool = False) -> dict:
+        """Läser in files och uppdaterar manifestet efter varje färdig fil"""
+        batches = queue.Queue(maxsize=self.queue_size)
+        producer = threading.Thread(target=self._produce, args=(files, batches, inspect), daemon=True)
+        producer.start()
+
+        stats = {"files": 0, "chunks": 0, "batches": 0, "failed_files": []}
+        started = time.perf_counter()
+        file_ids = {}
+        seen_ids = {}
+        failed = set()
+
+        while True:
+            kind, file, payload = batches.get()
+            if kind == _END:
+                break
+            if kind == _ERROR:
+                raise payload
+
+            if kind == _BATCH:
+                if file in failed:
+                    continue
+                ids = self.db_manager.add_documents(
+                    payload, update_indexes=False, seen_ids=seen_ids.setdefault(file, set())
+                )
+                if ids is None:
+                    failed.add(file)
+                    continue
+                file_ids.setdefault(file, []).extend(ids)
+                stats["batches"] += 1
+                stats["chunks"] += len(ids)
+
+            elif kind == _FILE_FAILED:
+                # Filen bröts mitt i; behåll tidigare chunks och manifestpost så att den läses om
+                failed.add(file)
+
+            elif kind == _FILE_DONE:
+                ids = file_ids.pop(file, [])
+                seen_ids.pop(file, None)
+                if file in failed:
+                    failed.discard(file)
+                    stats["failed_files"].append(file)
+                elif not ids:
+                    print(f"⚠️ Inga chunks från {file}, behåller tidigare innehåll")
+                else:
+                    # Checkpoint: filen är klar och behöver inte läsas om vid nästa körning
+                    self.db_manager.finish_file(manifest, file, hashes[file], ids)
+                    self.db_manager.save_manifest(manifest)
+                    stats["files"] += 1
+
+        producer.join()
+        elapsed = time.perf_counter() - started
+        stats["seconds"] = elapsed
+        print(f"\n✅ Skrev {stats['chunks']} chunks från {stats['files']} filer i {stats['batches']} batchar "
+              f"({stats['chunks'] / max(elapsed, 1e-9):.1f} chunks/s)")
+        if stats["failed_files"]:
+            print(f"❌ Misslyckades: {', '.join(stats['failed_files'])}")
+        return stats
+
+    def _produce(self, files: List[str], batches: queue.Queue, inspect: bool):
+        """Producenttråd: strömmar chunks från en fil i taget och lägger batchar i kön"""
+        try:
+            for file, chunks in self.doc_processor.iter_files(files, lazy=True):
+                try:
+                    if inspect:
+                        # Inspektion behöver alla chunks från filen på en gång
+                        chunks = list(chunks)
+                        if chunks:
+                            self.doc_processor.inspect_chunks(chunks)
+                    chunks = iter(chunks)
+                    while True:
+                        batch = list(islice(chunks, self.batch_size))
+                        if not batch:
+                            break
+                        batches.put((_BATCH, file, batch))
+                except Exception:
+                    # Felet har redan skrivits ut av laddaren
+                    batches.put((_FILE_FAILED, file, None))
+                batches.put((_FILE_DONE, file, None))
+        except Exception as e:
+            batches.put((_ERROR, None, e))
+        finally:
+            batches.put((_END, None, None))
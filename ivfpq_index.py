@@ -0,0 +1,243 @@
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import metrics
+
+IVFPQ_DIRNAME = "ivfpq"
+DEFAULT_NPROBE = 8
+DEFAULT_TRAIN_SIZE = 50_000
+# Antal koder per delkvantiserare; 256 ryms i en byte
+KSUB = 256
+KMEANS_ITERATIONS = 20
+# Rader per block vid tilldelning till centroider, så att avståndsmatrisen hålls liten
+ASSIGN_BLOCK_ROWS = 1 << 14
+
+
+def default_nlist(n: int) -> int:
+    """Antal inverterade listor: ungefär 4 * sqrt(n), minst 1"""
+    return max(1, min(n, int(4 * np.sqrt(n))))
+
+
+def default_m(dim: int) -> int:
+    """Antal delvektorer: en byte per 8 dimensioner när dimensionen går jämnt upp"""
+    for m in (dim // 8, dim // 4, dim // 2, dim):
+        if m and dim % m == 0:
+            return m
+    return 1
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Närmaste centroid (L2) för varje rad, beräknat blockvis"""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+        block = vectors[start:start + ASSIGN_BLOCK_ROWS]
+        labels[start:start + len(block)] = np.argmin(centroid_norms - 2 * block @ centroids.T, axis=1)
+    return labels
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """Lloyds algoritm; tomma kluster får en slumpvis vald punkt"""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(vectors, centroids)
+        counts = np.bincount(labels, minlength=k)
+        # Summera punkterna per kluster med reduceat över de sorterade etiketterna
+        order = np.argsort(labels, kind="stable")
+        present = np.flatnonzero(counts)
+        sums = np.zeros_like(centroids)
+        sums[present] = np.add.reduceat(vectors[order], np.searchsorted(labels[order], present), axis=0)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+    return centroids
+
+
+class IVFPQIndex:
+    """Approximativt vektorindex: inverterade listor (IVF) med produktkvantiserade residualer (PQ).
+
+    Varje vektor tilldelas närmaste grovcentroid och residualen (vektor minus
+    centroid) delas i m delvektorer som var och en kodas som en byte. En vektor
+    tar alltså m byte i stället för 4 * dim. Vid sökning besöks bara de nprobe
+    listor vars centroider ligger närmast frågan, och skalärprodukten skattas
+    som q·centroid + summan av uppslag i en tabell per delvektor. Kortlistan kan
+    räknas om exakt mot de fullständiga vektorerna (se DatabaseManager).
+    """
+
+    def __init__(self, nlist: Optional[int] = None, m: Optional[int] = None, seed: int = 0):
+        self.nlist = nlist
+        self.m = m
+        self.seed = seed
+        self.centroids = None
+        self.codebooks = None
+        self.ids: List[str] = []
+        self.lists = np.zeros(0, dtype=np.int32)
+        self.codes = np.zeros((0, 0), dtype=np.uint8)
+        self.deleted = np.zeros(0, dtype=bool)
+        self._positions: Optional[Dict[str, int]] = None
+        self._layout = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self) -> int:
+        return int((~self.deleted).sum())
+
+    def train(self, sample: np.ndarray):
+        """Tränar grovcentroider och PQ-kodböcker på ett urval av (normaliserade) vektorer"""
+        sample = np.asarray(sample, dtype=np.float32)
+        n, dim = sample.shape
+        self.nlist = self.nlist or default_nlist(n)
+        self.m = self.m or default_m(dim)
+        if dim % self.m:
+            raise ValueError(f"Dimensionen {dim} är inte delbar med m={self.m}")
+        self.centroids = kmeans(sample, self.nlist, seed=self.seed)
+        self.nlist = len(self.centroids)
+        residuals = sample - self.centroids[_assign(sample, self.centroids)]
+        sub_dim = dim // self.m
+        codebooks = np.zeros((self.m, KSUB, sub_dim), dtype=np.float32)
+        for j in range(self.m):
+            trained = kmeans(residuals[:, j * sub_dim:(j + 1) * sub_dim], KSUB, seed=self.seed + j + 1)
+            codebooks[j, :len(trained)] = trained
+        self.codebooks = codebooks
+        self.codes = np.zeros((0, self.m), dtype=np.uint8)
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        lists = _assign(vectors, self.centroids)
+        residuals = vectors - self.centroids[lists]
+        sub_dim = residuals.shape[1] // self.m
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = _assign(residuals[:, j * sub_dim:(j + 1) * sub_dim], self.codebooks[j])
+        return lists, codes
+
+    def add(self, ids: Sequence[str], vectors):
+        """Lägger till (eller ersätter) vektorer; indexet måste vara tränat"""
+        if not self.is_trained:
+            raise RuntimeError("IVF-PQ-indexet måste tränas innan vektorer läggs till")
+        if not len(ids):
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        self.remove(ids)
+        lists, codes = self._encode(vectors)
+        positions = self._id_positions()
+        for offset, doc_id in enumerate(ids):
+            positions[doc_id] = len(self.ids) + offset
+        self.ids.extend(ids)
+        self.lists = np.concatenate([self.lists, lists])
+        self.codes = np.concatenate([self.codes, codes])
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(ids), dtype=bool)])
+        self._layout = None
+
+    def remove(self, ids: Sequence[str]):
+        positions = self._id_positions()
+        for doc_id in ids:
+            position = positions.pop(doc_id, None)
+            if position is not None:
+                self.deleted[position] = True
+
+    def _id_positions(self) -> Dict[str, int]:
+        if self._positions is None:
+            self._positions = {doc_id: i for i, doc_id in enumerate(self.ids) if not self.deleted[i]}
+        return self._positions
+
+    def _inverted_lists(self):
+        """(positioner sorterade per lista, start-offset per lista), byggs om efter tillägg"""
+        if self._layout is None:
+            order = np.argsort(self.lists, kind="stable")
+            offsets = np.searchsorted(self.lists[order], np.arange(self.nlist + 1))
+            self._layout = (order, offsets)
+        return self._layout
+
+    def _candidates(self, probes: np.ndarray, allowed: Optional[np.ndarray]) -> np.ndarray:
+        order, offsets = self._inverted_lists()
+        candidates = np.concatenate([order[offsets[p]:offsets[p + 1]] for p in probes])
+        keep = ~self.deleted[candidates]
+        if allowed is not None:
+            keep &= allowed[candidates]
+        return candidates[keep]
+
+    def search(self, query, k: int, nprobe: int = DEFAULT_NPROBE,
+               allowed: Optional[np.ndarray] = None) -> Tuple[List[str], np.ndarray]:
+        """Skattade top-k (ID:n, poäng) för en fråga; allowed är en valfri bitmask över raderna i ids"""
+        if not self.is_trained or not len(self.ids):
+            return [], np.zeros(0, dtype=np.float32)
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        coarse = self.centroids @ query
+        nprobe = min(nprobe, self.nlist)
+        probes = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+
+        candidates = self._candidates(probes, allowed)
+        if allowed is not None and len(candidates) < k and nprobe < self.nlist:
+            # Ett snävt filter kan lämna för få träffar i de närmaste listorna; sök då i alla
+            candidates = self._candidates(np.arange(self.nlist), allowed)
+        if not len(candidates):
+            return [], np.zeros(0, dtype=np.float32)
+        metrics.count("documents_scored", len(candidates), leg="dense")
+
+        # Uppslagstabell: skalärprodukten mellan frågans delvektor och varje kodord
+        sub_dim = len(query) // self.m
+        table = np.einsum("jkd,jd->jk", self.codebooks, query.reshape(self.m, sub_dim))
+        scores = coarse[self.lists[candidates]] + table[np.arange(self.m), self.codes[candidates]].sum(axis=1)
+
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [self.ids[candidates[i]] for i in top], scores[top]
+
+    def compact(self):
+        """Tar bort raderade rader ur listorna"""
+        if not self.deleted.any():
+            return
+        live = np.flatnonzero(~self.deleted)
+        self.ids = [self.ids[i] for i in live]
+        self.lists = self.lists[live]
+        self.codes = np.asarray(self.codes[live])
+        self.deleted = np.zeros(len(live), dtype=bool)
+        self._positions = None
+        self._layout = None
+
+    def save(self, path: str):
+        """Sparar indexet i en katalog; koderna sparas som .npy så att de kan minnesmappas"""
+        if not self.is_trained:
+            raise RuntimeError("Ett otränat IVF-PQ-index kan inte sparas")
+        self.compact()
+        os.makedirs(path, exist_ok=True)
+        arrays = {"centroids": self.centroids, "codebooks": self.codebooks, "lists": self.lists, "codes": self.codes}
+        for name, array in arrays.items():
+            tmp_path = os.path.join(path, f"{name}.tmp.npy")
+            np.save(tmp_path, array)
+            os.replace(tmp_path, os.path.join(path, f"{name}.npy"))
+        tmp_path = os.path.join(path, "ids.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"ids": self.ids, "nlist": self.nlist, "m": self.m, "seed": self.seed}, f)
+        os.replace(tmp_path, os.path.join(path, "ids.json"))
+
+    @classmethod
+    def load(cls, path: str) -> Optional["IVFPQIndex"]:
+        """Det sparade indexet, eller None om katalogen inte innehåller ett tränat index"""
+        if not os.path.exists(os.path.join(path, "ids.json")):
+            return None
+        with open(os.path.join(path, "ids.json")) as f:
+            meta = json.load(f)
+        index = cls(nlist=meta["nlist"], m=meta["m"], seed=meta["seed"])
+        try:
+            index.centroids = np.load(os.path.join(path, "centroids.npy"))
+            index.codebooks = np.load(os.path.join(path, "codebooks.npy"))
+        except (OSError, ValueError):
+            # Äldre versioner sparade även otränade index, med centroiderna som objektarrayer
+            return None
+        index.lists = np.load(os.path.join(path, "lists.npy"))
+        index.codes = np.load(os.path.join(path, "codes.npy"), mmap_mode="r")
+        index.ids = meta["ids"]
+        index.deleted = np.zeros(len(index.ids), dtype=bool)
+        return index
@@ -0,0 +1,103 @@
+import threading
+import time
+from typing import Iterator
+
+import httpx
+
+import metrics
+from context_builder import estimate_tokens
+
+LLM_BASE_URL = "http://127.0.0.1:1234/v1"
+LLM_MODEL = "meta-llama-3.1-8b-instruct"
+
+_SPECIAL_TOKENS = ("<|im_start|>", "<|im_end|>")
+
+
+def clean_completion(text: str) -> str:
+    """Tar bort chat-mallens specialtokens ur modellens svar"""
+    for token in _SPECIAL_TOKENS:
+        text = text.replace(token, "")
+    return text
+
+
+class LLMClient:
+    """Långlivad klient mot den lokala OpenAI-kompatibla completion-servern.
+
+    Alla anrop delar en httpx-connection pool, så TCP-anslutningen återanvänds
+    mellan frågorna i stället för att öppnas (och lämnas öppen) per anrop.
+    """
+
+    def __init__(self, base_url: str = LLM_BASE_URL, model: str = LLM_MODEL, api_key: str = "not-needed",
+                 timeout: float = 30.0, connect_timeout: float = 5.0, max_retries: int = 2,
+                 max_connections: int = 10):
+        self.base_url = base_url
+        self.model_name = model
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.http_client = httpx.Client(
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            # Transporten försöker igen vid anslutningsfel, OpenAI-klienten vid timeouts och 5xx
+            transport=httpx.HTTPTransport(retries=max_retries),
+        )
+        self._models = {}
+        self._models_lock = threading.Lock()
+
+    def _get_model(self, **params):
+        """Återanvänder en modellinstans per uppsättning genereringsparametrar"""
+        key = tuple(sorted(params.items()))
+        # Låset hindrar att parallella anrop (t.ex. i evaluate.py) skapar samma modell flera gånger
+        with self._models_lock:
+            if key not in self._models:
+                # langchain_openai tar flera sekunder att importera, så det görs vid första anropet
+                from langchain_openai import OpenAI
+            
+                self._models[key] = OpenAI(
+                    base_url=self.base_url,
+                    api_key=self.api_key,
+                    model=self.model_name,
+                    http_client=self.http_client,
+                    max_retries=self.max_retries,
+                    request_timeout=self.timeout,
+                    **params
+                )
+            return self._models[key]
+
+    @metrics.traced("llm.complete")
+    def complete(self, prompt: str, **params) -> str:
+        """Hämtar hela svaret på en gång"""
+        metrics.count("llm_prompt_tokens", estimate_tokens(prompt))
+        response = clean_completion(self._get_model(**params).invoke(prompt)).strip()
+        metrics.count("llm_completion_tokens", estimate_tokens(response))
+        return response
+
+    def stream(self, prompt: str, **params) -> Iterator[str]:
+        """Strömmar svaret token för token när de kommer från servern"""
+        metrics.count("llm_prompt_tokens", estimate_tokens(prompt))
+        requested = time.perf_counter()
+        started = False
+        streamed = []
+        try:
+            for chunk in self._get_model(**params).stream(prompt):
+                text = clean_completion(chunk)
+                if not started:
+                    # Hoppa över inledande blanksteg, precis som strip() i complete()
+                    text = text.lstrip()
+                    started = bool(text)
+                    if started:
+                        metrics.observe("llm.first_token", time.perf_counter() - requested)
+                if text:
+                    streamed.append(text)
+                    yield text
+        finally:
+            metrics.count("llm_completion_tokens", estimate_tokens("".join(streamed)))
+
+    def close(self):
+        self.http_client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
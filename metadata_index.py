@@ -0,0 +1,185 @@
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+METADATA_INDEX_FILENAME = "metadata_index.npz"
+# Metadatafält som får egna index och kan användas i filter
+FILTER_FIELDS = ("source", "type", "sheet", "page")
+# Operatorer i filteruttrycken (samma syntax som Chromas where)
+FILTER_OPERATORS = ("$eq", "$ne", "$in", "$nin")
+
+
+def value_key(value) -> str:
+    """Jämförbar nyckel för ett metadatavärde; 3, 3.0 och "3" blir samma nyckel"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def filter_key(where: Optional[dict]) -> Optional[str]:
+    """Kanonisk sträng för ett filter, används i cache-nycklar"""
+    return json.dumps(where, sort_keys=True, ensure_ascii=False) if where else None
+
+
+def parse_filter(text: str) -> Optional[dict]:
+    """Tolkar "source=regler.pdf type=structured_data sheet=Blad1,Blad2" till ett filteruttryck.
+
+    Flera värden för samma fält blir $in, flera fält kombineras med $and och
+    heltal tolkas som tal så att filtret även fungerar som Chroma-where.
+    """
+    conditions = []
+    for part in text.split():
+        field, sep, values = part.partition("=")
+        if not sep or not values:
+            raise ValueError(f"Ogiltigt filter '{part}', använd fält=värde")
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Kan inte filtrera på '{field}', välj bland: {', '.join(FILTER_FIELDS)}")
+        parsed = [int(v) if v.isdigit() else v for v in values.split(",")]
+        conditions.append({field: parsed[0] if len(parsed) == 1 else {"$in": parsed}})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+class MetadataIndex:
+    """ID-mängder per metadatavärde för att förfiltrera sökningen.
+
+    För varje fält i FILTER_FIELDS och varje värde sparas de sorterade
+    radnumren (positionerna i ids) som har värdet. Ett filteruttryck i
+    Chromas where-syntax ({"source": "a.pdf"}, {"page": {"$in": [1, 2]}},
+    {"$and": [...]}, {"$or": [...]}) utvärderas till en bitmask över raderna
+    med mängdoperationer, utan att någon metadata behöver läsas vid sökning.
+    Indexet byggs i samma ordning som BM25-indexet så att maskerna kan
+    användas direkt på dess positioner.
+    """
+
+    def __init__(self, ids: Sequence[str], postings: Dict[str, Dict[str, np.ndarray]]):
+        self.ids = list(ids)
+        self.postings = postings
+        self._rows = None
+        self._masks: Dict[str, np.ndarray] = {}
+        self._alignments: Dict[int, tuple] = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, rows: Iterable[Tuple[str, dict]]) -> "MetadataIndex":
+        """Bygger indexet från (id, metadata)-par"""
+        ids = []
+        values: Dict[str, Dict[str, List[int]]] = {field: {} for field in FILTER_FIELDS}
+        for row, (doc_id, metadata) in enumerate(rows):
+            ids.append(doc_id)
+            for field in FILTER_FIELDS:
+                if metadata and field in metadata:
+                    values[field].setdefault(value_key(metadata[field]), []).append(row)
+        postings = {
+            field: {value: np.asarray(rows, dtype=np.int32) for value, rows in by_value.items()}
+            for field, by_value in values.items()
+        }
+        return cls(ids, postings)
+
+    def update(self, removed: Iterable[str], added: Iterable[Tuple[str, dict]]) -> "MetadataIndex":
+        """Nytt index utan removed och med added sist, i samma ordning som BM25Index.update"""
+        added = list(added)
+        drop = set(removed) | {doc_id for doc_id, _metadata in added}
+        keep = np.fromiter((doc_id not in drop for doc_id in self.ids), dtype=bool, count=len(self.ids))
+        new_rows = np.cumsum(keep) - 1
+        n_kept = int(keep.sum())
+        delta = MetadataIndex.build(added)
+        postings = {}
+        empty = np.zeros(0, dtype=np.int32)
+        for field in FILTER_FIELDS:
+            by_value = {}
+            for value in set(self.postings.get(field, {})) | set(delta.postings[field]):
+                rows = self.postings.get(field, {}).get(value, empty)
+                rows = np.concatenate([new_rows[rows[keep[rows]]], delta.postings[field].get(value, empty) + n_kept])
+                if rows.size:
+                    by_value[value] = rows.astype(np.int32)
+            postings[field] = by_value
+        ids = [doc_id for doc_id, kept in zip(self.ids, keep) if kept] + delta.ids
+        return MetadataIndex(ids, postings)
+
+    def values(self, field: str) -> List[str]:
+        return sorted(self.postings.get(field, {}))
+
+    def mask(self, where: dict) -> np.ndarray:
+        """Bitmask över raderna som matchar filtret; resultatet cachas per filter"""
+        key = filter_key(where)
+        if key not in self._masks:
+            if len(self._masks) >= 64:
+                self._masks.clear()
+            self._masks[key] = self._evaluate(where)
+        return self._masks[key]
+
+    def _evaluate(self, where: dict) -> np.ndarray:
+        if not isinstance(where, dict) or not where:
+            raise ValueError(f"Ogiltigt filter: {where!r}")
+        masks = []
+        for field, condition in where.items():
+            if field in ("$and", "$or"):
+                parts = [self._evaluate(part) for part in condition]
+                combined = np.logical_and.reduce(parts) if field == "$and" else np.logical_or.reduce(parts)
+                masks.append(np.asarray(combined, dtype=bool))
+            else:
+                masks.append(self._field_mask(field, condition))
+        return np.logical_and.reduce(masks) if len(masks) > 1 else masks[0]
+
+    def _field_mask(self, field: str, condition) -> np.ndarray:
+        if field not in self.postings:
+            raise ValueError(f"Kan inte filtrera på '{field}', välj bland: {', '.join(FILTER_FIELDS)}")
+        operator, operand = next(iter(condition.items())) if isinstance(condition, dict) else ("$eq", condition)
+        if operator not in FILTER_OPERATORS:
+            raise ValueError(f"Okänd operator '{operator}', välj bland: {', '.join(FILTER_OPERATORS)}")
+        values = operand if operator in ("$in", "$nin") else [operand]
+        mask = np.zeros(len(self.ids), dtype=bool)
+        for value in values:
+            rows = self.postings[field].get(value_key(value))
+            if rows is not None:
+                mask[rows] = True
+        return ~mask if operator in ("$ne", "$nin") else mask
+
+    def matching_ids(self, where: dict) -> List[str]:
+        return [self.ids[row] for row in np.flatnonzero(self.mask(where))]
+
+    def mask_for(self, where: dict, ids: Sequence[Optional[str]]) -> np.ndarray:
+        """Filtrets bitmask omräknad till ordningen i en annan ID-lista (t.ex. vektorlagrets positioner).
+
+        Mappningen mellan listorna cachas så länge listan är samma objekt med samma längd.
+        """
+        cached = self._alignments.get(id(ids))
+        if cached is None or cached[0] is not ids or cached[1] != len(ids):
+            if self._rows is None:
+                self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+            rows = np.asarray([self._rows.get(doc_id, -1) for doc_id in ids], dtype=np.int64)
+            cached = (ids, len(ids), rows)
+            self._alignments[id(ids)] = cached
+        rows = cached[2]
+        return (rows >= 0) & self.mask(where)[np.maximum(rows, 0)]
+
+    def save(self, path: str):
+        """Sparar indexet atomiskt: radnumren per fält i CSR-form"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = {"ids": np.asarray(self.ids, dtype=str)}
+        for field, by_value in self.postings.items():
+            values = sorted(by_value)
+            arrays[f"{field}__values"] = np.asarray(values, dtype=str)
+            arrays[f"{field}__indptr"] = np.cumsum([0] + [len(by_value[v]) for v in values])
+            arrays[f"{field}__rows"] = (np.concatenate([by_value[v] for v in values]) if values
+                                        else np.zeros(0, dtype=np.int32))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "MetadataIndex":
+        with np.load(path, allow_pickle=False) as data:
+            postings = {}
+            for field in FILTER_FIELDS:
+                values = data[f"{field}__values"].tolist()
+                indptr, rows = data[f"{field}__indptr"], data[f"{field}__rows"]
+                postings[field] = {value: rows[indptr[i]:indptr[i + 1]] for i, value in enumerate(values)}
+            return cls(data["ids"].tolist(), postings)
@@ -0,0 +1,390 @@
+import atexit
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+# Histogramgränser i sekunder för stegtiderna
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_PREFIX = "rag_"
+# Prometheus-filen skrivs högst så här ofta (sekunder), och alltid vid avslut
+DEFAULT_EXPORT_INTERVAL = 10.0
+
+# Pågående span i den aktuella tråden/kontexten; nya spans blir dess barn
+_current_span = contextvars.ContextVar("rag_current_span", default=None)
+
+
+class _NullSpan:
+    """Span som inte gör något; returneras när mätningen är avstängd"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """Ett tidsatt steg; spans som startas inuti ett annat blir dess barn"""
+
+    __slots__ = ("metrics", "name", "attrs", "counts", "children", "parent", "wall_time", "start", "duration",
+                 "_token")
+
+    def __init__(self, metrics: "Metrics", name: str, attrs: dict, parent: "Span" = None):
+        self.metrics = metrics
+        self.name = name
+        self.attrs = attrs
+        self.counts = {}
+        self.children = []
+        self.parent = parent
+        self.wall_time = None
+        self.start = None
+        self.duration = None
+        self._token = None
+
+    def set(self, **attrs):
+        """Lägger till attribut, t.ex. antal träffar när de är kända"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self)
+        self.wall_time = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.metrics._finish(self)
+        return False
+
+    def to_dict(self, origin: float) -> dict:
+        record = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+        }
+        if self.attrs:
+            record["attrs"] = self.attrs
+        if self.counts:
+            record["counts"] = self.counts
+        if self.children:
+            record["children"] = [child.to_dict(origin) for child in list(self.children)]
+        return record
+
+
+class Metrics:
+    """Stegtider och räknare för sök- och inläsningsvägen.
+
+    span(name) mäter ett steg och lägger tiden i ett histogram per stegnamn.
+    Spans som startas inuti ett annat (även i trådpoolen, se bind) blir dess
+    barn, och när det yttersta spannet är klart skrivs hela trädet som en
+    JSON-rad till log_path. count(name, value, **labels) räknar upp en räknare
+    (dokument som poängsatts, tokens till språkmodellen, cacheträffar) och
+    bokförs även på det pågående spannet. Histogram och räknare exporteras i
+    Prometheus textformat till prometheus_path och/eller på /metrics.
+
+    Avstängd returnerar span() ett delat tomt objekt och count() gör ingenting,
+    så instrumenteringen kostar bara ett funktionsanrop per steg.
+    """
+
+    def __init__(self, enabled: bool = False, log_path: Optional[str] = None,
+                 prometheus_path: Optional[str] = None, export_interval: float = DEFAULT_EXPORT_INTERVAL):
+        self._lock = threading.Lock()
+        self._log_file = None
+        self._server = None
+        self._atexit_registered = False
+        self.reset()
+        self.configure(enabled, log_path, prometheus_path, export_interval)
+
+    @classmethod
+    def from_env(cls) -> "Metrics":
+        """Inställningar från RAG_METRICS, RAG_METRICS_LOG, RAG_METRICS_PROM och RAG_METRICS_INTERVAL.
+
+        Mätningen slås på av RAG_METRICS=1 eller av att någon exportväg
+        (även RAG_METRICS_PORT, se serve_from_env) är satt.
+        RAG_METRICS_LOG=- skriver JSON-raderna till stderr.
+        """
+        log_path = os.environ.get("RAG_METRICS_LOG") or None
+        prometheus_path = os.environ.get("RAG_METRICS_PROM") or None
+        enabled = (os.environ.get("RAG_METRICS", "").lower() in ("1", "true", "yes")
+                   or bool(log_path or prometheus_path or os.environ.get("RAG_METRICS_PORT")))
+        export_interval = float(os.environ.get("RAG_METRICS_INTERVAL", DEFAULT_EXPORT_INTERVAL))
+        return cls(enabled, log_path, prometheus_path, export_interval)
+
+    def configure(self, enabled: bool = True, log_path: Optional[str] = None,
+                  prometheus_path: Optional[str] = None, export_interval: float = DEFAULT_EXPORT_INTERVAL):
+        with self._lock:
+            if self._log_file is not None and self._log_file is not sys.stderr:
+                self._log_file.close()
+            self._log_file = None
+        self.enabled = enabled
+        self.log_path = log_path
+        self.prometheus_path = prometheus_path
+        self.export_interval = export_interval
+        self._last_export = time.monotonic()
+        if enabled and prometheus_path and not self._atexit_registered:
+            atexit.register(self.flush)
+            self._atexit_registered = True
+
+    def reset(self):
+        """Nollställer histogram och räknare"""
+        with self._lock:
+            # stegnamn -> [antal per hink, summa, antal, max]
+            self._stages: Dict[str, list] = {}
+            # (namn, sorterade etiketter) -> värde
+            self._counters: Dict[tuple, float] = {}
+
+    def span(self, name: str, **attrs):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attrs)
+
+    def count(self, name: str, value: float = 1, **labels):
+        if not self.enabled or not value:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        span = _current_span.get()
+        if span is not None:
+            label = name if not labels else f"{name}{{{','.join(f'{k}={v}' for k, v in key[1])}}}"
+            span.counts[label] = span.counts.get(label, 0) + value
+
+    def traced(self, name: str) -> Callable:
+        """Dekorator som mäter hela funktionen som ett span"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with Span(self, name, {}):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def bind(self, fn: Callable) -> Callable:
+        """fn bunden till den aktuella kontexten, så att spans i en trådpool hamnar under anroparens span"""
+        if not self.enabled:
+            return fn
+        return functools.partial(contextvars.copy_context().run, fn)
+
+    def timed_iter(self, name: str, iterable: Iterable, **attrs) -> Iterator:
+        """Itererar över iterable och mäter bara tiden som går åt till att ta fram elementen.
+
+        Till för strömmande laddare där konsumenten (t.ex. databasskrivningen) annars
+        skulle räknas in i steget.
+        """
+        if not self.enabled:
+            return iter(iterable)
+        return self._timed_iter(Span(self, name, attrs, parent=_current_span.get()), iterable)
+
+    def _timed_iter(self, span: Span, iterable: Iterable) -> Iterator:
+        span.wall_time = time.time()
+        span.start = time.perf_counter()
+        elapsed = 0.0
+        items = 0
+        iterator = iter(iterable)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    elapsed += time.perf_counter() - started
+                    break
+                elapsed += time.perf_counter() - started
+                items += 1
+                yield item
+        finally:
+            span.duration = elapsed
+            span.attrs["items"] = items
+            self._finish(span)
+
+    def observe(self, name: str, seconds: float):
+        """Lägger en stegtid i stegets histogram"""
+        if not self.enabled:
+            return
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = [[0] * len(STAGE_BUCKETS), 0.0, 0, 0.0]
+            for i, bound in enumerate(STAGE_BUCKETS):
+                if seconds <= bound:
+                    stage[0][i] += 1
+                    break
+            stage[1] += seconds
+            stage[2] += 1
+            stage[3] = max(stage[3], seconds)
+
+    def _finish(self, span: Span):
+        self.observe(span.name, span.duration)
+        if span.parent is not None:
+            span.parent.children.append(span)
+            return
+        if self.log_path:
+            self._write_trace(span)
+        if self.prometheus_path and time.monotonic() - self._last_export >= self.export_interval:
+            self.write_prometheus()
+
+    def _write_trace(self, span: Span):
+        record = {"ts": round(span.wall_time, 3), **span.to_dict(span.start)}
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._log_file is None:
+                if self.log_path == "-":
+                    self._log_file = sys.stderr
+                else:
+                    os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+                    self._log_file = open(self.log_path, "a", encoding="utf-8")
+            self._log_file.write(line + "\n")
+            self._log_file.flush()
+
+    def snapshot(self) -> dict:
+        """Stegtider och räknare som en dict, t.ex. för utskrift eller JSON"""
+        with self._lock:
+            stages = {
+                name: {
+                    "count": count,
+                    "total_seconds": total,
+                    "mean_ms": 1000 * total / count if count else 0.0,
+                    "max_ms": 1000 * maximum,
+                }
+                for name, (_buckets, total, count, maximum) in sorted(self._stages.items())
+            }
+            counters = {
+                name + (f"{{{','.join(f'{k}={v}' for k, v in labels)}}}" if labels else ""): value
+                for (name, labels), value in sorted(self._counters.items())
+            }
+        return {"stages": stages, "counters": counters}
+
+    def prometheus_text(self) -> str:
+        """Histogram och räknare i Prometheus textformat"""
+        with self._lock:
+            stages = {name: (list(buckets), total, count) for name, (buckets, total, count, _max)
+                      in sorted(self._stages.items())}
+            counters = sorted(self._counters.items())
+
+        lines = [f"# HELP {METRIC_PREFIX}stage_seconds Tid per steg i sök- och inläsningsvägen.",
+                 f"# TYPE {METRIC_PREFIX}stage_seconds histogram"]
+        for name, (buckets, total, count) in stages.items():
+            cumulative = 0
+            for bound, bucket in zip(STAGE_BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f'{METRIC_PREFIX}stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{METRIC_PREFIX}stage_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+            lines.append(f'{METRIC_PREFIX}stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'{METRIC_PREFIX}stage_seconds_count{{stage="{name}"}} {count}')
+
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{METRIC_PREFIX}{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            label_text = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels)
+            lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: Optional[str] = None):
+        """Skriver Prometheus-texten atomiskt (för node_exporters textfile-collector)"""
+        path = path or self.prometheus_path
+        if not path:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+        self._last_export = time.monotonic()
+
+    def flush(self):
+        """Skriver Prometheus-filen; körs även automatiskt vid avslut"""
+        if self.enabled and self.prometheus_path:
+            self.write_prometheus()
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> int:
+        """Startar en HTTP-server i bakgrunden som svarar med prometheus_text() på /metrics"""
+        if self._server is None:
+            metrics = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def log_message(self, *args):
+                    pass
+
+                def do_GET(self):
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    body = metrics.prometheus_text().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            self._server = ThreadingHTTPServer((host, port), Handler)
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address[1]
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Processens gemensamma mätning; modulerna anropar funktionerna nedan
+METRICS = Metrics.from_env()
+
+
+def enabled() -> bool:
+    return METRICS.enabled
+
+
+def span(name: str, **attrs):
+    return METRICS.span(name, **attrs)
+
+
+def count(name: str, value: float = 1, **labels):
+    METRICS.count(name, value, **labels)
+
+
+def traced(name: str) -> Callable:
+    return METRICS.traced(name)
+
+
+def observe(name: str, seconds: float):
+    METRICS.observe(name, seconds)
+
+
+def bind(fn: Callable) -> Callable:
+    return METRICS.bind(fn)
+
+
+def timed_iter(name: str, iterable: Iterable, **attrs) -> Iterator:
+    return METRICS.timed_iter(name, iterable, **attrs)
+
+
+def serve_from_env() -> Optional[int]:
+    """Startar /metrics-servern om RAG_METRICS_PORT är satt och returnerar porten"""
+    port = os.environ.get("RAG_METRICS_PORT")
+    if not port or not METRICS.enabled:
+        return None
+    port = METRICS.serve(int(port))
+    print(f"📈 Metrics på http://127.0.0.1:{port}/metrics")
+    return port
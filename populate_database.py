@@ -1,6 +1,10 @@
 import argparse
-from document_processor import DocumentProcessor
-from database_manager import DatabaseManager
+import logging
+import os
+from document_processor import DocumentProcessor, file_hash
+from database_manager import DENSE_INDEXES, DatabaseManager
+from ingestion_pipeline import IngestionPipeline
+from vector_store import VECTOR_BACKENDS, VECTOR_DTYPES
 
 CHROMA_PATH = "chroma"
 DATA_PATH = "data"
@@ -9,23 +13,65 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--reset", action="store_true", help="Reset the database.")
     parser.add_argument("--inspect", action="store_true", help="Inspect chunks before adding to database.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only process new or changed files and remove chunks of deleted files. "
+                             "Also resumes an interrupted run.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes used to load and chunk files in parallel.")
+    parser.add_argument("--batch-size", type=int, default=256,
+                        help="Number of chunks embedded and written per batch.")
+    parser.add_argument("--vector-backend", choices=VECTOR_BACKENDS, default=None,
+                        help="Vector storage: chroma or memmap (memory-mapped exact search). "
+                             "Defaults to RAG_VECTOR_BACKEND or the backend of the existing database.")
+    parser.add_argument("--vector-dtype", choices=VECTOR_DTYPES, default=None,
+                        help="Storage type for memmap vectors (default float16).")
+    parser.add_argument("--dense-index", choices=DENSE_INDEXES, default=None,
+                        help="Index for the dense search leg: exact or ivfpq (approximate, trained after ingestion). "
+                             "Defaults to RAG_DENSE_INDEX or exact.")
+    parser.add_argument("--verbose", action="store_true", help="Log metadata for every chunk.")
     args = parser.parse_args()
 
-    db_manager = DatabaseManager(CHROMA_PATH)
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    logging.getLogger("database_manager").setLevel(logging.DEBUG if args.verbose else logging.INFO)
+
+    db_manager = DatabaseManager(CHROMA_PATH, batch_size=args.batch_size,
+                                 vector_backend=args.vector_backend, vector_dtype=args.vector_dtype,
+                                 dense_index=args.dense_index)
     if args.reset:
         print("✨ Rensar databasen")
         db_manager.clear_database()
 
-    doc_processor = DocumentProcessor(DATA_PATH)
-    
-    # Ladda och chunka dokument
-    documents = doc_processor.load_documents()
-    
-    if args.inspect:
-        doc_processor.inspect_chunks(documents)
-    
-    # Lägg till dokumenten i databasen
-    db_manager.add_documents(documents)
+    # Excel- och CSV-tabeller skrivs även till tabellagret för SQL-frågor
+    doc_processor = DocumentProcessor(DATA_PATH, workers=args.workers,
+                                      structured_store_path=db_manager.structured_store_path)
+    manifest = db_manager.load_manifest()
+
+    # Jämför filernas innehållshash mot manifestet
+    files = doc_processor.list_files()
+    hashes = {file: file_hash(os.path.join(DATA_PATH, file)) for file in files}
+    removed = [file for file in manifest["files"] if file not in hashes]
+    if args.incremental:
+        changed = [file for file in files if manifest["files"].get(file, {}).get("hash") != hashes[file]]
+        print(f"\n🔄 Inkrementell körning: {len(changed)} nya/ändrade och {len(removed)} borttagna filer "
+              f"av {len(files)}")
+    else:
+        changed = files
+
+    for file in removed:
+        print(f"🗑️ Tar bort chunks för {file}")
+        db_manager.remove_file(manifest, file)
+
+    # Ladda, chunka och skriv i batchar; manifestet sparas efter varje färdig fil
+    pipeline = IngestionPipeline(doc_processor, db_manager, batch_size=args.batch_size)
+    pipeline.run(changed, hashes, manifest, inspect=args.inspect)
+
+    db_manager.save_manifest(manifest)
+    # Ett nyvalt IVF-PQ-index byggs även om inga filer har ändrats
+    ann_index = db_manager.ann_index
+    if changed or removed or (ann_index is not None and not ann_index.is_trained):
+        db_manager.refresh_indexes()
+    else:
+        print("\n✅ Inga ändringar att läsa in")
 
 if __name__ == "__main__":
     main()
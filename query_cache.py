@@ -0,0 +1,96 @@
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+import metrics
+
+
+def normalize_query(query: str) -> str:
+    """Normaliserar en fråga så att små skillnader i skrivsätt ger samma cache-nyckel"""
+    return " ".join(query.lower().split())
+
+
+class LRUCache:
+    """Begränsad LRU-cache med valfri TTL och valfri persistens till disk.
+
+    Med ett namn räknas träffar och missar även i metrics (cache_hits/cache_misses).
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None, path: Optional[str] = None,
+                 name: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = None
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if self.ttl is None or time.time() - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                else:
+                    del self._entries[key]
+                    value = None
+            if value is None:
+                self.misses += 1
+        if self.name:
+            metrics.count("cache_hits" if value is not None else "cache_misses", cache=self.name)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def save(self):
+        """Sparar cachen atomiskt om en sökväg har angetts"""
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with self._lock:
+            items = list(self._entries.items())
+        with open(tmp_path, "wb") as f:
+            pickle.dump(items, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                items = pickle.load(f)
+        except Exception as e:
+            print(f"⚠️ Kunde inte läsa cache från {self.path}: {e}")
+            return
+        self._entries = OrderedDict(items[-self.max_size:])
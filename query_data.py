@@ -1,9 +1,15 @@
 import argparse
+import metrics
 from database_manager import DatabaseManager
 from search_engine import SearchEngine
-from get_embedding_function import get_embedding_function
+from context_builder import ContextAssembler
+from metadata_index import parse_filter
+from answer_cache import SemanticAnswerCache, depends_on_history
+from chat_history import ChatHistory
 
 CHROMA_PATH = "chroma"
+CACHE_PATH = "cache"
+CONTEXT_TOKEN_BUDGET = 1500
 SYSTEM_PROMPT = """Du är en hjälpsam assistent som svarar på frågor om spelet Monopol baserat på given kontext.
 
 VIKTIGT:
@@ -16,12 +22,12 @@ VIKTIGT:
 4. Citera relevant text från kontexten när möjligt."""
 
 CHAT_PROMPT = """
-Kontext:
-{context}
-
 Historik:
 {history}
 
+Kontext:
+{context}
+
 Användare: {question}
 Assistent:"""
 
@@ -42,74 +48,171 @@ def format_source(metadata):
             return f"- {source} (sida {int(page)})"
         return f"- {source} (sida {page})"
 
+def create_search_engine(db_manager, cache_dir=CACHE_PATH, **kwargs):
+    """Sökmotorn med chatt-prompten; samma (lat laddade) embeddingmodell används för databasen och frågorna"""
+    return SearchEngine(
+        CHAT_PROMPT,
+        db_manager.embedding_function,
+        system_prompt=SYSTEM_PROMPT,
+        db_manager=db_manager,
+        cache_dir=cache_dir,
+        **kwargs
+    )
+
+@metrics.traced("query")
+def query_rag(query_text: str, search_engine=None, where=None) -> str:
+    """Besvarar en enskild fråga utan historik: tabellfråga, annars sökning, kontext och språkmodell.
+
+    Används av tester och benchmarks; utan search_engine skapas en tillfällig mot CHROMA_PATH.
+    """
+    owns_engine = search_engine is None
+    if owns_engine:
+        search_engine = create_search_engine(DatabaseManager(CHROMA_PATH))
+    try:
+        structured = search_engine.answer_structured(query_text, where)
+        if structured:
+            return structured["answer"]
+        bm25_results, sim_results = search_engine.search_legs(query_text, where=where)
+        context_text, _results = ContextAssembler(token_budget=CONTEXT_TOKEN_BUDGET).assemble(
+            [bm25_results, sim_results]
+        )
+        return search_engine.generate_chat_response(query_text, context_text, "")
+    finally:
+        if owns_engine:
+            search_engine.close()
+
+def print_metrics():
+    """Skriver ut stegtider och räknare från metrics"""
+    if not metrics.enabled():
+        print("Mätningen är avstängd, starta med RAG_METRICS=1")
+        return
+    snapshot = metrics.METRICS.snapshot()
+    for name, stage in snapshot["stages"].items():
+        print(f"{name:28} {stage['count']:6d} st  medel {stage['mean_ms']:9.1f} ms  max {stage['max_ms']:9.1f} ms")
+    for name, value in snapshot["counters"].items():
+        print(f"{name:50} {value:g}")
+
+def answer_turn(search_engine, context_assembler, chat_history, user_input, active_filter, answer_cache=None):
+    """Besvarar en fråga i chatten och lägger den i historiken"""
+    # Aggregerings- och uppslagsfrågor över tabeller besvaras direkt med SQL
+    structured = search_engine.answer_structured(user_input, active_filter)
+    if structured:
+        print("\n📚 KÄLLOR:")
+        print("\n".join(format_source(metadata) for metadata in structured["sources"]))
+        print(f"\n=== ✨ SVAR (tabellfråga, {structured['seconds'] * 1000:.1f} ms) ===")
+        print(structured["answer"])
+        chat_history.append(user_input, structured["answer"])
+        return
+    
+    # Omformuleringar av en tidigare fråga får det sparade svaret, om historiken inte ändrar vad frågan betyder
+    query_embedding = None
+    if answer_cache is not None and not depends_on_history(user_input, chat_history):
+        query_embedding = search_engine.embed_query(user_input)
+        cached = answer_cache.lookup(query_embedding, search_engine.db_manager.corpus_version, active_filter)
+        if cached:
+            print("\n📚 KÄLLOR:")
+            print("\n".join(sorted(set(format_source(metadata) for metadata in cached["sources"]))))
+            print(f"\n=== ⚡ SVAR (från cache, likhet {cached['similarity']:.2f}) ===")
+            print(cached["answer"])
+            chat_history.append(user_input, cached["answer"])
+            return
+    
+    # Sök efter relevanta dokument
+    bm25_results, sim_results = search_engine.search_legs(user_input, where=active_filter)
+    
+    # Slå ihop träfflistorna, ta bort överlapp och packa kontexten inom tokenbudgeten
+    with metrics.span("context.assemble"):
+        context_text, results = context_assembler.assemble([bm25_results, sim_results])
+    
+    # Historiken är begränsad till sin tokenbudget, äldre turer är bortplockade eller sammanfattade
+    history_text = chat_history.render()
+    
+    # Visa källor för de chunks som faktiskt skickades som kontext
+    sources = [format_source(doc["metadata"]) for doc, _score in results]
+    print("\n📚 KÄLLOR:")
+    print("\n".join(sorted(set(sources))))
+    
+    # Visa topp chunks
+    print("\n🔍 TOPP 3 CHUNKS (RRF):")
+    for i, (doc, score) in enumerate(results[:3], 1):
+        print(f"\n{i}. Score: {score:.3f}")
+        print("-" * 50)
+        print(doc["page_content"])
+        print("-" * 50)
+    
+    # Generera och visa svaret medan det strömmar in
+    print("\n=== ✨ SVAR ===")
+    response_parts = []
+    with metrics.span("llm.stream"):
+        for token in search_engine.stream_chat_response(user_input, context_text, history_text):
+            print(token, end="", flush=True)
+            response_parts.append(token)
+    print()
+    response_text = "".join(response_parts).strip()
+    
+    # Felsvar sparas inte, nästa omformulering ska få ett nytt försök
+    if query_embedding is not None and response_text and not response_text.startswith("Error:"):
+        answer_cache.store(user_input, query_embedding, response_text, [doc["metadata"] for doc, _score in results],
+                           search_engine.db_manager.corpus_version, active_filter)
+    
+    # Uppdatera historik
+    chat_history.append(user_input, response_text)
+
 def main():
+    metrics.serve_from_env()
     db_manager = DatabaseManager(CHROMA_PATH)
-    embedding_function = get_embedding_function()
-    search_engine = SearchEngine(
-        CHAT_PROMPT, 
-        embedding_function,
-        system_prompt=SYSTEM_PROMPT
-    )
+    search_engine = create_search_engine(db_manager)
     
-    # Spara chat historik
-    chat_history = []
+    context_assembler = ContextAssembler(token_budget=CONTEXT_TOKEN_BUDGET)
+    # Färdiga svar för omformulerade frågor, RAG_ANSWER_CACHE=0 stänger av
+    answer_cache = SemanticAnswerCache.from_env(CACHE_PATH)
+    
+    # Spara chat historik inom en tokenbudget (RAG_HISTORY_TOKENS, RAG_HISTORY_SUMMARY=1 sammanfattar äldre turer)
+    chat_history = ChatHistory.from_env(search_engine.llm_client)
+    # Aktivt metadatafilter, t.ex. "filter source=regler.pdf"
+    active_filter = None
     
     print("\n=== 🤖 RAG Chat ===")
-    print("Skriv 'exit' för att avsluta\n")
+    print("Skriv 'exit' för att avsluta, 'stats' för cache-statistik, 'metrics' för stegtider")
+    print("'filter source=fil.pdf type=structured_data sheet=Blad1 page=3' begränsar sökningen, 'filter' tar bort filtret\n")
     
     while True:
         # Få input från användaren
         user_input = input("\nFråga: ")
         if user_input.lower() in ['exit', 'quit', 'avsluta']:
             break
-            
-        # Sök efter relevanta dokument
-        data = db_manager.get_all_documents()
-        results = search_engine.search(user_input, data["documents"], data["metadatas"])
-        
-        # Skapa kontext från relevanta dokument
-        context_text = "\n\n---\n\n".join([doc["page_content"] for doc, _score in results])
+        if user_input.lower() == 'stats':
+            for name, stats in search_engine.cache_stats().items():
+                size = f"{stats['size']}/{stats['max_size']}" if "max_size" in stats else f"{stats['size']}"
+                print(f"{name}: {stats['hits']} träffar, {stats['misses']} missar "
+                      f"({stats['hit_rate']:.0%}), {size} poster")
+            if answer_cache is not None:
+                stats = answer_cache.stats()
+                print(f"answers: {stats['hits']} träffar, {stats['misses']} missar "
+                      f"({stats['hit_rate']:.0%}), {stats['size']}/{stats['max_size']} poster")
+            continue
+        if user_input.lower().split()[:1] == ['filter']:
+            try:
+                active_filter = parse_filter(user_input[len('filter'):])
+            except ValueError as e:
+                print(f"❌ {e}")
+                continue
+            print(f"🔎 Filter: {active_filter}" if active_filter else "🔎 Filtret borttaget")
+            continue
+        if user_input.lower() == 'metrics':
+            print_metrics()
+            continue
         
-        # Formatera chat historik
-        history_text = "\n".join([
-            f"Användare: {q}\nAssistent: {a}" 
-            for q, a in chat_history
-        ])
-        
-        # Generera svar
-        response_text = search_engine.generate_chat_response(
-            user_input, 
-            context_text,
-            history_text
-        )
-        
-        # Uppdatera historik
-        chat_history.append((user_input, response_text))
-        
-        # Visa källor - Uppdatera för att hantera (doc, score) tupler
-        sources = [format_source(doc[0]['metadata']) for doc in results]  # Notera doc[0] för att få dokumentet från tupeln
-        print("\n📚 KÄLLOR:")
-        print("\n".join(sorted(set(sources))))
-        
-        # Visa topp chunks
-        print("\n🔍 TOPP 3 CHUNKS:")
-        print("\nBM25 chunks:")
-        for i, (doc, score) in enumerate(results[:3], 1):
-            print(f"\n{i}. Score: {score:.3f}")
-            print("-" * 50)
-            print(doc["page_content"])
-            print("-" * 50)
-        
-        if len(results) > 3:
-            print("\nSimilarity chunks:")
-            for i, (doc, score) in enumerate(results[3:6], 1):
-                print(f"\n{i}. Score: {score:.3f}")
-                print("-" * 50)
-                print(doc["page_content"])
-                print("-" * 50)
-        # Visa svar
-        print("\n=== ✨ SVAR ===")
-        print(response_text)
+        # Hela frågan mäts som ett span; sökning, kontext och svar blir dess steg
+        with metrics.span("chat.turn", filtered=bool(active_filter)):
+            answer_turn(search_engine, context_assembler, chat_history, user_input, active_filter, answer_cache)
+    
+    # Spara cacherna till nästa session
+    search_engine.save_caches()
+    if answer_cache is not None:
+        answer_cache.save()
+    search_engine.close()
+    metrics.METRICS.flush()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,29 @@
+import os
+from typing import Optional
+
+
+def model_cache_dir() -> Optional[str]:
+    """Lokal katalog för modeller och tokenizers (RAG_MODEL_CACHE); None = bibliotekens standardcacher"""
+    return os.environ.get("RAG_MODEL_CACHE")
+
+
+def offline_mode() -> bool:
+    """Offline-läge (RAG_OFFLINE=1): inga nedladdningar, allt måste finnas i den lokala cachen"""
+    return os.environ.get("RAG_OFFLINE", "").lower() in ("1", "true", "yes")
+
+
+def configure_runtime():
+    """Pekar modellcacharna till model_cache_dir() och stänger av nätverksanrop i offline-läge.
+
+    Måste köras innan huggingface_hub, transformers eller chromadb importeras,
+    eftersom de läser miljövariablerna vid import.
+    """
+    cache_dir = model_cache_dir()
+    if cache_dir:
+        os.environ.setdefault("HF_HOME", os.path.join(cache_dir, "huggingface"))
+        os.environ.setdefault("SENTENCE_TRANSFORMERS_HOME", os.path.join(cache_dir, "sentence_transformers"))
+        os.environ.setdefault("NLTK_DATA", os.path.join(cache_dir, "nltk_data"))
+    if offline_mode():
+        os.environ["HF_HUB_OFFLINE"] = "1"
+        os.environ["TRANSFORMERS_OFFLINE"] = "1"
+        os.environ["ANONYMIZED_TELEMETRY"] = "False"
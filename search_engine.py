@@ -1,26 +1,167 @@
-import nltk
-from nltk.tokenize import sent_tokenize, word_tokenize
-nltk.download('punkt')
-nltk.download('punkt_tab')
-from rank_bm25 import BM25Okapi
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import numpy as np
-from langchain.prompts import ChatPromptTemplate
-from langchain_openai import OpenAI
-import httpx
-from typing import List, Dict, Tuple
+import metrics
+from bm25_index import BM25Index
+from query_cache import LRUCache, normalize_query
+from metadata_index import MetadataIndex, filter_key
+from llm_client import LLMClient
+from typing import Iterator, List, Dict, Optional, Tuple
+
+def build_chat_prompt(system_prompt: str, query: str, context: str, history: str) -> str:
+    """Chattprompten som vanlig text, ordnad från det som ändras minst till det som ändras mest.
+
+    Systemprompten är identisk i varje anrop och historiken ändras bara i slutet
+    (utom vid komprimering), så inferensservern kan återanvända prompt-/KV-cachen
+    för den delen; kontexten och frågan är nya för varje fråga och ligger sist.
+    """
+    return f"""{system_prompt}
+
+Historik:
+{history}
+
+Kontext:
+{context}
+
+Användare: {query}
+Assistent:"""
+
+def _leg_failed(name: str, timeout, error: Exception):
+    """Loggar ett sökben som tog för lång tid eller kastade; sökningen fortsätter med det andra benet"""
+    if isinstance(error, (FutureTimeoutError, asyncio.TimeoutError)):
+        print(f"⚠️ {name}-sökningen hann inte klart inom {timeout}s, använder bara det andra benet")
+    else:
+        print(f"⚠️ Fel i {name}-sökningen: {str(error)}")
+    return [], False
 
 class SearchEngine:
-    def __init__(self, prompt_template, embedding_function=None, system_prompt=None):
-        self.prompt_template = ChatPromptTemplate.from_template(prompt_template)
+    def __init__(self, prompt_template, embedding_function=None, system_prompt=None, db_manager=None,
+                 cache_size=1024, cache_ttl=None, cache_dir=None, llm_client=None,
+                 lexical_timeout=None, dense_timeout=None, max_workers=4, structured_store=None):
+        self._prompt_template_text = prompt_template
+        self._prompt_template = None
         self.embedding_function = embedding_function
         self.system_prompt = system_prompt
+        self.db_manager = db_manager
+        self.llm_client = llm_client or LLMClient()
+        # Tabellager för aggregerings- och uppslagsfrågor som kan besvaras utan språkmodellen
+        self.structured_store = structured_store or (db_manager.structured_store if db_manager else None)
+        self._lexical_index = None
+        self._lexical_index_mtime = None
+        self._lexical_index_lock = threading.Lock()
+        self._corpus_embeddings = None
+        
+        # BM25- och similarity-benen körs parallellt; ett ben som missar sin deadline ger tomt resultat
+        self.lexical_timeout = lexical_timeout
+        self.dense_timeout = dense_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="search")
+        
+        # Cacher för frågeinbäddningar och sökresultat (resultaten är knutna till korpusversionen)
+        self.embedding_cache = LRUCache(
+            cache_size, cache_ttl, os.path.join(cache_dir, "query_embeddings.pkl") if cache_dir else None,
+            name="query_embeddings"
+        )
+        self.result_cache = LRUCache(
+            cache_size, cache_ttl, os.path.join(cache_dir, "search_results.pkl") if cache_dir else None,
+            name="search_results"
+        )
+        self._cached_corpus_version = None
+
+    @property
+    def prompt_template(self):
+        """Prompt-mallen för generate_answer; langchain importeras först när den behövs"""
+        if self._prompt_template is None:
+            from langchain_core.prompts import ChatPromptTemplate
+            self._prompt_template = ChatPromptTemplate.from_template(self._prompt_template_text)
+        return self._prompt_template
+
+    def _get_lexical_index(self):
+        """Laddar BM25-indexet en gång och laddar om det bara när filen har ändrats"""
+        path = self.db_manager.lexical_index_path
+        with self._lexical_index_lock:
+            mtime = os.path.getmtime(path) if os.path.exists(path) else None
+            if self._lexical_index is None or mtime != self._lexical_index_mtime:
+                self._lexical_index = self.db_manager.load_lexical_index()
+                self._lexical_index_mtime = os.path.getmtime(path) if os.path.exists(path) else None
+            return self._lexical_index
+
+    @metrics.traced("search.bm25")
+    def _lexical_search(self, query: str, top_k: int, where: dict = None) -> List[Tuple[Dict, float]]:
+        """BM25-sökning mot det förbyggda indexet, valfritt begränsad till chunks som matchar filtret"""
+        index = self._get_lexical_index()
+        if index is None:
+            return []
+        allowed = self.db_manager.filter_mask(where, index.ids) if where else None
+        hits = index.top_k(query, top_k, allowed)
+        # Indexet kan ligga efter lagret, så träffar paras med dokumenten via ID och saknade hoppas över
+        ids = [index.ids[position] for position, _score in hits]
+        by_id = self.db_manager.get_documents_by_id(ids)
+        return [({"page_content": by_id[doc_id][0], "metadata": by_id[doc_id][1]}, score)
+                for doc_id, (_position, score) in zip(ids, hits) if doc_id in by_id]
+
+    def embed_query(self, query: str) -> List[float]:
+        """Frågans inbäddning (samma cachade vektor som similarity-sökningen använder)"""
+        return self._embed_query(query)
+
+    def _embed_query(self, query: str) -> List[float]:
+        """Bäddar in frågan som användaren skrev den; den normaliserade frågan är bara cache-nyckel"""
+        key = normalize_query(query)
+        embedding = self.embedding_cache.get(key)
+        if embedding is None:
+            with metrics.span("embed.query"):
+                embedding = self.embedding_function.embed_query(query)
+            self.embedding_cache.put(key, embedding)
+        return embedding
+
+    def _current_corpus_version(self) -> str:
+        """Läser korpusversionen och tömmer resultatcachen när den har ändrats"""
+        version = self.db_manager.corpus_version
+        if self._cached_corpus_version is not None and version != self._cached_corpus_version:
+            self.result_cache.clear()
+        self._cached_corpus_version = version
+        return version
+
+    def cache_stats(self) -> Dict[str, dict]:
+        """Returnerar träff/miss-statistik för cacherna"""
+        stats = {
+            "query_embeddings": self.embedding_cache.stats(),
+            "search_results": self.result_cache.stats(),
+        }
+        if hasattr(self.embedding_function, "stats"):
+            stats["embedding_store"] = self.embedding_function.stats()
+        return stats
+
+    def save_caches(self):
+        """Sparar cacherna till disk om en cache-katalog har angetts"""
+        self.embedding_cache.save()
+        self.result_cache.save()
+
+    @metrics.traced("search.dense")
+    def _dense_search(self, query: str, top_k: int, where: dict = None) -> List[Tuple[Dict, float]]:
+        """Semantisk sökning: bäddar in frågan en gång och frågar de lagrade vektorerna"""
+        query_embedding = self._embed_query(query)
+        documents, metadatas, scores = self.db_manager.similarity_search_by_vector(query_embedding, top_k, where)
+        return [({"page_content": doc, "metadata": meta}, score)
+                for doc, meta, score in zip(documents, metadatas, scores) if score > 0]
+
+    def _embed_corpus(self, documents: list[str]) -> np.ndarray:
+        """Bäddar in inskickade dokument i ett anrop och cachar matrisen"""
+        key = hash(tuple(documents))
+        if self._corpus_embeddings is None or self._corpus_embeddings[0] != key:
+            with metrics.span("embed.corpus", documents=len(documents)):
+                matrix = np.asarray(self.embedding_function.embed_documents(list(documents)), dtype=np.float32)
+            self._corpus_embeddings = (key, matrix.reshape(len(documents), -1))
+        return self._corpus_embeddings[1]
 
     def expand_query(self, query: str) -> str:
         """Expandera query med synonymer för bättre BM25 matchning"""
         try:
             # Använd språkmodellen för att generera relaterade termer
             prompt = f"Generate 2-3 synonyms or related terms for the query: {query}"
-            expanded_terms = self.model.invoke(prompt).strip().split('\n')
+            expanded_terms = self.llm_client.complete(prompt).split('\n')
             
             # Kombinera original query med expanderade termer
             expanded_query = f"{query} {' '.join(expanded_terms)}"
@@ -28,42 +169,191 @@ class SearchEngine:
         except:
             return query
 
-    def search(self, query: str, documents: list[str], metadatas: list[dict], top_k_each=6) -> List[Tuple[Dict, float]]:
-        results = []
+    def answer_structured(self, query: str, where: dict = None) -> Optional[Dict]:
+        """Besvarar summa-, medelvärdes-, max/min-, antals- och uppslagsfrågor över tabelldata med SQL.
+
+        Returnerar {"answer", "sources", "seconds"} eller None om frågan ska gå
+        den vanliga vägen via sökning och språkmodell. where begränsar tabellerna
+        på samma sätt som sökningen (source=regler.pdf ger inget tabellsvar).
+        """
+        if self.structured_store is None:
+            return None
+        try:
+            with metrics.span("search.structured") as span:
+                answer = self.structured_store.answer(query, where)
+                span.set(answered=answer is not None)
+            return answer
+        except Exception as e:
+            print(f"⚠️ Fel i tabellfrågan: {str(e)}")
+            return None
+
+    def search(self, query: str, documents: list[str] = None, metadatas: list[dict] = None, top_k_each=6,
+               where: dict = None) -> List[Tuple[Dict, float]]:
+        """Hybrid sökning: BM25-träffar följda av similarity-träffar.
+
+        where är ett valfritt metadatafilter i Chromas syntax, t.ex. {"source": "regler.pdf"}
+        eller {"type": "structured_data"}; båda benen poängsätter då bara de chunks som matchar.
+        """
+        bm25_results, sim_results = self.search_legs(query, documents, metadatas, top_k_each, where)
+        return bm25_results + sim_results
+
+    @metrics.traced("search")
+    def search_legs(self, query: str, documents: list[str] = None, metadatas: list[dict] = None,
+                    top_k_each=6, where: dict = None) -> Tuple[List[Tuple[Dict, float]], List[Tuple[Dict, float]]]:
+        """Returnerar BM25- och similarity-träffarna som två separata rankade listor"""
+        # Använd det persistenta BM25-indexet och de lagrade vektorerna om inga dokument skickas in
+        if documents is None:
+            cache_key = (normalize_query(query), top_k_each, filter_key(where), self._current_corpus_version())
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return list(cached[0]), list(cached[1])
+            
+            bm25_results, sim_results, complete = self._run_legs(query, top_k_each, where)
+            if complete:
+                self.result_cache.put(cache_key, (list(bm25_results), list(sim_results)))
+            return bm25_results, sim_results
         
-        # BM25 sökning
-        tokenized_corpus = [word_tokenize(doc.lower()) for doc in documents]
-        bm25 = BM25Okapi(tokenized_corpus)
-        query_tokens = word_tokenize(query.lower())
-        bm25_scores = bm25.get_scores(query_tokens)
+        if where:
+            keep = np.flatnonzero(MetadataIndex.build(enumerate(metadatas)).mask(where))
+            documents = [documents[i] for i in keep]
+            metadatas = [metadatas[i] for i in keep]
+            if not documents:
+                return [], []
         
-        # Ta top-k från BM25
-        bm25_indices = np.argsort(bm25_scores)[::-1][:top_k_each]
-        bm25_results = [({"page_content": documents[i], "metadata": metadatas[i]}, bm25_scores[i]) 
-                        for i in bm25_indices if bm25_scores[i] > 0]
-        results.extend(bm25_results)
+        # BM25 sökning över de dokument som skickats in
+        with metrics.span("search.bm25_build", documents=len(documents)):
+            bm25 = BM25Index.build(list(range(len(documents))), documents)
+        bm25_results = [({"page_content": documents[i], "metadata": metadatas[i]}, score)
+                        for i, score in bm25.top_k(query, top_k_each)]
         
         # Semantic similarity sökning
+        sim_results = []
         if self.embedding_function:
-            query_embedding = self.embedding_function.embed_query(query)
-            doc_embeddings = [
-                self.embedding_function.embed_documents([doc])[0] 
-                for doc in documents
-            ]
-            
-            similarity_scores = [
-                np.dot(query_embedding, doc_embedding) 
-                for doc_embedding in doc_embeddings
-            ]
+            query_embedding = np.asarray(self._embed_query(query))
+            similarity_scores = self._embed_corpus(documents) @ query_embedding
             
             # Ta top-k från similarity
             sim_indices = np.argsort(similarity_scores)[::-1][:top_k_each]
-            sim_results = [({"page_content": documents[i], "metadata": metadatas[i]}, similarity_scores[i]) 
+            sim_results = [({"page_content": documents[i], "metadata": metadatas[i]}, float(similarity_scores[i])) 
                           for i in sim_indices if similarity_scores[i] > 0]
-            results.extend(sim_results)
         
+        return bm25_results, sim_results
+
+    @metrics.traced("search.many")
+    def search_many(self, queries: List[str], top_k=6, where: dict = None) -> List[List[Tuple[Dict, float]]]:
+        """Hybrid sökning för många frågor på en gång (t.ex. utvärdering och bulk-Q&A).
+
+        Alla frågor bäddas in i ett anrop och poängsätts mot korpusen som en
+        matrisprodukt; BM25-poängen för hela batchen tas fram med en gles matrisoperation.
+        Returnerar en resultatlista per fråga i samma format som search().
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        
+        index = self._get_lexical_index()
+        allowed = self.db_manager.filter_mask(where, index.ids) if where and index is not None else None
+        bm25_hits = index.top_k_many(queries, top_k, allowed) if index is not None else [[] for _ in queries]
+        bm25_ids = [[index.ids[position] for position, _score in hits] for hits in bm25_hits]
+        
+        sim_ids = [[] for _ in queries]
+        sim_scores = [[] for _ in queries]
+        if self.embedding_function:
+            query_matrix = self._embed_queries(queries)
+            for i, hits in enumerate(self.db_manager.similarity_search_many(query_matrix, top_k, where)):
+                sim_ids[i] = [doc_id for doc_id, _score in hits]
+                sim_scores[i] = [score for _doc_id, score in hits]
+        
+        # Hämta alla träffade dokument i ett anrop
+        unique_ids = list(dict.fromkeys(doc_id for ids in bm25_ids + sim_ids for doc_id in ids))
+        by_id = {doc_id: {"page_content": doc, "metadata": meta}
+                 for doc_id, (doc, meta) in self.db_manager.get_documents_by_id(unique_ids).items()}
+        
+        results = []
+        for hits, ids, scores, sids in zip(bm25_hits, bm25_ids, sim_scores, sim_ids):
+            query_results = [(by_id[doc_id], score) for doc_id, (_pos, score) in zip(ids, hits) if doc_id in by_id]
+            query_results.extend((by_id[doc_id], score) for doc_id, score in zip(sids, scores) if doc_id in by_id)
+            results.append(query_results)
         return results
 
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Bäddar in flera frågor; bara de som saknas i cachen skickas, i ett enda batchanrop"""
+        keys = [normalize_query(query) for query in queries]
+        # Originaltexten bäddas in (första förekomsten per nyckel); den normaliserade frågan är bara cache-nyckel
+        originals = dict(zip(reversed(keys), reversed(queries)))
+        embeddings = {key: self.embedding_cache.get(key) for key in dict.fromkeys(keys)}
+        missing = [key for key, embedding in embeddings.items() if embedding is None]
+        if missing:
+            with metrics.span("embed.queries", count=len(missing)):
+                new_embeddings = self.embedding_function.embed_documents([originals[key] for key in missing])
+            for key, embedding in zip(missing, new_embeddings):
+                embeddings[key] = embedding
+                self.embedding_cache.put(key, embedding)
+        return np.asarray([embeddings[key] for key in keys], dtype=np.float32)
+
+    def _run_legs(self, query: str, top_k: int, where: dict = None):
+        """Kör BM25-benet och similarity-benet (inbäddning + vektorsökning) samtidigt i trådpoolen"""
+        started = time.monotonic()
+        lexical_future = self._executor.submit(metrics.bind(self._lexical_search), query, top_k, where)
+        dense_future = (self._executor.submit(metrics.bind(self._dense_search), query, top_k, where)
+                        if self.embedding_function else None)
+        
+        bm25_results, lexical_ok = self._leg_result(lexical_future, "BM25", self.lexical_timeout, started)
+        sim_results, dense_ok = self._leg_result(dense_future, "similarity", self.dense_timeout, started)
+        return bm25_results, sim_results, lexical_ok and dense_ok
+
+    @staticmethod
+    def _leg_result(future, name: str, timeout, started: float):
+        """Väntar på ett sökben till dess deadline; returnerar (träffar, om benet hann klart)"""
+        if future is None:
+            return [], True
+        remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+        try:
+            return future.result(timeout=remaining), True
+        except Exception as e:
+            return _leg_failed(name, timeout, e)
+
+    async def asearch_legs(self, query: str, documents: list[str] = None, metadatas: list[dict] = None,
+                           top_k_each=6, where: dict = None) -> Tuple[List[Tuple[Dict, float]], List[Tuple[Dict, float]]]:
+        """Asynkron variant av search_legs där båda benen körs samtidigt"""
+        loop = asyncio.get_running_loop()
+        if documents is not None:
+            return await loop.run_in_executor(
+                self._executor, self.search_legs, query, documents, metadatas, top_k_each, where
+            )
+        
+        cache_key = (normalize_query(query), top_k_each, filter_key(where), self._current_corpus_version())
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            return list(cached[0]), list(cached[1])
+        
+        lexical = loop.run_in_executor(self._executor, metrics.bind(self._lexical_search), query, top_k_each, where)
+        dense = (loop.run_in_executor(self._executor, metrics.bind(self._dense_search), query, top_k_each, where)
+                 if self.embedding_function else None)
+        (bm25_results, lexical_ok), (sim_results, dense_ok) = await asyncio.gather(
+            self._await_leg(lexical, "BM25", self.lexical_timeout),
+            self._await_leg(dense, "similarity", self.dense_timeout),
+        )
+        if lexical_ok and dense_ok:
+            self.result_cache.put(cache_key, (list(bm25_results), list(sim_results)))
+        return bm25_results, sim_results
+
+    async def asearch(self, query: str, documents: list[str] = None, metadatas: list[dict] = None,
+                      top_k_each=6, where: dict = None) -> List[Tuple[Dict, float]]:
+        """Asynkron hybrid sökning: BM25-träffar följda av similarity-träffar"""
+        bm25_results, sim_results = await self.asearch_legs(query, documents, metadatas, top_k_each, where)
+        return bm25_results + sim_results
+
+    @staticmethod
+    async def _await_leg(future, name: str, timeout):
+        """Asynkron motsvarighet till _leg_result"""
+        if future is None:
+            return [], True
+        try:
+            return await asyncio.wait_for(future, timeout), True
+        except Exception as e:
+            return _leg_failed(name, timeout, e)
+
     def generate_answer(self, query: str, context: str):
         # Uppdatera system prompt för att hantera strukturerad data
         structured_data_prompt = """
@@ -86,44 +376,32 @@ class SearchEngine:
         )
         
         try:
-            model = OpenAI(
-                base_url="http://127.0.0.1:1234/v1",
-                api_key="not-needed",
-                temperature=0.2,
-            
-                top_p=0.95,
-                model="meta-llama-3.1-8b-instruct"
-            )
-            response = model.invoke(prompt)
-            return response.strip().replace("<|im_start|>", "").replace("<|im_end|>", "")
+            return self.llm_client.complete(prompt, temperature=0.2, top_p=0.95)
         except Exception as e:
             return f"Error: {str(e)}"
 
-    def generate_chat_response(self, query: str, context: str, history: str):
-        # Formatera prompt som vanlig text istället för chat
-        full_prompt = f"""
-{self.system_prompt}
-
-Kontext:
-{context}
-
-Historik:
-{history}
+    def _build_chat_prompt(self, query: str, context: str, history: str) -> str:
+        return build_chat_prompt(self.system_prompt, query, context, history)
 
-Användare: {query}
-Assistent:"""
+    def generate_chat_response(self, query: str, context: str, history: str):
+        full_prompt = self._build_chat_prompt(query, context, history)
         
         try:
-            model = OpenAI(
-                base_url="http://127.0.0.1:1234/v1",
-                api_key="not-needed",
-                temperature=0.4,
-                model="meta-llama-3.1-8b-instruct",
-                http_client=httpx.Client(timeout=30.0)
-            )
-            
             # Använd vanlig completion istället för chat completion
-            response = model.invoke(full_prompt)
-            return response.strip().replace("<|im_start|>", "").replace("<|im_end|>", "")
+            return self.llm_client.complete(full_prompt, temperature=0.4)
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    def stream_chat_response(self, query: str, context: str, history: str) -> Iterator[str]:
+        """Som generate_chat_response men strömmar svaret medan det genereras"""
+        full_prompt = self._build_chat_prompt(query, context, history)
+        
+        try:
+            yield from self.llm_client.stream(full_prompt, temperature=0.4)
         except Exception as e:
-            return f"Error: {str(e)}" 
\ No newline at end of file
+            yield f"Error: {str(e)}"
+
+    def close(self):
+        """Stänger den delade LLM-anslutningen och trådpoolen"""
+        self._executor.shutdown(wait=False)
+        self.llm_client.close()
@@ -1,12 +1,129 @@
 import pandas as pd
-from langchain.schema.document import Document
-from typing import List, Optional
+from langchain_core.documents import Document
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from queue import Empty, Full
+from typing import Dict, Iterator, List, Optional, Tuple
 import numpy as np
 import importlib.util
 import re
+from structured_store import StructuredStore
+
+# Antal rader per block när CSV- och Excel-filer strömmas
+CSV_BLOCK_ROWS = 50_000
+EXCEL_BLOCK_ROWS = 10_000
+# Färdiga block per sheet som en arbetsprocess får ha väntande innan den pausar
+SHEET_QUEUE_BLOCKS = 2
+
+DATE_PATTERNS = [re.compile(pattern) for pattern in (
+    r'\d{4}-\d{2}-\d{2}',  # YYYY-MM-DD
+    r'\d{2}/\d{2}/\d{4}',  # DD/MM/YYYY eller MM/DD/YYYY
+    r'\d{4}',              # Endast årtal
+    r'\d{4}[Qq]\d{1}',     # År och kvartal (t.ex. 2019Q1 eller 2019q1)
+)]
+
+
+def _is_text_dtype(series: pd.Series) -> bool:
+    return series.dtype == 'object' or pd.api.types.is_string_dtype(series.dtype)
+
+
+def _first_valid(series: pd.Series):
+    """Första icke-null värdet i kolumnen, eller None"""
+    present = series.notna().to_numpy()
+    return series.iloc[present.argmax()] if present.any() else None
+
+
+def _looks_like_integer(value) -> bool:
+    """Om pd.to_numeric skulle tolka värdet som ett heltal"""
+    if isinstance(value, (bool, np.bool_)):
+        return False
+    if isinstance(value, (int, np.integer)):
+        return True
+    if isinstance(value, str):
+        return value.strip().lstrip('+-').isdigit()
+    return False
+
+
+def _join_columns(columns: List[np.ndarray], n_rows: int) -> np.ndarray:
+    """Slår ihop formaterade kolumner radvis med ' | ', utan tomma delar"""
+    joined = np.full(n_rows, "", dtype=object)
+    for part in columns:
+        has_joined = joined != ""
+        has_part = part != ""
+        joined = np.where(has_joined & has_part, joined + " | " + part, np.where(has_part, part, joined))
+    return joined
+
+
+def _excel_column_names(header: tuple) -> List[str]:
+    """Kolumnnamn från rubrikraden, med samma namn som pd.read_excel ger tomma och dubblerade rubriker"""
+    names = []
+    seen = {}
+    for i, value in enumerate(header):
+        name = f"Unnamed: {i}" if value is None else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _excel_sheet_blocks(queue, stop, file_path: str, sheet_name: str, source: str, chunk_size: int,
+                        block_rows: int, table_store_path: Optional[str]):
+    """Körs i en arbetsprocess: strömmar ett sheet och lägger kompakta (text, metadata)-poster i kön, ett block i taget.
+
+    Kön är begränsad, så arbetaren väntar när huvudprocessen inte hinner med; None markerar att sheetet är klart.
+    Om huvudprocessen slutar läsa (stop sätts) avbryts arbetet.
+    """
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.5)
+                return True
+            except Full:
+                continue
+        return False
+
+    try:
+        processor = StructuredDataProcessor(table_store_path=table_store_path)
+        records_per_block = max(1, block_rows // chunk_size)
+        records = []
+        for doc in processor.excel_sheet_to_documents(file_path, sheet_name, source, chunk_size, block_rows):
+            records.append((doc.page_content, doc.metadata))
+            if len(records) == records_per_block:
+                if not put(records):
+                    return
+                records = []
+        if records:
+            put(records)
+    finally:
+        put(None)
+
+
+def _drain_sheet(queue, future) -> Iterator[List[Tuple[str, dict]]]:
+    """Block från en arbetares kö tills den är klar; ett fel i arbetaren kastas vidare här"""
+    while True:
+        try:
+            records = queue.get(timeout=1.0)
+        except Empty:
+            # Skyddar mot en arbetsprocess som dog utan att hinna markera att den var klar
+            if future.done():
+                future.result()
+                return
+            continue
+        if records is None:
+            future.result()
+            return
+        yield records
+
 
 class StructuredDataProcessor:
-    def __init__(self):
+    def __init__(self, sheet_workers: int = 1, table_store_path: Optional[str] = None):
+        self.sheet_workers = sheet_workers
+        # Om en sökväg anges skrivs tabellerna även till StructuredStore för SQL-frågor
+        self.table_store_path = table_store_path
+        self.table_store = StructuredStore(table_store_path) if table_store_path else None
         # Kontrollera om nödvändiga paket är installerade
         self._check_dependencies()
 
@@ -56,6 +173,101 @@ class StructuredDataProcessor:
             print(f"❌ Fel vid inläsning av Excel-fil {file_path}: {e}")
             return pd.DataFrame()
 
+    def iter_excel_blocks(self, file_path: str, sheet_name: str,
+                          block_rows: int = EXCEL_BLOCK_ROWS) -> Iterator[Tuple[pd.DataFrame, int]]:
+        """Strömmar ett sheet i block om block_rows rader med openpyxl i read-only-läge.
+
+        Returnerar (block, radoffset); bara ett block i taget ligger i minnet.
+        """
+        from openpyxl import load_workbook
+        
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = workbook[sheet_name].iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = _excel_column_names(header)
+            width = len(columns)
+            
+            block = []
+            row_offset = 0
+            for row in rows:
+                # Hoppa över helt tomma rader, precis som pd.read_excel
+                if all(value is None for value in row):
+                    continue
+                row = tuple(row[:width]) + (None,) * (width - len(row))
+                block.append(row)
+                if len(block) == block_rows:
+                    yield pd.DataFrame(block, columns=columns), row_offset
+                    row_offset += len(block)
+                    block = []
+            if block:
+                yield pd.DataFrame(block, columns=columns), row_offset
+        finally:
+            workbook.close()
+
+    def excel_sheet_names(self, file_path: str) -> List[str]:
+        from openpyxl import load_workbook
+        
+        workbook = load_workbook(file_path, read_only=True)
+        try:
+            return list(workbook.sheetnames)
+        finally:
+            workbook.close()
+
+    def excel_to_documents(self, file_path: str, source: str, chunk_size: int = 5,
+                           block_rows: int = EXCEL_BLOCK_ROWS) -> Iterator[Document]:
+        """Strömmar en Excel-arbetsbok till Document-objekt, ett sheet i taget eller parallellt per sheet"""
+        if importlib.util.find_spec("openpyxl") is None:
+            print(f"⚠️ Hoppar över Excel-fil {file_path} - openpyxl är inte installerat")
+            return
+        
+        # .xls stöds inte av openpyxl - läs dem med pandas som tidigare
+        if file_path.endswith('.xls'):
+            yield from self.dataframe_to_documents(self.load_excel(file_path), source, chunk_size)
+            return
+        
+        # Blocken måste vara en multipel av chunk_size så att radintervallen blir desamma
+        block_rows = max(chunk_size, block_rows // chunk_size * chunk_size)
+        sheets = self.excel_sheet_names(file_path)
+        print(f"   Hittade {len(sheets)} sheets: {', '.join(sheets)}")
+        
+        if self.sheet_workers <= 1 or len(sheets) <= 1:
+            for sheet in sheets:
+                yield from self.excel_sheet_to_documents(file_path, sheet, source, chunk_size, block_rows)
+            return
+        
+        # Varje sheet strömmar tillbaka block genom en egen kö med plats för SHEET_QUEUE_BLOCKS block, så
+        # högst workers * (SHEET_QUEUE_BLOCKS + 1) block ligger i minnet samtidigt oavsett arbetsbokens storlek
+        with Manager() as manager, \
+                ProcessPoolExecutor(max_workers=min(self.sheet_workers, len(sheets))) as executor:
+            queues = [manager.Queue(maxsize=SHEET_QUEUE_BLOCKS) for _ in sheets]
+            stop = manager.Event()
+            futures = [executor.submit(_excel_sheet_blocks, queue, stop, file_path, sheet, source, chunk_size,
+                                       block_rows, self.table_store_path)
+                       for queue, sheet in zip(queues, sheets)]
+            try:
+                # Resultaten lämnas i sheet-ordning; senare sheets väntar när deras kö är full
+                for queue, future in zip(queues, futures):
+                    for records in _drain_sheet(queue, future):
+                        for content, metadata in records:
+                            yield Document(page_content=content, metadata=metadata)
+            finally:
+                # Om läsaren slutar i förtid (eller ett sheet misslyckas) ska väntande arbetare inte blockera
+                stop.set()
+                for future in futures:
+                    future.cancel()
+
+    def excel_sheet_to_documents(self, file_path: str, sheet_name: str, source: str, chunk_size: int = 5,
+                                 block_rows: int = EXCEL_BLOCK_ROWS) -> Iterator[Document]:
+        """Chunkar ett sheet block för block; kolumntyperna bestäms från första blocket"""
+        column_types = None
+        for block, row_offset in self.iter_excel_blocks(file_path, sheet_name, block_rows):
+            if column_types is None:
+                column_types = self.detect_column_types(block)
+            yield from self._sheet_to_documents(block, source, sheet_name, chunk_size, row_offset, column_types)
+
     def load_csv(self, file_path: str, encoding: str = 'utf-8', sep: str = ',') -> pd.DataFrame:
         """Laddar en CSV-fil och returnerar en DataFrame"""
         try:
@@ -64,6 +276,68 @@ class StructuredDataProcessor:
             print(f"Fel vid inläsning av CSV-fil: {e}")
             return pd.DataFrame()
 
+    def iter_csv(self, file_path: str, encoding: str = 'utf-8', sep: str = ',',
+                 chunksize: int = CSV_BLOCK_ROWS) -> Iterator[pd.DataFrame]:
+        """Läser en CSV-fil i block om chunksize rader i stället för hela filen på en gång"""
+        try:
+            yield from pd.read_csv(file_path, encoding=encoding, sep=sep, chunksize=chunksize)
+        except Exception as e:
+            print(f"Fel vid inläsning av CSV-fil: {e}")
+
+    def csv_to_documents(self, file_path: str, source: str, chunk_size: int = 5,
+                         block_rows: int = CSV_BLOCK_ROWS) -> Iterator[Document]:
+        """Strömmar en CSV-fil till Document-objekt med samma format som dataframe_to_documents"""
+        # Blocken måste vara en multipel av chunk_size så att radintervallen blir desamma
+        block_rows = max(chunk_size, block_rows // chunk_size * chunk_size)
+        column_types = None
+        row_offset = 0
+        for block in self.iter_csv(file_path, chunksize=block_rows):
+            if column_types is None:
+                column_types = self.detect_column_types(block)
+            yield from self._sheet_to_documents(block, source, 'main', chunk_size, row_offset, column_types)
+            row_offset += len(block)
+
+    def detect_column_types(self, df: pd.DataFrame) -> Dict[str, list]:
+        """Identifierar värde-, datum- och beskrivande kolumner en gång per sheet"""
+        # Identifiera värdekolumner (numeriska kolumner)
+        value_columns = []
+        for col in df.columns:
+            series = df[col]
+            if series.dtype in ('float64', 'int64'):
+                value_columns.append(col)
+            elif _is_text_dtype(series):
+                # Testa första icke-null värdet
+                sample = _first_valid(series)
+                try:
+                    if sample is not None:
+                        pd.to_numeric(sample)
+                        value_columns.append(col)
+                except (ValueError, TypeError):
+                    continue
+        
+        # Identifiera datumkolumner - var mer selektiv
+        date_columns = []
+        for col in df.columns:
+            series = df[col]
+            if series.dtype == 'datetime64[ns]':
+                date_columns.append(col)
+            elif _is_text_dtype(series):
+                # Testa första icke-null värdet mot datummönster
+                sample = _first_valid(series)
+                if sample is not None and isinstance(sample, str):
+                    sample = sample.strip()
+                    if any(pattern.match(sample) for pattern in DATE_PATTERNS):
+                        date_columns.append(col)
+        
+        # Identifiera beskrivande kolumner
+        text_columns = [col for col in df.columns
+                        if col not in value_columns and
+                        col not in date_columns and
+                        col != 'Sheet' and
+                        not str(col).startswith('Unnamed:')]
+        
+        return {"value": value_columns, "date": date_columns, "text": text_columns}
+
     def dataframe_to_documents(self, df: pd.DataFrame, source: str, chunk_size: int = 5) -> List[Document]:
         """Konverterar en DataFrame till en lista av Document-objekt med fokus på data"""
         documents = []
@@ -75,114 +349,112 @@ class StructuredDataProcessor:
             sheet_groups = [('main', df)]
 
         for sheet_name, sheet_df in sheet_groups:
-            # Identifiera värdekolumner (numeriska kolumner)
-            value_columns = sheet_df.select_dtypes(include=['float64', 'int64', 'object']).columns
-            
-            # Försök konvertera object-kolumner till numeriska
-            numeric_columns = []
-            for col in value_columns:
-                if sheet_df[col].dtype == 'object':
-                    # Testa första icke-null värdet
-                    sample = sheet_df[col].dropna().iloc[0] if not sheet_df[col].dropna().empty else None
-                    try:
-                        if sample is not None:
-                            pd.to_numeric(sample)
-                            numeric_columns.append(col)
-                    except:
-                        continue
-                else:
-                    numeric_columns.append(col)
+            column_types = self.detect_column_types(sheet_df)
+            documents.extend(self._sheet_to_documents(sheet_df, source, sheet_name, chunk_size, 0, column_types))
+
+        return documents
+
+    def _sheet_to_documents(self, sheet_df: pd.DataFrame, source: str, sheet_name, chunk_size: int,
+                            row_offset: int, column_types: Dict[str, list]) -> List[Document]:
+        """Formaterar ett sheet (eller ett block av det) kolumnvis och delar upp det i chunks om chunk_size rader"""
+        documents = []
+        if self.table_store is not None:
+            self.table_store.write_block(source, sheet_name, sheet_df, row_offset, column_types)
+        value_columns = [col for col in column_types["value"] if col in sheet_df.columns]
+        date_columns = [col for col in column_types["date"] if col in sheet_df.columns]
+        text_columns = [col for col in column_types["text"] if col in sheet_df.columns]
+        
+        # Formatera alla rader på en gång, en kolumn i taget
+        row_parts = [self._format_date_column(sheet_df[col]) for col in date_columns]
+        row_parts += [self._format_value_column(sheet_df[col]) for col in value_columns]
+        row_texts = _join_columns(row_parts, len(sheet_df))
+        
+        # Processa varje chunk av rader
+        for start_idx in range(0, len(sheet_df), chunk_size):
+            end_idx = min(start_idx + chunk_size, len(sheet_df))
             
-            value_columns = numeric_columns
+            content_parts = []
+            descriptions = []
             
-            # Identifiera datumkolumner - var mer selektiv
-            date_columns = []
-            date_patterns = [
-                r'\d{4}-\d{2}-\d{2}',  # YYYY-MM-DD
-                r'\d{2}/\d{2}/\d{4}',  # DD/MM/YYYY eller MM/DD/YYYY
-                r'\d{4}',              # Endast årtal
-                r'\d{4}[Qq]\d{1}',     # År och kvartal (t.ex. 2019Q1 eller 2019q1)
-            ]
+            # Lägg till diagram/tabell-beskrivning om den finns
+            for col in text_columns:
+                descriptions = sheet_df[col].iloc[start_idx:end_idx].dropna().unique()
+                if len(descriptions) > 0:
+                    content_parts.append(f"Beskrivning: {', '.join(str(d) for d in descriptions)}")
             
-            for col in sheet_df.columns:
-                if sheet_df[col].dtype == 'datetime64[ns]':
-                    date_columns.append(col)
-                elif sheet_df[col].dtype == 'object':
-                    # Testa första icke-null värdet mot datummönster
-                    sample = sheet_df[col].dropna().iloc[0] if not sheet_df[col].dropna().empty else None
-                    if sample is not None and isinstance(sample, str):
-                        sample = sample.strip()
-                        if any(re.match(pattern, sample) for pattern in date_patterns):
-                            date_columns.append(col)
+            # Lägg till data rad för rad
+            content_parts.extend(text for text in row_texts[start_idx:end_idx] if text)
             
-            # Identifiera beskrivande kolumner
-            text_columns = [col for col in sheet_df.columns 
-                           if col not in value_columns and 
-                           col not in date_columns and 
-                           col != 'Sheet' and 
-                           not col.startswith('Unnamed:')]
+            row_start = row_offset + start_idx + 1
+            row_end = row_offset + end_idx
             
-            # Processa varje chunk av rader
-            for start_idx in range(0, len(sheet_df), chunk_size):
-                end_idx = min(start_idx + chunk_size, len(sheet_df))
-                chunk_df = sheet_df.iloc[start_idx:end_idx]
-                
-                content_parts = []
-                
-                # Lägg till diagram/tabell-beskrivning om den finns
-                if text_columns:
-                    for col in text_columns:
-                        descriptions = chunk_df[col].dropna().unique()
-                        if descriptions.size > 0:
-                            content_parts.append(f"Beskrivning: {', '.join(str(d) for d in descriptions)}")
-                
-                # Lägg till data rad för rad
-                for idx, row in chunk_df.iterrows():
-                    row_parts = []
-                    
-                    # Lägg till datum om det finns
-                    for date_col in date_columns:
-                        if pd.notna(row[date_col]):
-                            date_val = str(row[date_col]).strip()
-                            row_parts.append(f"Datum ({date_col}): {date_val}")
-                    
-                    # Lägg till värden
-                    for val_col in value_columns:
-                        if pd.notna(row[val_col]):
-                            try:
-                                value = pd.to_numeric(row[val_col])
-                                formatted_value = f"{value:,.2f}" if isinstance(value, float) else f"{value:,d}"
-                                row_parts.append(f"Värde ({val_col}): {formatted_value}")
-                            except:
-                                # Om värdet inte kan konverteras till numeriskt, lägg till som text
-                                row_parts.append(f"Text ({val_col}): {row[val_col]}")
-                    
-                    if row_parts:
-                        content_parts.append(" | ".join(row_parts))
-                
-                # Skapa metadata
-                metadata = {
-                    "source": source,
-                    "type": "structured_data",
-                    "sheet": sheet_name,
-                    "row_start": start_idx + 1,
-                    "row_end": end_idx,
-                    "description": ", ".join(str(d) for d in descriptions) if text_columns and descriptions.size > 0 else "",
-                    "value_columns": ", ".join(str(col) for col in value_columns),
-                    "date_columns": ", ".join(str(col) for col in date_columns),
-                    "id": f"{source}:{sheet_name}:{start_idx+1}-{end_idx}"
-                }
-
-                # Skapa Document-objekt endast om vi har meningsfullt innehåll
-                if content_parts:
-                    doc = Document(
-                        page_content="\n".join(content_parts),
-                        metadata=metadata
-                    )
-                    documents.append(doc)
+            # Skapa metadata
+            metadata = {
+                "source": source,
+                "type": "structured_data",
+                "sheet": sheet_name,
+                "row_start": row_start,
+                "row_end": row_end,
+                "description": ", ".join(str(d) for d in descriptions) if text_columns and len(descriptions) > 0 else "",
+                "value_columns": ", ".join(str(col) for col in value_columns),
+                "date_columns": ", ".join(str(col) for col in date_columns),
+                "id": f"{source}:{sheet_name}:{row_start}-{row_end}"
+            }
+
+            # Skapa Document-objekt endast om vi har meningsfullt innehåll
+            if content_parts:
+                documents.append(Document(
+                    page_content="\n".join(content_parts),
+                    metadata=metadata
+                ))
 
         return documents
 
+    @staticmethod
+    def _format_date_column(series: pd.Series) -> np.ndarray:
+        """Formaterar en datumkolumn till 'Datum (kolumn): värde', tom sträng där värde saknas"""
+        present = series.notna()
+        values = series[present]
+        # str() på Timestamp ger samma format som tidigare radvisa formatering
+        formatted = (values.map(str) if pd.api.types.is_datetime64_any_dtype(series.dtype)
+                     else values.astype(str)).str.strip()
+        out = np.full(len(series), "", dtype=object)
+        out[present.to_numpy()] = (f"Datum ({series.name}): " + formatted).to_numpy()
+        return out
+
+    @staticmethod
+    def _format_value_column(series: pd.Series) -> np.ndarray:
+        """Formaterar en värdekolumn med tusentalsavgränsare.
+
+        Heltal formateras som heltal och flyttal med två decimaler; värden som inte
+        går att tolka som tal behålls som text.
+        """
+        out = np.full(len(series), "", dtype=object)
+        present = series.notna().to_numpy()
+        if not present.any():
+            return out
+        
+        values = series[present]
+        if series.dtype == 'int64':
+            out[present] = (f"Värde ({series.name}): " + values.map('{:,d}'.format)).to_numpy()
+            return out
+        if series.dtype == 'float64':
+            out[present] = (f"Värde ({series.name}): " + values.map('{:,.2f}'.format)).to_numpy()
+            return out
+        
+        # Textkolumner: tolka hela kolumnen på en gång och avgör heltal/flyttal per värde
+        numeric = pd.to_numeric(values, errors='coerce')
+        is_numeric = numeric.notna()
+        is_integer = is_numeric & values.map(_looks_like_integer).astype(bool)
+        is_float = is_numeric & ~is_integer
+        
+        formatted = pd.Series("", index=values.index, dtype=object)
+        formatted[is_integer] = f"Värde ({series.name}): " + numeric[is_integer].astype('int64').map('{:,d}'.format)
+        formatted[is_float] = f"Värde ({series.name}): " + numeric[is_float].astype('float64').map('{:,.2f}'.format)
+        formatted[~is_numeric] = f"Text ({series.name}): " + values[~is_numeric].astype(str)
+        out[present] = formatted.to_numpy()
+        return out
+
     def _format_chunk_as_text(self, df: pd.DataFrame) -> str:
         """Formaterar en DataFrame-chunk som läsbar text"""
         text_parts = []
@@ -205,4 +477,4 @@ class StructuredDataProcessor:
                         formatted_value = str(value)
                     text_parts.append(f"  {col}: {formatted_value}")
         
-        return "\n".join(text_parts) 
\ No newline at end of file
+        return "\n".join(text_parts)
@@ -0,0 +1,374 @@
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+from bm25_index import tokenize
+from metadata_index import MetadataIndex
+from query_cache import normalize_query
+
+STRUCTURED_STORE_FILENAME = "structured.sqlite3"
+
+# Max antal rader som visas för uppslagsfrågor och max antal radintervall som citeras
+MAX_LOOKUP_ROWS = 10
+MAX_CITED_RANGES = 20
+
+# Längsta flerordsvärde (t.ex. "park place") som matchas mot frågan
+MAX_FILTER_WORDS = 4
+
+# Nyckelord som uttryckligen ber om ett aggregat -> SQL-aggregat; flerordsfraser kontrolleras före enskilda ord
+AGGREGATE_KEYWORDS = {
+    "summa": "SUM", "summan": "SUM", "sum": "SUM", "sammanlagt": "SUM", "sammanlagda": "SUM",
+    "medel": "AVG", "medelvärde": "AVG", "medelvärdet": "AVG", "genomsnitt": "AVG",
+    "genomsnittet": "AVG", "genomsnittlig": "AVG", "genomsnittliga": "AVG", "average": "AVG", "mean": "AVG",
+    "högsta": "MAX", "maximum": "MAX", "highest": "MAX",
+    "lägsta": "MIN", "minimum": "MIN", "lowest": "MIN",
+}
+
+# Vanliga ord som bara räknas som aggregat direkt före värdekolumnens namn ("antal spelare", "total intäkter")
+# och när frågan dessutom nämner tabellen eller ett värde ur den; annars går frågan till sökningen
+CONTEXTUAL_AGGREGATE_KEYWORDS = {
+    "hur många": "COUNT", "how many": "COUNT", "antal": "COUNT", "count": "COUNT",
+    "total": "SUM", "totalt": "SUM", "totala": "SUM",
+    "max": "MAX", "största": "MAX", "min": "MIN", "minsta": "MIN",
+}
+
+AGGREGATE_LABELS = {"SUM": "Summa", "AVG": "Medelvärde", "MAX": "Högsta värde", "MIN": "Lägsta värde",
+                    "COUNT": "Antal"}
+
+_YEAR_PATTERN = re.compile(r"^\d{4}$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cells (
+    source TEXT NOT NULL,
+    sheet TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    col TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    num REAL,
+    text TEXT,
+    text_lower TEXT
+);
+CREATE INDEX IF NOT EXISTS cells_by_column ON cells (source, sheet, col, row);
+CREATE INDEX IF NOT EXISTS cells_by_text ON cells (source, sheet, text_lower);
+CREATE TABLE IF NOT EXISTS columns (
+    source TEXT NOT NULL,
+    sheet TEXT NOT NULL,
+    col TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    PRIMARY KEY (source, sheet, col)
+);
+"""
+
+
+def format_number(value: float) -> str:
+    """Formaterar ett tal som i de strukturerade chunkarna: heltal med tusentalsavgränsare, annars två decimaler"""
+    if float(value).is_integer():
+        return f"{int(value):,d}"
+    return f"{value:,.2f}"
+
+
+def row_ranges(rows: List[int]) -> List[Tuple[int, int]]:
+    """Slår ihop sorterade radnummer till sammanhängande (start, slut)-intervall"""
+    ranges = []
+    for row in rows:
+        if ranges and row == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], row)
+        else:
+            ranges.append((row, row))
+    return ranges
+
+
+def _question_phrases(tokens: List[str]) -> List[str]:
+    """Alla ordföljder i frågan med upp till MAX_FILTER_WORDS ord, för matchning mot cellvärden"""
+    phrases = set()
+    for n in range(1, MAX_FILTER_WORDS + 1):
+        for i in range(len(tokens) - n + 1):
+            phrases.add(" ".join(tokens[i:i + n]))
+    return sorted(phrases)
+
+
+def _contains_phrase(tokens: List[str], phrase_tokens: List[str]) -> bool:
+    n = len(phrase_tokens)
+    return n > 0 and any(tokens[i:i + n] == phrase_tokens for i in range(len(tokens) - n + 1))
+
+
+class StructuredStore:
+    """Tabelldata från Excel/CSV i SQLite, nycklat på samma source/sheet/rad som chunkarnas metadata.
+
+    Varje cell lagras som en rad (source, sheet, row, col) med kolumnens typ från
+    StructuredDataProcessor.detect_column_types, så att summor och uppslag kan
+    räknas ut med SQL i stället för av språkmodellen. Anslutningar öppnas per
+    operation så att lagret kan skrivas från producenttråden och arbetsprocesserna.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def delete_source(self, source: str):
+        """Tar bort alla tabeller från en fil, t.ex. innan den läses in på nytt"""
+        if not self.exists():
+            return
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cells WHERE source = ?", (source,))
+            conn.execute("DELETE FROM columns WHERE source = ?", (source,))
+        conn.close()
+
+    def write_block(self, source: str, sheet, block: "pd.DataFrame", row_offset: int,
+                    column_types: Dict[str, list]):
+        """Skriver ett block av ett sheet; radnumren blir row_offset + position + 1 som i chunkarna"""
+        import pandas as pd
+        
+        sheet = str(sheet)
+        rows = [row_offset + i + 1 for i in range(len(block))]
+        kinds = {col: "text" for col in column_types["text"]}
+        kinds.update({col: "date" for col in column_types["date"]})
+        kinds.update({col: "value" for col in column_types["value"]})
+
+        records = []
+        for col, kind in kinds.items():
+            if col not in block.columns:
+                continue
+            series = block[col]
+            present = series.notna().to_numpy()
+            if not present.any():
+                continue
+            texts = series.map(str).str.strip().to_numpy()
+            if kind == "value":
+                numbers = pd.to_numeric(series, errors="coerce").to_numpy(dtype=float)
+            for i in present.nonzero()[0]:
+                num = None
+                if kind == "value" and numbers[i] == numbers[i]:
+                    num = float(numbers[i])
+                records.append((source, sheet, rows[i], str(col), kind, num, texts[i], texts[i].lower()))
+
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO columns (source, sheet, col, kind) VALUES (?, ?, ?, ?)",
+                [(source, sheet, str(col), kind) for col, kind in kinds.items() if col in block.columns],
+            )
+            conn.executemany(
+                "INSERT INTO cells (source, sheet, row, col, kind, num, text, text_lower) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                records,
+            )
+        conn.close()
+
+    def answer(self, question: str, where: dict = None) -> Optional[dict]:
+        """Besvarar en aggregerings- eller uppslagsfråga över tabelldata.
+
+        Returnerar {"answer", "sources", "seconds"} där sources är metadata i samma
+        form som de strukturerade chunkarna, eller None om frågan inte gäller tabellerna.
+        Med ett metadatafilter (samma syntax som i sökningen) används bara de tabeller
+        vars chunks filtret släpper igenom.
+        """
+        if not self.exists():
+            return None
+        started = time.perf_counter()
+        tokens = tokenize(normalize_query(question))
+
+        conn = self._connect()
+        try:
+            candidates = self._match_tables(conn, tokens, where)
+            if not candidates:
+                return None
+            lines, sources = [], []
+            for source, sheet, value_col, filters in candidates:
+                table_named = bool(filters) or self._mentions_table(tokens, source, sheet)
+                aggregate = self._detect_aggregate(tokens, value_col, table_named)
+                if aggregate is None and not filters:
+                    continue
+                rows = self._filtered_rows(conn, source, sheet, filters)
+                if aggregate:
+                    line, cited = self._aggregate(conn, aggregate, source, sheet, value_col, rows)
+                else:
+                    line, cited = self._lookup(conn, source, sheet, value_col, rows)
+                if line is None:
+                    continue
+                condition = " och ".join(f"{col} = {', '.join(values)}" for col, values in filters.items())
+                lines.append(f"{line} ({source}, {sheet}{', ' + condition if condition else ''})")
+                sources.extend(self._sources(source, sheet, cited))
+        finally:
+            conn.close()
+
+        if not lines:
+            return None
+        return {"answer": "\n".join(lines), "sources": sources, "seconds": time.perf_counter() - started}
+
+    @staticmethod
+    def _detect_aggregate(tokens: List[str], value_col: str, table_named: bool) -> Optional[str]:
+        """Aggregatet som frågan uttryckligen ber om för värdekolumnen, eller None"""
+        for keyword, aggregate in AGGREGATE_KEYWORDS.items():
+            if _contains_phrase(tokens, keyword.split()):
+                return aggregate
+        if table_named:
+            col_tokens = tokenize(value_col)
+            for keyword, aggregate in CONTEXTUAL_AGGREGATE_KEYWORDS.items():
+                if _contains_phrase(tokens, keyword.split() + col_tokens):
+                    return aggregate
+        return None
+
+    @staticmethod
+    def _mentions_table(tokens: List[str], source: str, sheet: str) -> bool:
+        """Om frågan nämner filen (utan filändelse) eller sheetets namn"""
+        names = [os.path.splitext(source)[0]] + ([sheet] if sheet != "main" else [])
+        return any(_contains_phrase(tokens, tokenize(name)) for name in names)
+
+    def _match_tables(self, conn: sqlite3.Connection, tokens: List[str], where: dict = None):
+        """Hittar (source, sheet, värdekolumn, filter) för värdekolumner som nämns i frågan.
+
+        Filter är text- eller datumvärden ur samma sheet som förekommer i frågan,
+        grupperade per kolumn. Finns samma kolumn i flera sheets behålls bara de
+        sheets där flest filterkolumner matchar.
+        """
+        columns = conn.execute("SELECT source, sheet, col, kind FROM columns").fetchall()
+        if where:
+            allowed = self._allowed_tables({(source, sheet) for source, sheet, _col, _kind in columns}, where)
+            columns = [column for column in columns if (column[0], column[1]) in allowed]
+        value_columns = {}
+        for source, sheet, col, kind in columns:
+            col_tokens = tokenize(col)
+            if kind == "value" and _contains_phrase(tokens, col_tokens):
+                # Längsta matchande kolumnnamnet vinner inom ett sheet ("Antal spelare" före "Antal")
+                current = value_columns.get((source, sheet))
+                if current is None or len(col_tokens) > len(tokenize(current)):
+                    value_columns[(source, sheet)] = col
+
+        phrases = _question_phrases(tokens)
+        years = [token for token in tokens if _YEAR_PATTERN.match(token)]
+        candidates = []
+        for (source, sheet), value_col in value_columns.items():
+            filters = self._match_filters(conn, source, sheet, phrases, years)
+            # Ord som redan är kolumnnamnet räknas inte som filter
+            filters.pop(value_col, None)
+            candidates.append((source, sheet, value_col, filters))
+
+        if not candidates:
+            return []
+        best = max(len(filters) for *_rest, filters in candidates)
+        return [candidate for candidate in candidates if len(candidate[3]) == best]
+
+    @staticmethod
+    def _allowed_tables(tables, where: dict):
+        """De (source, sheet) vars chunks matchar filtret; tabellchunkarna har type=structured_data och ingen sida"""
+        tables = sorted(tables)
+        index = MetadataIndex.build(
+            (f"{source}:{sheet}", {"source": source, "type": "structured_data", "sheet": sheet})
+            for source, sheet in tables
+        )
+        return {table for table, keep in zip(tables, index.mask(where)) if keep}
+
+    @staticmethod
+    def _match_filters(conn: sqlite3.Connection, source: str, sheet: str, phrases: List[str],
+                       years: List[str]) -> Dict[str, List[str]]:
+        filters = {}
+        if phrases:
+            placeholders = ", ".join("?" for _ in phrases)
+            for col, value in conn.execute(
+                f"SELECT DISTINCT col, text FROM cells WHERE source = ? AND sheet = ? "
+                f"AND kind IN ('text', 'date') AND text_lower IN ({placeholders})",
+                [source, sheet, *phrases],
+            ):
+                filters.setdefault(col, []).append(value)
+        for year in years:
+            # Årtal matchar datumkolumner på prefix (2019 -> 2019-03-01, 2019Q1) och årtalskolumner exakt
+            for col, kind in conn.execute(
+                "SELECT DISTINCT col, kind FROM cells WHERE source = ? AND sheet = ? AND "
+                "((kind = 'date' AND text_lower LIKE ?) OR (kind = 'value' AND text_lower = ?))",
+                (source, sheet, f"{year}%", year),
+            ):
+                if col not in filters:
+                    filters[col] = [f"{year}*" if kind == "date" else year]
+        return filters
+
+    @staticmethod
+    def _filtered_rows(conn: sqlite3.Connection, source: str, sheet: str,
+                       filters: Dict[str, List[str]]) -> Optional[List[int]]:
+        """Rader som uppfyller alla filter (ELLER inom en kolumn, OCH mellan kolumner); None = alla rader"""
+        if not filters:
+            return None
+        rows = None
+        for col, values in filters.items():
+            exact = [value.lower() for value in values if not value.endswith("*")]
+            prefixes = [value[:-1].lower() + "%" for value in values if value.endswith("*")]
+            conditions = []
+            params = [source, sheet, col]
+            if exact:
+                conditions.append(f"text_lower IN ({', '.join('?' for _ in exact)})")
+                params.extend(exact)
+            for prefix in prefixes:
+                conditions.append("text_lower LIKE ?")
+                params.append(prefix)
+            matched = {row for (row,) in conn.execute(
+                f"SELECT row FROM cells WHERE source = ? AND sheet = ? AND col = ? AND ({' OR '.join(conditions)})",
+                params,
+            )}
+            rows = matched if rows is None else rows & matched
+        return sorted(rows)
+
+    @staticmethod
+    def _value_cells(conn: sqlite3.Connection, source: str, sheet: str, value_col: str,
+                     rows: Optional[List[int]]) -> Tuple[str, list]:
+        """FROM/WHERE-delen och parametrarna för kolumnens talceller, valfritt begränsade till rows"""
+        where = "WHERE c.source = ? AND c.sheet = ? AND c.col = ? AND c.num IS NOT NULL"
+        params = [source, sheet, value_col]
+        if rows is None:
+            return f"FROM cells c {where}", params
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS selected_rows (row INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM selected_rows")
+        conn.executemany("INSERT INTO selected_rows (row) VALUES (?)", [(row,) for row in rows])
+        return f"FROM cells c JOIN selected_rows s ON c.row = s.row {where}", params
+
+    def _aggregate(self, conn: sqlite3.Connection, aggregate: str, source: str, sheet: str,
+                   value_col: str, rows: Optional[List[int]]):
+        """Räknar ut aggregatet i SQLite; num är redan REAL (skrivs med pd.to_numeric i write_block)"""
+        cells, params = self._value_cells(conn, source, sheet, value_col, rows)
+        result, count = conn.execute(f"SELECT {aggregate}(c.num), COUNT(*) {cells}", params).fetchone()
+        if not count:
+            return None, []
+        if aggregate in ("MAX", "MIN"):
+            # Första raden med det högsta/lägsta värdet citeras
+            order = "DESC" if aggregate == "MAX" else "ASC"
+            (row,) = conn.execute(f"SELECT c.row {cells} ORDER BY c.num {order}, c.row LIMIT 1", params).fetchone()
+            cited = [(row, row)]
+        else:
+            # Sammanhängande radintervall (rad - radnummer är konstant inom ett intervall)
+            cited = conn.execute(
+                f"SELECT MIN(row), MAX(row) FROM (SELECT c.row AS row, c.row - ROW_NUMBER() OVER (ORDER BY c.row) "
+                f"AS run {cells}) GROUP BY run ORDER BY 1 LIMIT ?",
+                [*params, MAX_CITED_RANGES],
+            ).fetchall()
+        label = AGGREGATE_LABELS[aggregate]
+        return f"{label} av {value_col}: {format_number(result)} ({count} rader)", cited
+
+    def _lookup(self, conn: sqlite3.Connection, source: str, sheet: str, value_col: str,
+                rows: Optional[List[int]]):
+        cells, params = self._value_cells(conn, source, sheet, value_col, rows)
+        (count,) = conn.execute(f"SELECT COUNT(*) {cells}", params).fetchone()
+        if not count:
+            return None, []
+        shown = conn.execute(f"SELECT c.row, c.num {cells} ORDER BY c.row LIMIT ?",
+                             [*params, MAX_LOOKUP_ROWS]).fetchall()
+        parts = [f"rad {row}: {format_number(num)}" for row, num in shown]
+        if count > len(shown):
+            parts.append(f"och {count - len(shown)} rader till")
+        return f"{value_col}: {'; '.join(parts)}", row_ranges([row for row, _num in shown])
+
+    @staticmethod
+    def _sources(source: str, sheet: str, ranges: List[Tuple[int, int]]) -> List[dict]:
+        """Citerade radintervall som metadata i samma form som de strukturerade chunkarna (för format_source)"""
+        return [
+            {"source": source, "type": "structured_data", "sheet": sheet, "row_start": start, "row_end": end}
+            for start, end in ranges[:MAX_CITED_RANGES]
+        ]
@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+
+def _default_responder(prompt: str) -> str:
+    return "Stubbsvar."
+
+
+class StubCompletionServer:
+    """Minimal OpenAI-kompatibel /v1/completions-server för tester och benchmarks.
+
+    Svaret bestäms av responder(prompt). Strömmande anrop ("stream": true) får svaret
+    som server-sent events, ett ord per event. Servern räknar anrop och unika
+    klientanslutningar så att tester kan verifiera connection pooling, och högsta
+    antalet samtidiga anrop (peak_in_flight) så att de kan verifiera parallellitet.
+    """
+
+    def __init__(self, responder: Optional[Callable[[str], str]] = None, latency: float = 0.0,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.responder = responder or _default_responder
+        self.latency = latency
+        self.requests = []
+        self.connections = set()
+        self.peak_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubCompletionServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                prompt = payload.get("prompt", "")
+                if isinstance(prompt, list):
+                    prompt = prompt[0] if prompt else ""
+                with server._lock:
+                    server.requests.append(payload)
+                    server.connections.add(self.client_address)
+                    server._in_flight += 1
+                    server.peak_in_flight = max(server.peak_in_flight, server._in_flight)
+                try:
+                    if server.latency:
+                        time.sleep(server.latency)
+                    text = server.responder(prompt)
+                finally:
+                    with server._lock:
+                        server._in_flight -= 1
+
+                if payload.get("stream"):
+                    words = text.split(" ")
+                    events = [
+                        _completion_body(payload, word if i == 0 else " " + word, None)
+                        for i, word in enumerate(words)
+                    ]
+                    events.append(_completion_body(payload, "", "stop"))
+                    body = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+                    content_type = "text/event-stream"
+                else:
+                    body = json.dumps(_completion_body(payload, text, "stop"))
+                    content_type = "application/json"
+
+                data = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def _completion_body(payload: dict, text: str, finish_reason: Optional[str]) -> dict:
+    return {
+        "id": "cmpl-stub",
+        "object": "text_completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "stub"),
+        "choices": [{"text": text, "index": 0, "logprobs": None, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
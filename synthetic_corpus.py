@@ -0,0 +1,148 @@
+import argparse
+import csv
+import os
+import textwrap
+from typing import Dict, List
+
+import numpy as np
+
+# Ord som gör texten lik våra regelböcker; resten av ordförrådet är syntetiskt
+GAME_WORDS = (
+    "spelare", "tärning", "tärningar", "bank", "banken", "pengar", "kronor", "gata", "gator", "hus", "hotell",
+    "fängelse", "chans", "allmänning", "hyra", "köpa", "sälja", "auktion", "inteckning", "runda", "start",
+    "passera", "kort", "bricka", "brädet", "tur", "regel", "vinnare", "poäng", "tåg", "vagnar", "rutt",
+    "station", "biljett", "färg", "längsta", "sträcka", "drag", "omgång", "motspelare",
+)
+STREET_COLORS = ("Brun", "Ljusblå", "Rosa", "Orange", "Röd", "Gul", "Grön", "Mörkblå")
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+LINES_PER_PAGE = 60
+LINE_WIDTH = 95
+
+
+class TextGenerator:
+    """Slumpad text med Zipf-fördelade ord, så att BM25 och embeddings får realistisk termstatistik"""
+
+    def __init__(self, vocabulary_size: int = 5000, seed: int = 0):
+        self.rng = np.random.default_rng(seed)
+        synthetic = [f"{a}{b}" for a in ("ka", "lo", "mi", "su", "te", "ra", "no", "vi", "de", "po")
+                     for b in range(vocabulary_size // 10)]
+        self.vocabulary = list(GAME_WORDS) + synthetic[:max(0, vocabulary_size - len(GAME_WORDS))]
+        ranks = np.arange(1, len(self.vocabulary) + 1)
+        self.weights = 1.0 / ranks / (1.0 / ranks).sum()
+
+    def words(self, n: int) -> List[str]:
+        return [self.vocabulary[i] for i in self.rng.choice(len(self.vocabulary), n, p=self.weights)]
+
+    def sentence(self) -> str:
+        words = self.words(int(self.rng.integers(6, 18)))
+        return " ".join(words).capitalize() + "."
+
+    def page(self, sentences: int = 25) -> str:
+        return " ".join(self.sentence() for _ in range(sentences))
+
+    def question(self) -> str:
+        """En fråga med några av korpusens ord, som frågorna i chatten"""
+        return "Hur fungerar " + " ".join(self.words(int(self.rng.integers(2, 5)))) + "?"
+
+
+def _pdf_text(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: List[str]):
+    """Skriver en minimal PDF med en textsida per element i pages (Helvetica, WinAnsi-kodning)"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"]
+    page_refs = []
+    for text in pages:
+        lines = textwrap.wrap(text, LINE_WIDTH)[:LINES_PER_PAGE]
+        stream = "BT /F1 9 Tf 11 TL 40 {} Td ".format(PAGE_HEIGHT - 50) + " ".join(
+            f"({_pdf_text(line)}) Tj T*" for line in lines) + " ET"
+        content = stream.encode("cp1252", errors="replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        objects.append(("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R >> >> "
+                        "/Contents %d 0 R >>" % (PAGE_WIDTH, PAGE_HEIGHT, len(objects))).encode())
+        page_refs.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>".encode()
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def write_table(path: str, rows: int, rng: np.random.Generator):
+    """Skriver en gatu-/pristabell som CSV eller Excel beroende på filändelsen"""
+    header = ["Namn", "Färg", "Pris", "Hyra", "År"]
+    records = [
+        [f"Gata {i + 1}", STREET_COLORS[i % len(STREET_COLORS)], int(rng.integers(60, 400)) * 10,
+         int(rng.integers(2, 50)) * 10, int(rng.integers(1935, 2025))]
+        for i in range(rows)
+    ]
+    if path.endswith(".xlsx"):
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("Gator")
+        sheet.append(header)
+        for record in records:
+            sheet.append(record)
+        workbook.save(path)
+    else:
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(records)
+
+
+def generate_corpus(path: str, pdf_files: int = 10, pages_per_file: int = 20, table_files: int = 2,
+                    rows_per_table: int = 1000, table_format: str = "csv", seed: int = 0) -> Dict[str, int]:
+    """Skriver en syntetisk korpus med PDF-regelböcker och tabeller till path och returnerar storleken"""
+    os.makedirs(path, exist_ok=True)
+    generator = TextGenerator(seed=seed)
+    for i in range(pdf_files):
+        write_pdf(os.path.join(path, f"regelbok_{i:04d}.pdf"),
+                  [generator.page() for _ in range(pages_per_file)])
+    for i in range(table_files):
+        write_table(os.path.join(path, f"tabell_{i:04d}.{table_format}"), rows_per_table, generator.rng)
+    total_bytes = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+    return {
+        "pdf_files": pdf_files,
+        "pdf_pages": pdf_files * pages_per_file,
+        "table_files": table_files,
+        "table_rows": table_files * rows_per_table,
+        "bytes": total_bytes,
+    }
+
+
+def sample_questions(n: int, seed: int = 1) -> List[str]:
+    generator = TextGenerator(seed=seed)
+    return [generator.question() for _ in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genererar en syntetisk korpus med PDF:er och tabeller")
+    parser.add_argument("path", help="Katalog att skriva filerna till.")
+    parser.add_argument("--pdf-files", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=20, help="Sidor per PDF.")
+    parser.add_argument("--tables", type=int, default=2)
+    parser.add_argument("--rows", type=int, default=1000, help="Rader per tabell.")
+    parser.add_argument("--table-format", choices=("csv", "xlsx"), default="csv")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    size = generate_corpus(args.path, args.pdf_files, args.pages, args.tables, args.rows,
+                           args.table_format, args.seed)
+    print(f"✅ Skrev {size['pdf_pages']} PDF-sidor och {size['table_rows']} tabellrader "
+          f"({size['bytes'] / 1e6:.1f} MB) till {args.path}")
+
+
+if __name__ == "__main__":
+    main()
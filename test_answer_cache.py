@@ -0,0 +1,67 @@
+from answer_cache import SemanticAnswerCache, depends_on_history
+
+SOURCES = [{"source": "monopol.pdf", "page": 3}]
+
+
+def test_similar_question_hits_and_distant_misses():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store("Hur mycket kostar ett hotell?", [1.0, 0.0, 0.0], "250 kr", SOURCES, "v1")
+
+    hit = cache.lookup([0.98, 0.1, 0.0], "v1")
+    assert hit["answer"] == "250 kr"
+    assert hit["sources"] == SOURCES
+    assert hit["similarity"] > 0.9
+    assert cache.lookup([0.5, 0.8, 0.0], "v1") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_new_corpus_version_and_other_filter_miss():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store("Hur mycket kostar ett hotell?", [1.0, 0.0], "250 kr", SOURCES, "v1",
+                where={"source": "monopol.pdf"})
+
+    assert cache.lookup([1.0, 0.0], "v1") is None
+    assert cache.lookup([1.0, 0.0], "v1", where={"source": "monopol.pdf"})["answer"] == "250 kr"
+    assert cache.lookup([1.0, 0.0], "v2", where={"source": "monopol.pdf"}) is None
+    assert len(cache) == 0
+
+
+def test_lru_eviction_and_persistence(tmp_path):
+    path = str(tmp_path / "answers.pkl")
+    cache = SemanticAnswerCache(max_size=2, threshold=0.99, path=path)
+    cache.store("a", [1.0, 0.0, 0.0], "A", [], "v1")
+    cache.store("b", [0.0, 1.0, 0.0], "B", [], "v1")
+    assert cache.lookup([1.0, 0.0, 0.0], "v1")["answer"] == "A"
+    cache.store("c", [0.0, 0.0, 1.0], "C", [], "v1")
+    cache.save()
+
+    reopened = SemanticAnswerCache(max_size=2, threshold=0.99, path=path)
+    assert reopened.lookup([0.0, 1.0, 0.0], "v1") is None
+    assert reopened.lookup([1.0, 0.0, 0.0], "v1")["answer"] == "A"
+    assert reopened.lookup([0.0, 0.0, 1.0], "v1")["answer"] == "C"
+
+
+def test_follow_up_questions_depend_on_history():
+    history = [("Hur mycket kostar ett hotell på Norrmalmstorg?", "2000 kr")]
+
+    assert not depends_on_history("Och hus då?", [])
+    assert depends_on_history("Och hus då?", history)
+    assert depends_on_history("Men om jag äger alla gator?", history)
+    assert depends_on_history("Gäller samma regel för hus?", history)
+    assert depends_on_history("Kan man bygga hotell där också?", history)
+    assert depends_on_history("Hur mycket kostar den?", history)
+    assert depends_on_history("Varför?", history)
+    assert not depends_on_history("Hur många hus finns i banken?", history)
+
+
+def test_standalone_swedish_questions_do_not_depend_on_history():
+    history = [("Hur mycket kostar ett hotell på Norrmalmstorg?", "2000 kr"), ("Och hus?", "200 kr")]
+
+    for question in ["Vad kostar det på Strandvägen?",
+                     "Hur mycket kostar det att bygga ett hotell på Strandvägen?",
+                     "Vad händer när man hamnar i fängelse?",
+                     "Hur många poäng ger den längsta tågrutten?",
+                     "Vad gör man då man passerar Gå?",
+                     "Får man bygga fler hus än de som finns i banken?",
+                     "Hur mycket mer kostar ett hotell än ett hus?"]:
+        assert not depends_on_history(question, history), question
@@ -0,0 +1,65 @@
+import numpy as np
+from rank_bm25 import BM25Okapi
+
+from bm25_index import BM25Index, tokenize
+
+CORPUS = [
+    "Varje spelare börjar med 1500 kr i Monopol.",
+    "Banken betalar ut 200 kr när spelaren passerar Gå.",
+    "Den längsta sammanhängande tågsträckan ger 10 poäng i Ticket to Ride.",
+    "Spelaren som har den längsta tågsträckan får bonuskortet.",
+    "Om du hamnar i fängelse måste du slå dubbelt för att komma ut.",
+]
+
+
+def test_scores_match_rank_bm25():
+    index = BM25Index.build([f"doc-{i}" for i in range(len(CORPUS))], CORPUS)
+    reference = BM25Okapi([tokenize(doc) for doc in CORPUS])
+
+    for query in ["längsta tågsträckan", "spelaren kr kr", "okänt ord"]:
+        expected = reference.get_scores(tokenize(query))
+        np.testing.assert_allclose(index.get_scores(query), expected, rtol=1e-5, atol=1e-6)
+
+
+def test_top_k_only_returns_matching_documents():
+    index = BM25Index.build([f"doc-{i}" for i in range(len(CORPUS))], CORPUS)
+
+    hits = index.top_k("längsta tågsträckan poäng", 3)
+
+    assert [position for position, _ in hits] == [2, 3]
+    assert hits[0][1] > hits[1][1] > 0
+    assert index.top_k("finns inte", 3) == []
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    index = BM25Index.build([f"doc-{i}" for i in range(len(CORPUS))], CORPUS)
+    path = str(tmp_path / "bm25_index.npz")
+
+    index.save(path)
+    loaded = BM25Index.load(path)
+
+    assert loaded.ids == index.ids
+    np.testing.assert_allclose(loaded.get_scores("fängelse dubbelt"), index.get_scores("fängelse dubbelt"))
+
+
+def test_top_k_many_matches_single_queries():
+    index = BM25Index.build([f"doc-{i}" for i in range(len(CORPUS))], CORPUS)
+    queries = ["längsta tågsträckan poäng", "spelaren kr kr", "okänt ord", "fängelse"]
+
+    assert index.top_k_many(queries, 2) == [index.top_k(query, 2) for query in queries]
+
+
+def test_update_matches_full_rebuild():
+    ids = [f"doc-{i}" for i in range(len(CORPUS))]
+    index = BM25Index.build(ids, CORPUS)
+
+    changed = "Den längsta tågsträckan ger numera 15 poäng."
+    added = "Hotell kostar 200 kr mer än ett hus."
+    updated = index.update(["doc-4"], [("doc-2", changed), ("doc-5", added)])
+
+    expected_ids = ["doc-0", "doc-1", "doc-3", "doc-2", "doc-5"]
+    expected = BM25Index.build(expected_ids, [CORPUS[0], CORPUS[1], CORPUS[3], changed, added])
+    assert updated.ids == expected_ids
+    assert "fängelse" not in updated.term_ids
+    for query in ["längsta tågsträckan poäng", "hotell kr", "fängelse dubbelt", "spelaren"]:
+        np.testing.assert_allclose(updated.get_scores(query), expected.get_scores(query), rtol=1e-6)
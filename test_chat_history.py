@@ -0,0 +1,47 @@
+from chat_history import ChatHistory
+from search_engine import build_chat_prompt
+
+
+def test_window_stays_within_budget_and_compacts_in_batches():
+    history = ChatHistory(token_budget=100)
+    prefixes = []
+    for i in range(20):
+        history.append(f"Fråga {i}?", "Svar " + "x" * 60)
+        assert history.tokens() <= 100
+        prefixes.append(history.render().split("\n")[0])
+
+    assert history.turns[-1][0] == "Fråga 19?"
+    # Fönstret flyttas inte varje tur, så historikens början är ofta oförändrad
+    assert sum(a == b for a, b in zip(prefixes, prefixes[1:])) >= len(prefixes) // 2
+
+
+def test_evicted_turns_are_summarized():
+    calls = []
+
+    def summarizer(summary, turns):
+        calls.append(turns)
+        return (summary + " " + " ".join(q for q, _a in turns)).strip()
+
+    history = ChatHistory(token_budget=60, summarizer=summarizer)
+    for i in range(6):
+        history.append(f"Fråga {i}?", "Svar " + "y" * 40)
+
+    assert calls
+    assert history.summary.startswith("Fråga 0?")
+    assert history.render().startswith("Sammanfattning av tidigare samtal: Fråga 0?")
+    assert "Fråga 5?" in history.render()
+
+
+def test_oversized_answer_is_clipped():
+    history = ChatHistory(token_budget=50)
+    history.append("Vad står i regelboken?", "z" * 1000)
+    assert len(history) == 1
+    assert history.tokens() <= 50
+
+
+def test_prompt_starts_with_stable_system_prompt():
+    first = build_chat_prompt("SYSTEM", "Fråga 1", "kontext 1", "")
+    second = build_chat_prompt("SYSTEM", "Fråga 2", "kontext 2", "Användare: Fråga 1\nAssistent: Svar")
+
+    assert first.startswith("SYSTEM\n") and second.startswith("SYSTEM\n")
+    assert second.index("Historik:") < second.index("Kontext:") < second.index("Användare: Fråga 2")
@@ -0,0 +1,77 @@
+from context_builder import DEFAULT_SEPARATOR, ContextAssembler, reciprocal_rank_fusion
+
+
+def _hit(text, source, score=1.0):
+    return {"page_content": text, "metadata": {"source": source}}, score
+
+
+def _words(text):
+    return len(text.split())
+
+
+def test_rrf_orders_by_summed_reciprocal_rank_and_merges_duplicates():
+    bm25 = [_hit("A.", "a"), _hit("B.", "b"), _hit("C.", "c")]
+    dense = [_hit("C.", "c"), _hit("  a. ", "a"), _hit("D.", "d")]
+
+    fused = reciprocal_rank_fusion([bm25, dense], k=1)
+
+    assert [doc["metadata"]["source"] for doc, _score in fused] == ["a", "c", "b", "d"]
+    assert [score for _doc, score in fused] == [1 / 2 + 1 / 3, 1 / 4 + 1 / 2, 1 / 3, 1 / 4]
+
+
+def test_same_chunk_in_both_legs_is_sent_once():
+    chunk = "Hotell kostar 200 kr. Hus kostar 50 kr."
+    context, selected = ContextAssembler().assemble([[_hit(chunk, "regler.pdf")], [_hit(chunk, "regler.pdf")]])
+
+    assert context == chunk
+    assert len(selected) == 1
+
+
+def test_overlapping_sentences_from_neighbour_chunks_are_dropped():
+    first = "Varje spelare börjar med 1500 kr. Hotell kostar 200 kr."
+    second = "Hotell kostar 200 kr. Den som hamnar i fängelse står över."
+
+    context, selected = ContextAssembler().assemble([[_hit(first, "p1"), _hit(second, "p2")]])
+
+    assert context == first + DEFAULT_SEPARATOR + "Den som hamnar i fängelse står över."
+    assert context.count("Hotell kostar 200 kr.") == 1
+    assert [doc["metadata"]["source"] for doc, _score in selected] == ["p1", "p2"]
+
+
+def test_chunks_are_packed_within_the_token_budget():
+    hits = [_hit("ett två tre fyra.", "a"), _hit("fem sex sju åtta nio tio.", "b"), _hit("elva tolv.", "c")]
+    assembler = ContextAssembler(token_budget=7, separator=" | ", token_counter=_words)
+
+    context, selected = assembler.assemble([hits])
+
+    # "b" ryms inte efter "a", men den mindre "c" gör det
+    assert context == "ett två tre fyra. | elva tolv."
+    assert _words(context) <= 7
+    assert [doc["metadata"]["source"] for doc, _score in selected] == ["a", "c"]
+
+
+def test_oversized_first_chunk_is_truncated_and_empty_items_are_skipped():
+    too_long = _hit("ett två tre fyra fem sex sju åtta nio tio elva.", "lång")
+    truncatable = _hit("ett två tre. fyra fem sex sju åtta nio.", "kortas")
+    assembler = ContextAssembler(token_budget=4, token_counter=_words)
+
+    context, selected = assembler.assemble([[too_long, truncatable]])
+
+    assert context == "ett två tre."
+    assert [(doc["page_content"], doc["metadata"]["source"]) for doc, _score in selected] == [("ett två tre.", "kortas")]
+
+    context, selected = assembler.assemble([[too_long]])
+    assert context == "" and selected == []
+
+
+def test_citations_stay_aligned_with_the_emitted_text():
+    hits = [_hit(f"Regel {i} gäller. Delad mening.", f"fil{i}.pdf") for i in range(5)]
+    assembler = ContextAssembler(token_budget=20)
+
+    context, selected = assembler.assemble([hits, list(reversed(hits))])
+
+    parts = context.split(DEFAULT_SEPARATOR)
+    assert parts == [doc["page_content"] for doc, _score in selected]
+    for part, (doc, _score) in zip(parts, selected):
+        number = doc["metadata"]["source"][len("fil"):-len(".pdf")]
+        assert part.startswith(f"Regel {number} gäller.")
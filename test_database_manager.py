@@ -0,0 +1,168 @@
+import os
+import sys
+
+from langchain_core.documents import Document
+
+import database_manager
+import populate_database
+from database_manager import DatabaseManager
+from embedding_cache import CachedEmbeddings
+from search_engine import SearchEngine
+from synthetic_corpus import write_pdf
+
+
+def test_ivfpq_refresh_on_empty_corpus_then_add(tmp_path, embeddings):
+    path = str(tmp_path / "chroma")
+    DatabaseManager(path, vector_backend="memmap", dense_index="ivfpq").refresh_indexes()
+
+    db = DatabaseManager(path, vector_backend="memmap", dense_index="ivfpq")
+    chunks = [Document(page_content=f"hotell {i} kostar", metadata={"source": "a.pdf", "page": i}) for i in range(5)]
+    ids = db.add_documents(chunks)
+
+    assert ids is not None and len(ids) == 5
+    assert db.ann_index.is_trained
+    documents, _metadatas, _scores = db.similarity_search_by_vector(embeddings.embed_query("hotell 3"), 2)
+    assert "hotell 3 kostar" in documents
+
+
+def test_lexical_hits_stay_paired_when_index_lags_store(tmp_path, embeddings):
+    db = DatabaseManager(str(tmp_path / "chroma"), vector_backend="memmap")
+    texts = ["hotell kostar pengar", "hotell på gata", "gata gata hotell", "tärning och fängelse", "auktion i banken"]
+    chunks = [Document(page_content=text, metadata={"source": "a.pdf", "page": i}) for i, text in enumerate(texts)]
+    ids = db.add_documents(chunks)
+    # Ta bort en chunk utan att bygga om BM25-indexet, som under en pågående inläsning
+    db.delete_chunks([ids[1]])
+
+    index = db.load_lexical_index()
+    expected_scores = {index.ids[position]: score for position, score in index.top_k("hotell gata", 5)}
+
+    search_engine = SearchEngine("", embeddings, db_manager=db)
+    try:
+        results = search_engine._lexical_search("hotell gata", 5)
+        batch_results = search_engine.search_many(["hotell gata"], top_k=5)[0]
+    finally:
+        search_engine.close()
+
+    assert len(results) == 2
+    for doc, score in results:
+        assert doc["metadata"]["id"] != ids[1]
+        assert doc["page_content"] == texts[doc["metadata"]["page"]]
+        assert score == expected_scores[doc["metadata"]["id"]]
+    assert ids[1] not in {doc["metadata"]["id"] for doc, _score in batch_results}
+
+
+def _write_csv(path, prices):
+    with open(path, "w") as f:
+        f.write("Namn,Pris\n" + "".join(f"Gata {i},{price}\n" for i, price in enumerate(prices)))
+
+
+def _populate(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["populate_database.py", *args])
+    populate_database.main()
+
+
+def test_incremental_populate_updates_only_changed_files(tmp_path, monkeypatch, embeddings):
+    model = embeddings
+    cached = CachedEmbeddings(model, str(tmp_path / "embeddings.sqlite3"))
+    monkeypatch.setattr(database_manager, "get_embedding_function", lambda *args, **kwargs: cached)
+    data_path, chroma_path = tmp_path / "data", str(tmp_path / "chroma")
+    data_path.mkdir()
+    monkeypatch.setattr(populate_database, "DATA_PATH", str(data_path))
+    monkeypatch.setattr(populate_database, "CHROMA_PATH", chroma_path)
+    # Tillräckligt många chunks för att ändringarna ska vara under INCREMENTAL_MAX_RATIO av korpusen
+    write_pdf(str(data_path / "regler.pdf"), ["Varje spelare börjar med 1500 kr.", "Hotell kostar 200 kr.",
+                                              "Hus kostar 50 kr.", "Den som hamnar i fängelse står över.",
+                                              "Gå kan ge 200 kr.", "Ticket to Ride har tåg."])
+    _write_csv(data_path / "priser.csv", [100 + 10 * i for i in range(12)])
+    _write_csv(data_path / "gamla.csv", [1, 2, 3])
+
+    _populate(monkeypatch)
+    db = DatabaseManager(chroma_path)
+    before = {file: set(entry["chunk_ids"]) for file, entry in db.load_manifest()["files"].items()}
+    assert before["priser.csv"] == {"priser.csv:main:1-5", "priser.csv:main:6-10", "priser.csv:main:11-12"}
+    assert len(before["regler.pdf"]) == 6 and all(doc_id.startswith("regler.pdf:") for doc_id in before["regler.pdf"])
+
+    # Ändra ett pris i andra chunken och ta bort en fil
+    _write_csv(data_path / "priser.csv", [100 + 10 * i if i != 7 else 999 for i in range(12)])
+    os.remove(data_path / "gamla.csv")
+    model.embedded.clear()
+
+    def full_rebuild(self):
+        raise AssertionError("en inkrementell körning ska inte bygga om BM25-indexet från grunden")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(DatabaseManager, "rebuild_lexical_index", full_rebuild)
+        _populate(monkeypatch, "--incremental")
+
+    db = DatabaseManager(chroma_path)
+    after = {file: set(entry["chunk_ids"]) for file, entry in db.load_manifest()["files"].items()}
+    assert after == {"regler.pdf": before["regler.pdf"], "priser.csv": before["priser.csv"]}
+    stored_ids = set(db.get_all_documents()["ids"])
+    assert stored_ids == before["regler.pdf"] | before["priser.csv"]
+    # Bara chunken med det ändrade priset bäddas in igen; resten kommer från embedding-cachen
+    assert len(model.embedded) == 1 and "999" in model.embedded[0]
+
+    index = db.load_lexical_index()
+    assert set(index.ids) == stored_ids
+    assert db.get_documents_by_id(["priser.csv:main:6-10"])["priser.csv:main:6-10"][0] == model.embedded[0]
+    assert db.metadata_index.matching_ids({"source": "gamla.csv"}) == []
+
+    # ID:na är deterministiska: en full körning ger samma chunks
+    _populate(monkeypatch)
+    assert set(DatabaseManager(chroma_path).get_all_documents()["ids"]) == stored_ids
+
+
+def test_failed_batch_is_not_written_and_retry_is_idempotent(tmp_path, embeddings, monkeypatch, caplog):
+    db = DatabaseManager(str(tmp_path / "chroma"), batch_size=2, vector_backend="memmap")
+    chunks = [Document(page_content=f"hotell {i} kostar", metadata={"source": "a.pdf", "page": i}) for i in range(5)]
+    embed_documents = embeddings.embed_documents
+    calls = []
+
+    def failing_second_batch(texts):
+        calls.append(texts)
+        if len(calls) == 2:
+            raise RuntimeError("modellen svarar inte")
+        return embed_documents(texts)
+
+    monkeypatch.setattr(embeddings, "embed_documents", failing_second_batch)
+    seen_ids = set()
+    assert db.add_documents(chunks, update_indexes=False, seen_ids=seen_ids) is None
+
+    # Första batchen är skriven, den misslyckade och de efterföljande inte
+    written = set(db.get_all_documents()["ids"])
+    assert len(written) == 2
+    assert "chunk 3-4 av 5" in caplog.text
+    assert "modellen svarar inte" in caplog.text
+
+    # Ett nytt försök med samma seen_ids (som för en fil i flera batchar) skriver resten, utan dubbletter
+    ids = db.add_documents(chunks, update_indexes=False, seen_ids=seen_ids)
+    assert ids is not None and len(ids) == 3
+    assert not written & set(ids)
+    assert all(chunk_id in caplog.text for chunk_id in ids[:2])
+    assert set(db.get_all_documents()["ids"]) == written | set(ids)
+    assert db.vector_store.count() == 5
+    assert db.add_documents(chunks, update_indexes=False, seen_ids=seen_ids) == []
+    assert db.vector_store.count() == 5
+
+
+def test_delete_heavy_update_rebuilds_the_lexical_index(tmp_path, embeddings, monkeypatch):
+    db = DatabaseManager(str(tmp_path / "chroma"), vector_backend="memmap")
+    ids = db.add_documents([Document(page_content=f"hotell {i} kostar", metadata={"source": "a.pdf", "page": i})
+                            for i in range(10)])
+    db.refresh_indexes()
+
+    rebuilds = []
+    rebuild_lexical_index = db.rebuild_lexical_index
+    monkeypatch.setattr(db, "rebuild_lexical_index", lambda: rebuilds.append(True) or rebuild_lexical_index())
+
+    # Några få borttagningar slås in i indexet, fler än hälften av korpusen ger en ombyggnad
+    db.delete_chunks(ids[:2])
+    db.refresh_indexes()
+    assert rebuilds == []
+    db.delete_chunks(ids[2:7])
+    db.refresh_indexes()
+    assert rebuilds == [True]
+
+    index = db.load_lexical_index()
+    assert len(index) == db.vector_store.count() == 3
+    assert set(index.ids) == set(ids[7:]) == set(db.get_all_documents()["ids"])
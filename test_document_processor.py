@@ -0,0 +1,78 @@
+import multiprocessing
+
+import pytest
+
+import document_processor
+from database_manager import chunk_id
+from document_processor import DocumentProcessor
+from metadata_index import MetadataIndex, parse_filter
+from synthetic_corpus import write_pdf
+
+
+def test_pdf_source_is_the_file_name_like_csv(tmp_path):
+    write_pdf(str(tmp_path / "regler.pdf"), ["Varje spelare börjar med 1500 kr.", "Hotell kostar 200 kr."])
+    (tmp_path / "priser.csv").write_text("Namn,Pris\nGata 1,100\n")
+
+    chunks = [chunk for _file, file_chunks in DocumentProcessor(str(tmp_path)).iter_files() for chunk in file_chunks]
+
+    assert {chunk.metadata["source"] for chunk in chunks} == {"regler.pdf", "priser.csv"}
+    ids = [chunk.metadata.get("id") or chunk_id(chunk.metadata, chunk.page_content) for chunk in chunks]
+    index = MetadataIndex.build(zip(ids, (chunk.metadata for chunk in chunks)))
+    pdf_ids = index.matching_ids(parse_filter("source=regler.pdf"))
+    assert len(pdf_ids) == 2 and all(doc_id.startswith("regler.pdf:") for doc_id in pdf_ids)
+
+
+def _records(results):
+    return [(file, [(chunk.page_content, chunk.metadata) for chunk in chunks]) for file, chunks in results]
+
+
+def _write_corpus(path):
+    pages = [f"Sida {page}. Den som står på ruta {page} betalar {page * 10} kr i hyra till ägaren." for page in range(7)]
+    write_pdf(str(path / "b_regler.pdf"), pages)
+    (path / "a_priser.csv").write_text("Namn,Pris\n" + "".join(f"Gata {i},{100 + i}\n" for i in range(12)))
+    (path / "c_trasig.xlsx").write_bytes(b"inte en arbetsbok")
+    (path / "d_gator.csv").write_text("Namn,Pris\nGata 1,100\n")
+
+
+def test_failing_file_does_not_affect_the_others_or_their_order(tmp_path):
+    _write_corpus(tmp_path)
+    processor = DocumentProcessor(str(tmp_path))
+
+    assert processor.load_file("c_trasig.xlsx") == []
+    serial = _records(processor.iter_files())
+
+    assert [file for file, _records in serial] == ["a_priser.csv", "b_regler.pdf", "c_trasig.xlsx", "d_gator.csv"]
+    assert [len(records) for _file, records in serial] == [3, 7, 0, 1]
+    assert _records(DocumentProcessor(str(tmp_path), workers=2).iter_files()) == serial
+
+
+def test_large_pdfs_are_split_into_page_ranges(tmp_path, monkeypatch):
+    _write_corpus(tmp_path)
+    serial = _records(DocumentProcessor(str(tmp_path)).iter_files())
+    monkeypatch.setattr(document_processor, "PDF_PAGES_PER_TASK", 3)
+    processor = DocumentProcessor(str(tmp_path), workers=2)
+
+    assert [(file, pages) for file, pages, _last in processor._tasks(processor.list_files())][1:4] == \
+        [("b_regler.pdf", (0, 3)), ("b_regler.pdf", (3, 6)), ("b_regler.pdf", (6, 7))]
+    assert _records(processor.iter_files()) == serial
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                    reason="arbetsprocesserna måste ärva den utbytta metoden")
+def test_error_in_one_page_range_drops_only_that_file(tmp_path, monkeypatch):
+    _write_corpus(tmp_path)
+    serial = _records(DocumentProcessor(str(tmp_path)).iter_files())
+    monkeypatch.setattr(document_processor, "PDF_PAGES_PER_TASK", 3)
+    load_pdf_pages = DocumentProcessor.load_pdf_pages
+
+    def failing_middle_range(self, file, start, stop):
+        if start == 3:
+            raise RuntimeError("trasig sida")
+        return load_pdf_pages(self, file, start, stop)
+
+    monkeypatch.setattr(DocumentProcessor, "load_pdf_pages", failing_middle_range)
+    results = _records(DocumentProcessor(str(tmp_path), workers=2).iter_files())
+
+    assert [file for file, _records in results] == [file for file, _records in serial]
+    assert results[1] == ("b_regler.pdf", [])
+    assert results[:1] + results[2:] == serial[:1] + serial[2:]
@@ -0,0 +1,101 @@
+import importlib.util
+
+import pytest
+
+from embedding_cache import CachedEmbeddings
+
+
+class CountingEmbeddings:
+    model_name = "counting"
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0, 0.5] for text in texts]
+
+    def embed_query(self, text):
+        self.embedded.append(text)
+        return [float(len(text)), 0.0, 0.0]
+
+
+def test_only_misses_reach_the_model(tmp_path):
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, str(tmp_path / "embeddings.sqlite3"))
+
+    first = cache.embed_documents(["Monopol", "Ticket to Ride", "Monopol"])
+    second = cache.embed_documents(["Ticket to Ride", "Gå i fängelse"])
+
+    assert model.embedded == ["Monopol", "Ticket to Ride", "Gå i fängelse"]
+    assert first[0] == first[2] == [7.0, 1.0, 0.5]
+    assert second[0] == first[1]
+    assert cache.stats()["size"] == 3
+
+
+def test_database_is_created_on_first_embedding(tmp_path):
+    path = tmp_path / "cache" / "embeddings.sqlite3"
+    cache = CachedEmbeddings(CountingEmbeddings(), str(path))
+
+    assert not path.parent.exists()
+    assert cache.stats()["size"] == 0
+    cache.close()
+    assert not path.parent.exists()
+
+    cache.embed_query("Monopol")
+    assert path.exists() and cache.stats()["size"] == 1
+
+
+def test_cache_persists_and_is_keyed_by_model(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    CachedEmbeddings(CountingEmbeddings(), path).embed_documents(["Monopol"])
+
+    model = CountingEmbeddings()
+    reopened = CachedEmbeddings(model, path)
+    reopened.embed_documents(["Monopol"])
+    assert model.embedded == []
+    assert reopened.stats()["hit_rate"] == 1.0
+
+    other = CountingEmbeddings()
+    other.model_name = "annan-modell"
+    CachedEmbeddings(other, path).embed_documents(["Monopol"])
+    assert other.embedded == ["Monopol"]
+
+
+def test_backend_settings_that_change_vectors_change_the_cache_key():
+    from get_embedding_function import LazyEmbeddings
+
+    reference = LazyEmbeddings()
+
+    assert LazyEmbeddings(batch_size=128, threads=2).cache_key == reference.cache_key
+    assert LazyEmbeddings(backend="onnx").cache_key != reference.cache_key
+    assert LazyEmbeddings(backend="onnx-int8").cache_key != LazyEmbeddings(backend="onnx").cache_key
+    assert LazyEmbeddings(max_seq_length=128).cache_key != reference.cache_key
+
+
+def test_onnx_backend_names_the_missing_package(monkeypatch):
+    from get_embedding_function import LazyEmbeddings
+
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name, *args: None if name == "optimum" else find_spec(name, *args))
+
+    with pytest.raises(ImportError, match=r"optimum\[onnxruntime\]"):
+        LazyEmbeddings(backend="onnx-int8").embed_query("Monopol")
+
+
+def test_offline_mode_without_cached_model_fails_fast(monkeypatch):
+    from get_embedding_function import LazyEmbeddings
+
+    attempts = []
+
+    def load_model(self):
+        attempts.append(self.model_name)
+        raise OSError("We couldn't connect to 'https://huggingface.co' to load this file")
+
+    monkeypatch.setattr(LazyEmbeddings, "_load_model", load_model)
+    monkeypatch.setenv("RAG_OFFLINE", "1")
+    monkeypatch.setenv("RAG_MODEL_CACHE", "/tom/modellcache")
+
+    with pytest.raises(OSError, match=r"finns inte i den lokala cachen och RAG_OFFLINE är satt.*RAG_MODEL_CACHE=/tom/modellcache"):
+        LazyEmbeddings().embed_query("Monopol")
+    assert len(attempts) == 1
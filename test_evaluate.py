@@ -0,0 +1,68 @@
+from evaluate import Evaluator, Judge, JudgeCache, retrieval_metrics, stub_responder
+from llm_client import LLMClient
+from search_engine import build_chat_prompt
+from stub_llm_server import StubCompletionServer
+
+CHUNKS = [
+    {"id": "data/monopoly.pdf:0:aaaa", "source": "data/monopoly.pdf", "page": 0},
+    {"id": "data/ticket_to_ride.pdf:3:bbbb", "source": "data/ticket_to_ride.pdf", "page": 3.0},
+    {"id": "priser.xlsx:Gator:1-5", "source": "priser.xlsx", "type": "structured_data", "sheet": "Gator"},
+]
+
+
+def test_retrieval_metrics():
+    assert retrieval_metrics(CHUNKS, ["ticket_to_ride.pdf:3"], [1, 3]) == {
+        "recall@1": 0.0, "recall@3": 1.0, "reciprocal_rank": 0.5}
+    assert retrieval_metrics(CHUNKS, ["monopoly.pdf", "priser.xlsx:Gator", "saknas.pdf"], [1, 3]) == {
+        "recall@1": 1 / 3, "recall@3": 2 / 3, "reciprocal_rank": 1.0}
+    assert retrieval_metrics(CHUNKS, ["data/monopoly.pdf:0"], [1])["recall@1"] == 1.0
+
+
+def test_judge_verdicts_are_cached(tmp_path):
+    with StubCompletionServer(stub_responder) as server:
+        with LLMClient(base_url=server.base_url) as client:
+            judge = Judge(client, JudgeCache(str(tmp_path / "judge.sqlite3")))
+            assert judge("$1500", "Varje spelare får $1500.") is True
+            assert judge("$1500", "Varje spelare får $1500.") is True
+            assert judge("10 points", "Inga poäng.") is False
+    assert len(server.requests) == 2
+    assert (judge.cache.hits, judge.cache.misses) == (1, 2)
+
+
+class FixedSearchEngine:
+    """Sökmotor med fasta träffar, så att testet inte behöver någon databas eller embeddingmodell"""
+
+    def __init__(self, llm_client):
+        self.llm_client = llm_client
+
+    def search_legs(self, query, top_k_each=6, where=None):
+        hits = [({"page_content": f"Sida {chunk['page']}: startkapital $1500.", "metadata": chunk}, 1.0)
+                for chunk in CHUNKS[:2]]
+        return hits[:top_k_each], []
+
+    def answer_structured(self, query, where=None):
+        return None
+
+    def generate_chat_response(self, query, context, history):
+        return self.llm_client.complete(build_chat_prompt("", query, context, history))
+
+
+def test_evaluator_runs_questions_concurrently_against_stub(tmp_path):
+    questions = [{"id": str(i), "question": f"Fråga {i}", "expected": "$1500", "relevant": ["monopoly.pdf"]}
+                 for i in range(8)]
+    with StubCompletionServer(stub_responder, latency=0.2) as server:
+        with LLMClient(base_url=server.base_url) as client:
+            # Skapa modellinstanserna innan de parallella anropen
+            client.complete("hej")
+            client.complete("hej", temperature=0)
+            judge = Judge(client, JudgeCache(str(tmp_path / "judge.sqlite3")))
+            report = Evaluator(FixedSearchEngine(client), judge, ks=[1, 3], workers=8).run(questions)
+        peak_in_flight = server.peak_in_flight
+
+    summary = report["summary"]
+    assert summary["accuracy"] == 1.0 and summary["mrr"] == 1.0 and summary["recall@1"] == 1.0
+    # Alla åtta svar är identiska, så domaren tillfrågas bara en gång per unikt (förväntat, svar)
+    assert summary["judge_cache"]["misses"] + summary["judge_cache"]["hits"] == 8
+    # Frågorna körs parallellt: stub-servern har haft flera anrop igång samtidigt
+    assert peak_in_flight > 1
+    assert set(summary["total_latency"]) >= {"p50_ms", "p95_ms"}
@@ -0,0 +1,101 @@
+import threading
+import time
+
+from langchain_core.documents import Document
+
+from database_manager import DatabaseManager
+from ingestion_pipeline import IngestionPipeline
+
+
+class FakeProcessor:
+    """Strömmar chunks som DocumentProcessor.iter_files(lazy=True); fail = {fil: chunk som kastar}"""
+
+    def __init__(self, chunks_per_file, fail=None):
+        self.chunks_per_file = chunks_per_file
+        self.fail = fail or {}
+        self.produced = 0
+
+    def _chunks(self, file):
+        for i in range(self.chunks_per_file):
+            if self.fail.get(file) == i:
+                raise RuntimeError(f"trasig rad i {file}")
+            self.produced += 1
+            yield Document(page_content=f"{file} rad {i} kostar {i * 10} kr", metadata={"source": file, "page": i})
+
+    def iter_files(self, files, lazy=False):
+        for file in files:
+            yield file, self._chunks(file)
+
+
+def _run(db, processor, files, manifest, batch_size=4, queue_size=4):
+    hashes = {file: f"hash-{file}" for file in files}
+    return IngestionPipeline(processor, db, batch_size=batch_size, queue_size=queue_size).run(files, hashes, manifest)
+
+
+def test_chunks_are_written_in_fixed_size_batches(tmp_path, embeddings, monkeypatch):
+    db = DatabaseManager(str(tmp_path / "chroma"), vector_backend="memmap")
+    manifest = db.load_manifest()
+    batch_sizes = []
+    add_documents = db.add_documents
+    monkeypatch.setattr(db, "add_documents",
+                        lambda chunks, **kwargs: batch_sizes.append(len(chunks)) or add_documents(chunks, **kwargs))
+
+    stats = _run(db, FakeProcessor(10), ["a.pdf", "b.pdf"], manifest)
+
+    assert batch_sizes == [4, 4, 2, 4, 4, 2]
+    assert (stats["files"], stats["chunks"], stats["batches"]) == (2, 20, 6)
+    assert db.vector_store.count() == 20
+    assert {file: len(entry["chunk_ids"]) for file, entry in manifest["files"].items()} == {"a.pdf": 10, "b.pdf": 10}
+    assert db.load_manifest() == manifest
+
+
+def test_bounded_queue_holds_back_the_producer(tmp_path, embeddings, monkeypatch):
+    db = DatabaseManager(str(tmp_path / "chroma"), vector_backend="memmap")
+    processor = FakeProcessor(100)
+    writing, release = threading.Event(), threading.Event()
+    add_documents = db.add_documents
+
+    def slow_add_documents(chunks, **kwargs):
+        writing.set()
+        release.wait(5)
+        return add_documents(chunks, **kwargs)
+
+    monkeypatch.setattr(db, "add_documents", slow_add_documents)
+    thread = threading.Thread(target=_run, args=(db, processor, ["a.pdf"], db.load_manifest()),
+                              kwargs={"batch_size": 2, "queue_size": 1})
+    thread.start()
+    try:
+        assert writing.wait(5)
+        time.sleep(0.2)
+        # En batch skrivs, en ligger i kön och producenten väntar med en tredje
+        assert processor.produced <= 3 * 2
+    finally:
+        release.set()
+        thread.join(10)
+    assert processor.produced == 100 and db.vector_store.count() == 100
+
+
+def test_failing_file_is_isolated_and_resumed_on_the_next_run(tmp_path, embeddings):
+    db = DatabaseManager(str(tmp_path / "chroma"), vector_backend="memmap")
+    manifest = db.load_manifest()
+    files = ["a.pdf", "b.pdf", "c.pdf"]
+
+    stats = _run(db, FakeProcessor(10, fail={"b.pdf": 6}), files, manifest)
+
+    assert stats["failed_files"] == ["b.pdf"]
+    assert set(manifest["files"]) == {"a.pdf", "c.pdf"}
+    # b.pdf:s första batchar ligger kvar men filen är inte registrerad, så den läses om nästa gång
+    assert db.vector_store.count() == 10 + 4 + 10
+
+    # Som populate_database --incremental: färdiga filer med samma hash hoppas över
+    hashes = {file: f"hash-{file}" for file in files}
+    remaining = [file for file in files if manifest["files"].get(file, {}).get("hash") != hashes[file]]
+    assert remaining == ["b.pdf"]
+    embeddings.embedded.clear()
+    stats = _run(db, FakeProcessor(10), remaining, manifest)
+
+    assert (stats["files"], stats["failed_files"]) == (1, [])
+    assert set(manifest["files"]) == set(files)
+    # Upsert på deterministiska ID:n: de redan skrivna chunkarna dubbleras inte
+    assert db.vector_store.count() == 30
+    assert len(embeddings.embedded) == 10
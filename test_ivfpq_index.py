@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from ivfpq_index import IVFPQIndex
+
+
+def _clustered(n=2000, dim=32, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, dim))
+    vectors = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+    return [f"doc{i}" for i in range(n)], vectors
+
+
+def _recall(index, ids, vectors, queries, k, nprobe):
+    hits = []
+    for query in queries:
+        expected = {ids[i] for i in np.argsort(-(vectors @ query))[:k]}
+        found, _scores = index.search(query, k, nprobe)
+        hits.append(len(expected & set(found)) / k)
+    return float(np.mean(hits))
+
+
+def test_recall_grows_with_nprobe():
+    ids, vectors = _clustered()
+    index = IVFPQIndex(nlist=32, m=16)
+    index.train(vectors[:1000])
+    index.add(ids, vectors)
+
+    queries = vectors[:50]
+    assert _recall(index, ids, vectors, queries, 10, 32) > _recall(index, ids, vectors, queries, 10, 1)
+    assert _recall(index, ids, vectors, queries, 10, 32) > 0.7
+    found, scores = index.search(vectors[5], 1, 32)
+    assert found == ["doc5"]
+    assert index.codes.shape == (2000, 16) and index.codes.dtype == np.uint8
+
+
+def test_incremental_add_remove_and_reload(tmp_path):
+    ids, vectors = _clustered(n=600)
+    index = IVFPQIndex(nlist=8, m=4)
+    index.train(vectors)
+    index.add(ids[:500], vectors[:500])
+    index.add(ids[500:], vectors[500:])
+    index.add(["doc1"], vectors[550:551])
+    index.remove(["doc550"])
+
+    assert len(index) == 599
+    assert index.search(vectors[550], 1, 8)[0] == ["doc1"]
+
+    index.save(str(tmp_path / "ivfpq"))
+    reloaded = IVFPQIndex.load(str(tmp_path / "ivfpq"))
+    assert len(reloaded) == 599
+    assert reloaded.search(vectors[550], 3, 8)[0] == index.search(vectors[550], 3, 8)[0]
+    reloaded.add(["new"], vectors[550:551])
+    assert "new" in reloaded.search(vectors[550], 2, 8)[0]
+
+
+def test_untrained_index_is_not_loaded(tmp_path):
+    path = tmp_path / "ivfpq"
+    with pytest.raises(RuntimeError):
+        IVFPQIndex().save(str(path))
+
+    # Så sparade äldre versioner ett otränat index
+    path.mkdir()
+    (path / "ids.json").write_text('{"ids": [], "nlist": null, "m": null, "seed": 0}')
+    np.save(path / "centroids.npy", np.array(None, dtype=object), allow_pickle=True)
+    np.save(path / "codebooks.npy", np.array(None, dtype=object), allow_pickle=True)
+    assert IVFPQIndex.load(str(path)) is None
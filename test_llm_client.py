@@ -0,0 +1,22 @@
+from llm_client import LLMClient
+from stub_llm_server import StubCompletionServer
+
+
+def test_complete_reuses_one_connection():
+    with StubCompletionServer(lambda prompt: "<|im_start|>1500 kr<|im_end|>") as server:
+        with LLMClient(base_url=server.base_url) as client:
+            answers = [client.complete("Hur mycket pengar?", temperature=0.4) for _ in range(3)]
+
+    assert answers == ["1500 kr"] * 3
+    assert len(server.requests) == 3
+    assert len(server.connections) == 1
+
+
+def test_stream_yields_tokens_as_they_arrive():
+    with StubCompletionServer(lambda prompt: "Den längsta tågsträckan ger 10 poäng.") as server:
+        with LLMClient(base_url=server.base_url) as client:
+            tokens = list(client.stream("Hur många poäng?", temperature=0.4))
+
+    assert len(tokens) > 1
+    assert "".join(tokens) == "Den längsta tågsträckan ger 10 poäng."
+    assert server.requests[0]["stream"] is True
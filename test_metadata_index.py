@@ -0,0 +1,51 @@
+import numpy as np
+
+from bm25_index import BM25Index
+from metadata_index import MetadataIndex, parse_filter
+
+ROWS = [
+    ("a:1", {"source": "regler.pdf", "type": "pdf", "page": 1}),
+    ("a:2", {"source": "regler.pdf", "type": "pdf", "page": 2.0}),
+    ("b:1", {"source": "priser.xlsx", "type": "structured_data", "sheet": "Gator"}),
+    ("b:2", {"source": "priser.xlsx", "type": "structured_data", "sheet": "Stationer"}),
+]
+
+
+def test_filter_expressions(tmp_path):
+    index = MetadataIndex.build(ROWS)
+    assert index.matching_ids({"source": "regler.pdf"}) == ["a:1", "a:2"]
+    assert index.matching_ids({"page": 2}) == ["a:2"]
+    assert index.matching_ids({"sheet": {"$in": ["Gator", "Saknas"]}}) == ["b:1"]
+    assert index.matching_ids({"$or": [{"page": 1}, {"sheet": "Stationer"}]}) == ["a:1", "b:2"]
+    assert index.matching_ids({"$and": [{"type": "structured_data"}, {"sheet": {"$ne": "Gator"}}]}) == ["b:2"]
+
+    index.save(str(tmp_path / "metadata_index.npz"))
+    reloaded = MetadataIndex.load(str(tmp_path / "metadata_index.npz"))
+    assert reloaded.matching_ids(parse_filter("type=structured_data sheet=Gator,Stationer")) == ["b:1", "b:2"]
+    assert list(reloaded.mask_for({"page": 1}, ["b:1", "a:1", "saknas"])) == [False, True, False]
+
+
+def test_parse_filter():
+    assert parse_filter("source=regler.pdf") == {"source": "regler.pdf"}
+    assert parse_filter("page=3,4 type=pdf") == {"$and": [{"page": {"$in": [3, 4]}}, {"type": "pdf"}]}
+    assert parse_filter("  ") is None
+
+
+def test_bm25_only_ranks_allowed_documents():
+    index = BM25Index.build(["a", "b", "c"], ["hotell på gatan", "hotell och hus", "fängelse"])
+    allowed = np.array([False, True, True])
+    assert [position for position, _score in index.top_k("hotell", 5, allowed)] == [1]
+    assert [[p for p, _s in hits] for hits in index.top_k_many(["hotell", "gatan"], 5, allowed)] == [[1], []]
+
+
+def test_update_keeps_rows_aligned_with_ids():
+    index = MetadataIndex.build(ROWS).update(
+        ["a:1"], [("b:1", {"source": "priser.xlsx", "type": "structured_data", "sheet": "Hotell"}),
+                  ("c:1", {"source": "nya.pdf", "type": "pdf", "page": 1})])
+
+    assert index.ids == ["a:2", "b:2", "b:1", "c:1"]
+    assert index.matching_ids({"sheet": "Gator"}) == []
+    assert index.matching_ids({"sheet": "Hotell"}) == ["b:1"]
+    assert index.matching_ids({"page": 1}) == ["c:1"]
+    assert index.matching_ids({"type": "pdf"}) == ["a:2", "c:1"]
+    assert index.values("source") == ["nya.pdf", "priser.xlsx", "regler.pdf"]
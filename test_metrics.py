@@ -0,0 +1,51 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import NULL_SPAN, Metrics
+
+
+def test_nested_spans_counters_and_exports(tmp_path):
+    metrics = Metrics(enabled=True, log_path=str(tmp_path / "trace.jsonl"),
+                      prometheus_path=str(tmp_path / "rag.prom"))
+
+    def leg():
+        with metrics.span("search.bm25"):
+            metrics.count("documents_scored", 40, leg="bm25")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        with metrics.span("chat.turn", filtered=False):
+            executor.submit(metrics.bind(leg)).result()
+            metrics.count("cache_hits", cache="search_results")
+    metrics.flush()
+
+    trace = json.loads((tmp_path / "trace.jsonl").read_text())
+    assert trace["name"] == "chat.turn" and trace["attrs"] == {"filtered": False}
+    assert trace["counts"] == {"cache_hits{cache=search_results}": 1}
+    [child] = trace["children"]
+    assert child["name"] == "search.bm25" and child["counts"] == {"documents_scored{leg=bm25}": 40}
+
+    text = (tmp_path / "rag.prom").read_text()
+    assert 'rag_stage_seconds_count{stage="search.bm25"} 1' in text
+    assert 'rag_stage_seconds_bucket{stage="chat.turn",le="+Inf"} 1' in text
+    assert 'rag_documents_scored_total{leg="bm25"} 40' in text
+    assert metrics.snapshot()["counters"] == {"cache_hits{cache=search_results}": 1,
+                                              "documents_scored{leg=bm25}": 40}
+
+
+def test_timed_iter_excludes_consumer_time():
+    metrics = Metrics(enabled=True)
+    for _chunk in metrics.timed_iter("docs.load_file", range(3), file="a.pdf"):
+        time.sleep(0.02)
+    stage = metrics.snapshot()["stages"]["docs.load_file"]
+    assert stage["count"] == 1 and stage["max_ms"] < 20
+
+
+def test_disabled_records_nothing():
+    metrics = Metrics(enabled=False)
+    assert metrics.span("search") is NULL_SPAN
+    with metrics.span("search"):
+        metrics.count("documents_scored", 5)
+    fn = len
+    assert metrics.bind(fn) is fn
+    assert metrics.snapshot() == {"stages": {}, "counters": {}}
@@ -0,0 +1,45 @@
+import query_cache
+from query_cache import LRUCache, normalize_query
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["size"] == 2
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(query_cache.time, "time", lambda: now[0])
+    cache = LRUCache(ttl=10)
+    cache.put("a", 1)
+
+    now[0] += 10
+    assert cache.get("a") == 1
+    now[0] += 0.5
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_cache_persists_the_newest_entries(tmp_path):
+    path = str(tmp_path / "cache.pkl")
+    cache = LRUCache(max_size=3, path=path)
+    for i in range(3):
+        cache.put(i, i * 10)
+    cache.save()
+
+    reloaded = LRUCache(max_size=2, path=path)
+    assert reloaded.get(0) is None
+    assert reloaded.get(2) == 20
+
+
+def test_normalize_query():
+    assert normalize_query("  Hur mycket   kostar\tett Hotell? ") == "hur mycket kostar ett hotell?"
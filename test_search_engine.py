@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+from langchain_core.documents import Document
+
+from database_manager import DatabaseManager
+from search_engine import SearchEngine
+
+
+def _slow_dense_engine(tmp_path, embeddings, release):
+    db = DatabaseManager(str(tmp_path / "chroma"), vector_backend="memmap")
+    texts = ["hotell kostar pengar", "gata med hus", "tärning och fängelse"]
+    db.add_documents([Document(page_content=text, metadata={"source": "a.pdf", "page": i})
+                      for i, text in enumerate(texts)])
+    db.refresh_indexes()
+
+    search_engine = SearchEngine("", embeddings, db_manager=db, dense_timeout=0.05)
+    dense_search = search_engine._dense_search
+
+    def slow_dense_search(*args):
+        release.wait(5)
+        return dense_search(*args)
+
+    search_engine._dense_search = slow_dense_search
+    return search_engine
+
+
+def test_slow_dense_leg_degrades_to_bm25_only(tmp_path, embeddings, capsys):
+    release = threading.Event()
+    search_engine = _slow_dense_engine(tmp_path, embeddings, release)
+    try:
+        bm25_results, sim_results = search_engine.search_legs("hotell", top_k_each=3)
+        async_bm25, async_sim = asyncio.run(search_engine.asearch_legs("hotell", top_k_each=3))
+        assert search_engine.result_cache.stats()["size"] == 0
+    finally:
+        release.set()
+        search_engine.close()
+
+    assert [doc["page_content"] for doc, _score in bm25_results] == ["hotell kostar pengar"]
+    assert sim_results == []
+    assert [doc["page_content"] for doc, _score in async_bm25] == ["hotell kostar pengar"]
+    assert async_sim == []
+    assert capsys.readouterr().out.count("similarity-sökningen hann inte klart inom 0.05s") == 2
+
+
+def _engine(tmp_path, embeddings, texts):
+    db = DatabaseManager(str(tmp_path / "chroma"), vector_backend="memmap")
+    db.add_documents([Document(page_content=text, metadata={"source": "a.pdf", "page": i})
+                      for i, text in enumerate(texts)])
+    return db, SearchEngine("", embeddings, db_manager=db)
+
+
+def test_query_is_embedded_as_written_and_cached_normalized(tmp_path, embeddings, monkeypatch):
+    _db, search_engine = _engine(tmp_path, embeddings, ["hotell kostar pengar"])
+    queries = []
+    embed_query = embeddings.embed_query
+    monkeypatch.setattr(embeddings, "embed_query", lambda text: queries.append(text) or embed_query(text))
+    try:
+        first = search_engine.embed_query("Hotell på  Strandvägen")
+        second = search_engine.embed_query("hotell på strandvägen")
+    finally:
+        search_engine.close()
+
+    assert queries == ["Hotell på  Strandvägen"]
+    assert first == second
+
+
+def test_result_cache_is_invalidated_by_add_documents_and_clear(tmp_path, embeddings):
+    db, search_engine = _engine(tmp_path, embeddings, ["hotell kostar pengar", "tärning och fängelse"])
+    try:
+        before, _sim = search_engine.search_legs("hotell", top_k_each=5)
+        assert search_engine.search_legs("hotell", top_k_each=5)[0] == before
+        assert search_engine.result_cache.hits == 1
+
+        db.add_documents([Document(page_content="hotell på gata", metadata={"source": "b.pdf", "page": 0})])
+        after, _sim = search_engine.search_legs("hotell", top_k_each=5)
+        assert {doc["page_content"] for doc, _score in after} == {"hotell kostar pengar", "hotell på gata"}
+
+        db.clear_database()
+        assert search_engine.search_legs("hotell", top_k_each=5) == ([], [])
+    finally:
+        search_engine.close()
+
+
+def test_startup_neither_loads_the_model_nor_writes_files(tmp_path, monkeypatch):
+    from get_embedding_function import LazyEmbeddings
+    from query_data import create_search_engine
+
+    def load_model(self):
+        raise AssertionError("modellen ska laddas först vid första inbäddningen")
+
+    monkeypatch.setattr(LazyEmbeddings, "_load_model", load_model)
+    monkeypatch.setenv("RAG_EMBEDDING_CACHE", str(tmp_path / "cache" / "embeddings.sqlite3"))
+    monkeypatch.chdir(tmp_path)
+
+    for backend in ("chroma", "memmap"):
+        db = DatabaseManager(str(tmp_path / f"chroma-{backend}"), vector_backend=backend)
+        create_search_engine(db, cache_dir=str(tmp_path / "cache")).close()
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from structured_data_processor import StructuredDataProcessor
+
+
+def _write_workbook(path, sheets=3, rows=47):
+    workbook = Workbook(write_only=True)
+    for s in range(sheets):
+        sheet = workbook.create_sheet(f"Blad{s + 1}")
+        sheet.append(["Namn", "Pris", "Färg"])
+        for i in range(rows):
+            sheet.append([f"Gata {s}-{i}", 100 + i * 10 + s, ("Röd", "Blå", None)[i % 3]])
+    workbook.save(path)
+
+
+def test_parallel_sheets_match_serial_in_order(tmp_path):
+    path = str(tmp_path / "gator.xlsx")
+    _write_workbook(path)
+
+    serial = list(StructuredDataProcessor().excel_to_documents(path, "gator.xlsx", chunk_size=5, block_rows=10))
+    parallel = list(StructuredDataProcessor(sheet_workers=2).excel_to_documents(
+        path, "gator.xlsx", chunk_size=5, block_rows=10))
+
+    assert [(doc.page_content, doc.metadata) for doc in parallel] == \
+        [(doc.page_content, doc.metadata) for doc in serial]
+    assert len(serial) == 30
+    assert [doc.metadata["sheet"] for doc in serial][::10] == ["Blad1", "Blad2", "Blad3"]
+    assert serial[9].metadata["row_start"] == 46 and serial[9].metadata["row_end"] == 47
+
+
+def test_stopping_early_does_not_block_on_full_sheet_queues(tmp_path):
+    path = str(tmp_path / "gator.xlsx")
+    _write_workbook(path, rows=300)
+
+    documents = StructuredDataProcessor(sheet_workers=3).excel_to_documents(path, "gator.xlsx", chunk_size=5,
+                                                                              block_rows=10)
+    first = [next(documents) for _ in range(3)]
+    documents.close()
+    assert [doc.metadata["row_start"] for doc in first] == [1, 6, 11]
+
+
+def _per_row_documents(df, source, chunk_size, column_types):
+    """Den tidigare radvisa formateringen (iterrows + pd.to_numeric per cell), som referens"""
+    value_columns, date_columns, text_columns = column_types["value"], column_types["date"], column_types["text"]
+    documents = []
+    for start_idx in range(0, len(df), chunk_size):
+        end_idx = min(start_idx + chunk_size, len(df))
+        chunk_df = df.iloc[start_idx:end_idx]
+        content_parts = []
+        descriptions = []
+        for col in text_columns:
+            descriptions = chunk_df[col].dropna().unique()
+            if descriptions.size > 0:
+                content_parts.append(f"Beskrivning: {', '.join(str(d) for d in descriptions)}")
+        for _idx, row in chunk_df.iterrows():
+            row_parts = []
+            for date_col in date_columns:
+                if pd.notna(row[date_col]):
+                    row_parts.append(f"Datum ({date_col}): {str(row[date_col]).strip()}")
+            for val_col in value_columns:
+                if pd.notna(row[val_col]):
+                    try:
+                        value = pd.to_numeric(row[val_col])
+                        formatted_value = f"{value:,.2f}" if isinstance(value, float) else f"{value:,d}"
+                        row_parts.append(f"Värde ({val_col}): {formatted_value}")
+                    except (ValueError, TypeError):
+                        row_parts.append(f"Text ({val_col}): {row[val_col]}")
+            if row_parts:
+                content_parts.append(" | ".join(row_parts))
+        metadata = {
+            "source": source,
+            "type": "structured_data",
+            "sheet": "main",
+            "row_start": start_idx + 1,
+            "row_end": end_idx,
+            "description": ", ".join(str(d) for d in descriptions) if text_columns and len(descriptions) > 0 else "",
+            "value_columns": ", ".join(str(col) for col in value_columns),
+            "date_columns": ", ".join(str(col) for col in date_columns),
+            "id": f"{source}:main:{start_idx + 1}-{end_idx}",
+        }
+        if content_parts:
+            documents.append((("\n".join(content_parts)), metadata))
+    return documents
+
+
+def test_column_formatting_matches_per_row_formatting():
+    df = pd.DataFrame({
+        "Datum": pd.to_datetime(["2024-01-05", None, "2024-03-01", "2024-04-30", "2024-05-02", "2024-06-15", None]),
+        "Kvartal": ["2024Q1", "2024Q1", None, "2024Q2", "2024Q2", "2024Q3", "2024Q3"],
+        "Antal": [1, 2500, 3, 40, 1234567, 6, 7],
+        "Pris": [1.5, np.nan, 1234.567, 0.0, -2.25, 10.0, np.nan],
+        "Belopp": ["120", "3.75", None, "saknas", "-40", "1e3", " 12 "],
+        "Kommentar": ["Hyra", None, "Hyra", "El", None, None, "Vatten"],
+    })
+    processor = StructuredDataProcessor()
+    column_types = processor.detect_column_types(df)
+    assert column_types == {"value": ["Antal", "Pris", "Belopp"], "date": ["Datum", "Kvartal"], "text": ["Kommentar"]}
+
+    documents = processor.dataframe_to_documents(df, "budget.csv", chunk_size=3)
+
+    assert [(doc.page_content, doc.metadata) for doc in documents] == \
+        _per_row_documents(df, "budget.csv", 3, column_types)
+    assert [(doc.metadata["row_start"], doc.metadata["row_end"]) for doc in documents] == [(1, 3), (4, 6), (7, 7)]
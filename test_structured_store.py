@@ -0,0 +1,89 @@
+import pandas as pd
+
+from metadata_index import parse_filter
+from structured_data_processor import StructuredDataProcessor
+from structured_store import StructuredStore
+
+SALES = pd.DataFrame({
+    "Kvartal": ["2019Q1", "2019Q1", "2019Q2", "2020Q1"],
+    "Region": ["Nord", "Syd", "Nord", "Syd"],
+    "Intäkter": [100.5, 200.0, 300.0, 400.0],
+})
+
+
+def make_store(tmp_path) -> StructuredStore:
+    processor = StructuredDataProcessor(table_store_path=str(tmp_path / "structured.sqlite3"))
+    processor.dataframe_to_documents(SALES, source="sales.csv")
+    return processor.table_store
+
+
+def test_sum_with_filter_cites_source_rows(tmp_path):
+    store = make_store(tmp_path)
+
+    result = store.answer("Vad är summan av intäkter 2019Q1?")
+
+    assert result["answer"].startswith("Summa av Intäkter: 300.50 (2 rader)")
+    assert result["sources"] == [
+        {"source": "sales.csv", "type": "structured_data", "sheet": "main", "row_start": 1, "row_end": 2}
+    ]
+
+
+def test_filters_combine_and_lookup_without_aggregate(tmp_path):
+    store = make_store(tmp_path)
+
+    assert store.answer("Medelvärde av intäkter 2019Q1 Syd")["answer"].startswith("Medelvärde av Intäkter: 200 ")
+    assert store.answer("Intäkter för Nord 2019Q2")["answer"].startswith("Intäkter: rad 3: 300")
+
+
+def test_unrelated_question_and_reingest(tmp_path):
+    store = make_store(tmp_path)
+    assert store.answer("Hur mycket pengar får man i Monopol?") is None
+
+    # En ny inläsning av samma fil ersätter raderna i stället för att dubblera dem
+    store.delete_source("sales.csv")
+    StructuredDataProcessor(table_store_path=store.path).dataframe_to_documents(SALES, source="sales.csv")
+    assert store.answer("summa intäkter")["answer"].startswith("Summa av Intäkter: 1,000.50 (4 rader)")
+
+
+def test_metadata_filter_limits_the_tables(tmp_path):
+    store = make_store(tmp_path)
+    question = "Vad är summan av intäkter 2019Q1?"
+
+    assert store.answer(question, parse_filter("source=regler.pdf")) is None
+    assert store.answer(question, parse_filter("page=3")) is None
+    result = store.answer(question, parse_filter("source=sales.csv,regler.pdf type=structured_data"))
+    assert {source["source"] for source in result["sources"]} == {"sales.csv"}
+    assert store.answer(question, {"sheet": "main"}) is not None
+
+
+def test_common_words_alone_do_not_route_prose_questions(tmp_path):
+    processor = StructuredDataProcessor(table_store_path=str(tmp_path / "structured.sqlite3"))
+    processor.dataframe_to_documents(pd.DataFrame({
+        "Spelare": ["Anna", "Bo", "Anna"],
+        "Money": [1500, 200, 300],
+        "Points": [10, 4, 6],
+    }), source="monopol.csv")
+    store = processor.table_store
+
+    # Vanliga ord före ett kolumnnamn räcker inte, frågan går till sökningen
+    assert store.answer("How much total money does a player start with in Monopoly?") is None
+    assert store.answer("How many points does the longest continuous train get in Ticket to Ride?") is None
+    assert store.answer("Vad är max points?") is None
+
+    # ... men väl tillsammans med tabellens namn eller ett värde ur den
+    assert store.answer("Total money för Anna")["answer"].startswith("Summa av Money: 1,800 (2 rader)")
+    assert store.answer("Antal points i monopol")["answer"].startswith("Antal av Points: 3 (3 rader)")
+    # Uttryckliga aggregat behöver bara kolumnen
+    assert store.answer("Summan av points")["answer"].startswith("Summa av Points: 20 (3 rader)")
+
+
+def test_aggregates_are_computed_in_sql_with_cited_ranges(tmp_path):
+    store = make_store(tmp_path)
+
+    assert store.answer("Högsta intäkter")["answer"].startswith("Högsta värde av Intäkter: 400 (4 rader)")
+    assert store.answer("Lägsta intäkter")["sources"] == [
+        {"source": "sales.csv", "type": "structured_data", "sheet": "main", "row_start": 1, "row_end": 1}
+    ]
+    result = store.answer("Genomsnitt av intäkter för Nord")
+    assert result["answer"].startswith("Medelvärde av Intäkter: 200.25 (2 rader)")
+    assert [(source["row_start"], source["row_end"]) for source in result["sources"]] == [(1, 1), (3, 3)]
@@ -0,0 +1,15 @@
+from document_processor import DocumentProcessor
+from synthetic_corpus import generate_corpus, sample_questions
+
+
+def test_generated_corpus_loads(tmp_path):
+    size = generate_corpus(str(tmp_path), pdf_files=1, pages_per_file=3, table_files=1, rows_per_table=20)
+    assert size["pdf_pages"] == 3 and size["table_rows"] == 20
+
+    processor = DocumentProcessor(str(tmp_path))
+    assert processor.list_files() == ["regelbok_0000.pdf", "tabell_0000.csv"]
+    chunks = processor.load_file("regelbok_0000.pdf")
+    assert {chunk.metadata["page"] for chunk in chunks} == {0, 1, 2}
+    assert "tärning" in " ".join(chunk.page_content for chunk in chunks)
+    assert processor.load_file("tabell_0000.csv")
+    assert len(sample_questions(5)) == 5
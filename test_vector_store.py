@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from vector_store import MemmapVectorStore
+
+
+def _corpus(n=200, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n, dim)).astype(np.float32)
+    ids = [f"doc{i}" for i in range(n)]
+    return ids, vectors
+
+
+def _exact_top_k(vectors, query, k):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return list(np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:k])
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_search_matches_exact_top_k(tmp_path, dtype):
+    ids, vectors = _corpus()
+    store = MemmapVectorStore(str(tmp_path / "vectors"), dtype)
+    store.upsert(ids[:120], vectors[:120], ids[:120], [{"source": "a.pdf"}] * 120)
+    store.upsert(ids[120:], vectors[120:], ids[120:], [{"source": "b.pdf"}] * 80)
+
+    query = vectors[7] + 0.1
+    documents, metadatas, scores = store.search(query, 5)
+    expected = [ids[i] for i in _exact_top_k(vectors, query, 5)]
+    if dtype == "float32":
+        assert documents == expected
+    else:
+        assert documents[0] == expected[0]
+        assert len(set(documents) & set(expected)) >= 4
+    assert scores == sorted(scores, reverse=True)
+    assert store.search_many(np.stack([query, vectors[150]]), 1)[1][0][0] == "doc150"
+
+
+def test_upsert_replaces_and_delete_hides_rows(tmp_path):
+    ids, vectors = _corpus(n=10)
+    store = MemmapVectorStore(str(tmp_path / "vectors"), "float32")
+    store.upsert(ids, vectors, ids, [{"page": i} for i in range(10)])
+    store.upsert(["doc3"], vectors[9:10], ["ny text"], [{"page": 99}])
+    store.delete(["doc9"])
+
+    assert store.count() == 9
+    assert store.get(["doc3", "doc9", "doc0"]) == (["ny text", "doc0"], [{"page": 99}, {"page": 0}])
+    documents, _metadatas, _scores = store.search(vectors[9], 1)
+    assert documents == ["ny text"]
+
+
+def test_compact_keeps_live_rows_and_results(tmp_path):
+    ids, vectors = _corpus(n=50)
+    path = str(tmp_path / "vectors")
+    store = MemmapVectorStore(path, "int8")
+    for start in range(0, 50, 10):
+        store.upsert(ids[start:start + 10], vectors[start:start + 10], ids[start:start + 10], [{}] * 10)
+    store.delete(ids[:5])
+    before = store.search_many(vectors[10:20], 3)
+
+    store.compact()
+    reopened = MemmapVectorStore(path, "int8")
+    assert reopened.count() == 45
+    assert [doc_id for doc_id, _text in reopened.iter_documents(page_size=7)] == ids[5:]
+    assert reopened.search_many(vectors[10:20], 3) == before
+    assert reopened.embedding_matrix()[1].shape == (45, 16)
@@ -0,0 +1,555 @@
+import glob
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import metrics
+
+COLLECTION_NAME = "documents"
+# Används om Chroma-klienten inte kan rapportera sin maxgräns
+DEFAULT_MAX_BATCH_SIZE = 5000
+
+VECTOR_BACKENDS = ("chroma", "memmap")
+VECTOR_DTYPES = ("float32", "float16", "int8")
+MEMMAP_DIRNAME = "vectors"
+
+# Antal rader som avkodas och poängsätts åt gången vid sökning i memmap-matrisen
+SEARCH_BLOCK_ROWS = 1 << 16
+# Gränser för när refresh skriver om memmap-segmenten (se MemmapVectorStore.compact)
+COMPACT_MAX_SEGMENTS = 16
+COMPACT_DELETED_RATIO = 0.25
+
+# SQLite tillåter ett begränsat antal parametrar per fråga
+_SQL_BATCH = 500
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def merge_top_k(candidates: List[Tuple[np.ndarray, np.ndarray]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Slår ihop (positioner, poäng)-kandidater från flera block och behåller de k bästa, sorterade"""
+    if not candidates:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    positions = np.concatenate([p for p, _ in candidates])
+    scores = np.concatenate([s for _, s in candidates])
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        positions, scores = positions[keep], scores[keep]
+    order = np.argsort(-scores, kind="stable")
+    return positions[order], scores[order]
+
+
+class ChromaVectorStore:
+    """Vektorlagring i Chroma (standard): dokument, metadata och vektorer i samma samling"""
+
+    def __init__(self, path: str, embedding_function):
+        self.path = path
+        self.embedding_function = embedding_function
+        # Chroma öppnas först när databasen används (se db)
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            from langchain_chroma import Chroma
+
+            self._db = Chroma(
+                persist_directory=self.path,
+                embedding_function=self.embedding_function,
+                collection_name=COLLECTION_NAME
+            )
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            try:
+                self._db.delete_collection()
+            except Exception:
+                pass
+            self._db = None
+
+    def count(self) -> int:
+        return self.db._collection.count()
+
+    def max_batch_size(self) -> int:
+        """Största batch som Chroma-klienten accepterar i en skrivning"""
+        try:
+            return self.db._client.get_max_batch_size()
+        except Exception:
+            return DEFAULT_MAX_BATCH_SIZE
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str], metadatas: List[dict]):
+        # Med explicita ID:n blir skrivningen en upsert
+        self.db._collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+
+    def delete(self, ids: Sequence[str]):
+        self.db.delete(ids=list(ids))
+
+    def get_by_id(self, ids: Sequence[str]) -> Dict[str, Tuple[str, dict]]:
+        """id -> (dokument, metadata) för de ID:n som finns i lagret"""
+        data = self.db.get(ids=list(ids), include=["documents", "metadatas"])
+        return {
+            doc_id: (document, metadata)
+            for doc_id, document, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+        }
+
+    def get(self, ids: Sequence[str]) -> Tuple[List[str], List[dict]]:
+        """Hämtar dokument och metadata i samma ordning som ids; ID:n som saknas hoppas över"""
+        by_id = self.get_by_id(ids)
+        found = [by_id[doc_id] for doc_id in ids if doc_id in by_id]
+        return [doc for doc, _ in found], [meta for _, meta in found]
+
+    def get_all(self, where: Optional[dict] = None) -> dict:
+        return self.db.get(where=where) if where else self.db.get()
+
+    def iter_documents(self, page_size: int = 5000, include_metadata: bool = False) -> Iterator[tuple]:
+        """Går igenom (id, text) eller (id, text, metadata) sida för sida"""
+        offset = 0
+        include = ["documents", "metadatas"] if include_metadata else ["documents"]
+        while True:
+            page = self.db.get(include=include, limit=page_size, offset=offset)
+            if not page["ids"]:
+                return
+            if include_metadata:
+                yield from zip(page["ids"], page["documents"], page["metadatas"])
+            else:
+                yield from zip(page["ids"], page["documents"])
+            offset += len(page["ids"])
+
+    def search(self, query_embedding, k: int, where: Optional[dict] = None, metadata_index=None):
+        """Returnerar (dokument, metadata, poäng) där poängen är skalärprodukten mot de lagrade vektorerna.
+
+        Ett filter skickas vidare som Chromas where; metadata_index behövs inte här.
+        """
+        count = self.count()
+        if count == 0:
+            return [], [], []
+        result = self.db._collection.query(
+            query_embeddings=[list(query_embedding)],
+            n_results=min(k, count),
+            where=where or None,
+            include=["documents", "metadatas", "embeddings"]
+        )
+        embeddings = np.asarray(result["embeddings"][0], dtype=np.float32)
+        scores = (embeddings @ np.asarray(query_embedding, dtype=np.float32)).tolist()
+        order = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        return ([result["documents"][0][i] for i in order],
+                [result["metadatas"][0][i] for i in order],
+                [scores[i] for i in order])
+
+    def get_embeddings(self, ids: Sequence[str]) -> np.ndarray:
+        """Vektorerna för ids i samma ordning; ID:n som saknas ger en nollrad"""
+        data = self.db.get(ids=list(ids), include=["embeddings"])
+        by_id = dict(zip(data["ids"], data["embeddings"]))
+        dim = len(next(iter(by_id.values()))) if by_id else 0
+        return np.asarray([by_id[doc_id] if doc_id in by_id else np.zeros(dim) for doc_id in ids],
+                          dtype=np.float32).reshape(len(ids), dim)
+
+    def iter_embeddings(self, page_size: int = 5000) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """Går igenom (ids, vektorer) sida för sida"""
+        offset = 0
+        while True:
+            page = self.db.get(include=["embeddings"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                return
+            yield page["ids"], np.asarray(page["embeddings"], dtype=np.float32).reshape(len(page["ids"]), -1)
+            offset += len(page["ids"])
+
+    def embedding_matrix(self) -> Tuple[List[str], np.ndarray]:
+        data = self.db.get(include=["embeddings"])
+        return data["ids"], np.asarray(data["embeddings"], dtype=np.float32).reshape(len(data["ids"]), -1)
+
+    def compact(self, force: bool = True):
+        pass
+
+
+class MemmapVectorStore:
+    """Exakt vektorsökning över minnesmappade .npy-segment.
+
+    Vektorerna normaliseras och lagras som float32, float16 eller int8 med en
+    skala per rad. ID, text och metadata ligger i en SQLite-tabell där radens
+    position är samma som i matrisen. Segmenten öppnas med mmap_mode="r", så
+    flera processer delar samma sidor i OS-cachen i stället för egna kopior.
+    Nya skrivningar blir nya segment och ersatta/borttagna rader markeras som
+    raderade; compact() skriver om allt till ett segment.
+    """
+
+    def __init__(self, path: str, dtype: str = "float16"):
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Okänd vektortyp '{dtype}', välj en av: {', '.join(VECTOR_DTYPES)}")
+        self.path = path
+        self.dtype = dtype
+        self._lock = threading.RLock()
+        self._conn = None
+        self._generation = None
+        self._segments = []
+        self._deleted = np.zeros(0, dtype=bool)
+        self._position_ids = None
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, "meta.sqlite3"))
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.path, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.path, "meta.sqlite3"), timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    pos INTEGER PRIMARY KEY, id TEXT NOT NULL, document TEXT, metadata TEXT,
+                    deleted INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS chunks_live_id ON chunks (id) WHERE deleted = 0;
+                CREATE TABLE IF NOT EXISTS segments (
+                    seg INTEGER PRIMARY KEY, start INTEGER NOT NULL, rows INTEGER NOT NULL, dtype TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+                INSERT OR IGNORE INTO settings (key, value) VALUES ('generation', '0');
+            """)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._segments = []
+            self._generation = None
+
+    def _segment_file(self, seg: int) -> str:
+        return os.path.join(self.path, f"seg_{seg:06d}.npy")
+
+    def _bump_generation(self, conn: sqlite3.Connection):
+        conn.execute("UPDATE settings SET value = CAST(value AS INTEGER) + 1 WHERE key = 'generation'")
+
+    def _refresh(self):
+        """Öppnar segmenten och raderingsmasken på nytt om en annan skrivning har ändrat lagret"""
+        conn = self._connection()
+        generation = conn.execute("SELECT value FROM settings WHERE key = 'generation'").fetchone()[0]
+        if generation == self._generation:
+            return
+        segments = []
+        for seg, start, rows, dtype in conn.execute("SELECT seg, start, rows, dtype FROM segments ORDER BY start"):
+            vectors = np.load(self._segment_file(seg), mmap_mode="r")
+            scales = np.load(self._segment_file(seg)[:-4] + ".scales.npy", mmap_mode="r") if dtype == "int8" else None
+            segments.append((start, rows, vectors, scales))
+        total = segments[-1][0] + segments[-1][1] if segments else 0
+        deleted = np.zeros(total, dtype=bool)
+        deleted_positions = [pos for (pos,) in conn.execute("SELECT pos FROM chunks WHERE deleted = 1")]
+        deleted[np.asarray(deleted_positions, dtype=np.int64)] = True
+        self._segments, self._deleted, self._generation = segments, deleted, generation
+
+    def _encode(self, matrix: np.ndarray):
+        """Normaliserar och kodar vektorerna till lagringstypen; int8 får en skala per rad"""
+        matrix = normalize_rows(np.asarray(matrix, dtype=np.float32))
+        if self.dtype == "int8":
+            scales = np.maximum(np.abs(matrix).max(axis=1), 1e-12) / 127.0
+            return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return matrix.astype(self.dtype), None
+
+    @staticmethod
+    def _decode(vectors: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+        block = np.asarray(vectors, dtype=np.float32)
+        return block * scales[:, None] if scales is not None else block
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM chunks WHERE deleted = 0").fetchone()[0]
+
+    def max_batch_size(self) -> int:
+        return DEFAULT_MAX_BATCH_SIZE
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str], metadatas: List[dict]):
+        """Lägger till en batch som ett nytt segment; tidigare rader med samma ID markeras som raderade"""
+        vectors, scales = self._encode(embeddings)
+        with self._lock:
+            conn = self._connection()
+            start = conn.execute("SELECT COALESCE(MAX(start + rows), 0) FROM segments").fetchone()[0]
+            seg = conn.execute("SELECT COALESCE(MAX(seg), 0) + 1 FROM segments").fetchone()[0]
+            # Segmentfilerna skrivs innan metadata committas; en avbruten skrivning lämnar bara en oanvänd fil
+            self._save_array(self._segment_file(seg), vectors)
+            if scales is not None:
+                self._save_array(self._segment_file(seg)[:-4] + ".scales.npy", scales)
+            with conn:
+                self._mark_deleted(conn, ids)
+                conn.executemany(
+                    "INSERT INTO chunks (pos, id, document, metadata) VALUES (?, ?, ?, ?)",
+                    [(start + i, doc_id, document, json.dumps(metadata, ensure_ascii=False))
+                     for i, (doc_id, document, metadata) in enumerate(zip(ids, documents, metadatas))],
+                )
+                conn.execute("INSERT INTO segments (seg, start, rows, dtype) VALUES (?, ?, ?, ?)",
+                             (seg, start, len(ids), self.dtype))
+                self._bump_generation(conn)
+
+    @staticmethod
+    def _save_array(path: str, array: np.ndarray):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _mark_deleted(conn: sqlite3.Connection, ids: Sequence[str]):
+        for start in range(0, len(ids), _SQL_BATCH):
+            batch = list(ids[start:start + _SQL_BATCH])
+            conn.execute(
+                f"UPDATE chunks SET deleted = 1 WHERE deleted = 0 AND id IN ({', '.join('?' for _ in batch)})",
+                batch,
+            )
+
+    def delete(self, ids: Sequence[str]):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                self._mark_deleted(conn, list(ids))
+                self._bump_generation(conn)
+
+    def _rows(self, column: str, values: Sequence, live_only: bool = True) -> Dict:
+        """Hämtar (id, dokument, metadata, pos) för givna ID:n eller positioner, nycklat på värdet"""
+        found = {}
+        conn = self._connection()
+        for start in range(0, len(values), _SQL_BATCH):
+            batch = list(values[start:start + _SQL_BATCH])
+            query = (f"SELECT id, document, metadata, pos FROM chunks WHERE {column} IN "
+                     f"({', '.join('?' for _ in batch)})" + (" AND deleted = 0" if live_only else ""))
+            for doc_id, document, metadata, pos in conn.execute(query, batch):
+                found[doc_id if column == "id" else pos] = (doc_id, document, json.loads(metadata), pos)
+        return found
+
+    def get_by_id(self, ids: Sequence[str]) -> Dict[str, Tuple[str, dict]]:
+        """id -> (dokument, metadata) för de ID:n som finns i lagret"""
+        with self._lock:
+            rows = self._rows("id", list(ids))
+        return {doc_id: (row[1], row[2]) for doc_id, row in rows.items()}
+
+    def get(self, ids: Sequence[str]) -> Tuple[List[str], List[dict]]:
+        """Hämtar dokument och metadata i samma ordning som ids; ID:n som saknas hoppas över"""
+        by_id = self.get_by_id(ids)
+        found = [by_id[doc_id] for doc_id in ids if doc_id in by_id]
+        return [doc for doc, _ in found], [meta for _, meta in found]
+
+    def get_all(self) -> dict:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT id, document, metadata FROM chunks WHERE deleted = 0 ORDER BY pos"
+            ).fetchall()
+        return {"ids": [r[0] for r in rows], "documents": [r[1] for r in rows],
+                "metadatas": [json.loads(r[2]) for r in rows]}
+
+    def iter_documents(self, page_size: int = 5000, include_metadata: bool = False) -> Iterator[tuple]:
+        """Går igenom (id, text) eller (id, text, metadata) i positionsordning"""
+        last = -1
+        while True:
+            with self._lock:
+                page = self._connection().execute(
+                    "SELECT pos, id, document, metadata FROM chunks WHERE deleted = 0 AND pos > ? "
+                    "ORDER BY pos LIMIT ?",
+                    (last, page_size),
+                ).fetchall()
+            if not page:
+                return
+            if include_metadata:
+                yield from ((doc_id, document, json.loads(metadata)) for _pos, doc_id, document, metadata in page)
+            else:
+                yield from ((doc_id, document) for _pos, doc_id, document, _metadata in page)
+            last = page[-1][0]
+
+    def position_ids(self) -> List[Optional[str]]:
+        """ID per position i matrisen (None för raderade rader), cachat per ändring av lagret"""
+        with self._lock:
+            self._refresh()
+            if self._position_ids is None or self._position_ids[0] != self._generation:
+                ids = [None] * len(self._deleted)
+                for pos, doc_id in self._connection().execute("SELECT pos, id FROM chunks WHERE deleted = 0"):
+                    ids[pos] = doc_id
+                self._position_ids = (self._generation, ids)
+            return self._position_ids[1]
+
+    def search_positions(self, query_matrix: np.ndarray, k: int,
+                         allowed: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Exakt top-k för varje rad i query_matrix: en matrisprodukt per block och argpartition.
+
+        allowed är en valfri bitmask över positionerna; då avkodas och poängsätts
+        bara de rader som släpps igenom. Returnerar (positioner, poäng) per fråga,
+        sorterat efter fallande poäng.
+        """
+        queries = normalize_rows(np.atleast_2d(np.asarray(query_matrix, dtype=np.float32)))
+        with self._lock:
+            self._refresh()
+            segments, deleted = self._segments, self._deleted
+        candidates = [[] for _ in range(len(queries))]
+        scored = 0
+        if allowed is None:
+            for seg_start, rows, vectors, scales in segments:
+                scored += rows
+                for start in range(0, rows, SEARCH_BLOCK_ROWS):
+                    end = min(start + SEARCH_BLOCK_ROWS, rows)
+                    block = self._decode(vectors[start:end], None if scales is None else scales[start:end])
+                    scores = block @ queries.T
+                    scores[deleted[seg_start + start:seg_start + end]] = -np.inf
+                    self._collect(candidates, np.arange(seg_start + start, seg_start + end), scores, k)
+        else:
+            subset = np.flatnonzero(allowed[:len(deleted)] & ~deleted)
+            scored = len(subset)
+            for start in range(0, len(subset), SEARCH_BLOCK_ROWS):
+                positions = subset[start:start + SEARCH_BLOCK_ROWS]
+                self._collect(candidates, positions, self._vectors_at(positions, segments) @ queries.T, k)
+        metrics.count("documents_scored", scored * len(queries), leg="dense")
+        results = []
+        for query_candidates in candidates:
+            positions, scores = merge_top_k(query_candidates, k)
+            live = np.isfinite(scores)
+            results.append((positions[live], scores[live]))
+        return results
+
+    @staticmethod
+    def _collect(candidates: List[list], positions: np.ndarray, scores: np.ndarray, k: int):
+        """Lägger till blockets top-k (positioner, poäng) per fråga; scores har en kolumn per fråga"""
+        take = min(k, len(positions))
+        top = np.argpartition(-scores, take - 1, axis=0)[:take]
+        for q in range(scores.shape[1]):
+            rows_q = top[:, q]
+            candidates[q].append((positions[rows_q], scores[rows_q, q]))
+
+    def _allowed(self, where: Optional[dict], metadata_index) -> Optional[np.ndarray]:
+        if not where:
+            return None
+        if metadata_index is None:
+            raise ValueError("Filtrerad sökning i memmap-lagret kräver ett metadataindex")
+        return metadata_index.mask_for(where, self.position_ids())
+
+    def search(self, query_embedding, k: int, where: Optional[dict] = None, metadata_index=None):
+        """Returnerar (dokument, metadata, poäng) där poängen är cosinuslikheten.
+
+        Med ett filter poängsätts bara de rader som metadata_index släpper igenom.
+        """
+        positions, scores = self.search_positions(query_embedding, k, self._allowed(where, metadata_index))[0]
+        with self._lock:
+            rows = self._rows("pos", positions.tolist(), live_only=False)
+        return ([rows[p][1] for p in positions.tolist()],
+                [rows[p][2] for p in positions.tolist()],
+                scores.astype(float).tolist())
+
+    def search_many(self, query_matrix: np.ndarray, k: int, where: Optional[dict] = None,
+                    metadata_index=None) -> List[List[Tuple[str, float]]]:
+        """Som search men för många frågor; returnerar [(id, poäng)] per fråga"""
+        hits = self.search_positions(query_matrix, k, self._allowed(where, metadata_index))
+        all_positions = sorted({int(p) for positions, _ in hits for p in positions})
+        with self._lock:
+            rows = self._rows("pos", all_positions, live_only=False)
+        return [[(rows[int(p)][0], float(s)) for p, s in zip(positions, scores)] for positions, scores in hits]
+
+    def _vectors_at(self, positions: np.ndarray, segments=None) -> np.ndarray:
+        """Avkodade vektorer för givna positioner (utan segments: anroparen håller låset och har kört _refresh)"""
+        segments = self._segments if segments is None else segments
+        dim = segments[0][2].shape[1] if segments else 0
+        result = np.zeros((len(positions), dim), dtype=np.float32)
+        for start, rows, vectors, scales in segments:
+            inside = np.flatnonzero((positions >= start) & (positions < start + rows))
+            if len(inside):
+                local = positions[inside] - start
+                result[inside] = self._decode(vectors[local], None if scales is None else scales[local])
+        return result
+
+    def get_embeddings(self, ids: Sequence[str]) -> np.ndarray:
+        """Vektorerna för ids i samma ordning; ID:n som saknas ger en nollrad"""
+        with self._lock:
+            self._refresh()
+            by_id = self._rows("id", list(ids))
+            positions = np.asarray([by_id[doc_id][3] if doc_id in by_id else -1 for doc_id in ids], dtype=np.int64)
+            return self._vectors_at(positions)
+
+    def iter_embeddings(self, page_size: int = 5000) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """Går igenom (ids, vektorer) sida för sida utan att avkoda hela matrisen"""
+        last = -1
+        while True:
+            with self._lock:
+                self._refresh()
+                page = self._connection().execute(
+                    "SELECT pos, id FROM chunks WHERE deleted = 0 AND pos > ? ORDER BY pos LIMIT ?",
+                    (last, page_size),
+                ).fetchall()
+                if not page:
+                    return
+                vectors = self._vectors_at(np.asarray([pos for pos, _id in page], dtype=np.int64))
+            yield [doc_id for _pos, doc_id in page], vectors
+            last = page[-1][0]
+
+    def embedding_matrix(self) -> Tuple[List[str], np.ndarray]:
+        """Alla levande vektorer avkodade till float32, i positionsordning"""
+        with self._lock:
+            self._refresh()
+            ids = [doc_id for (doc_id,) in self._connection().execute(
+                "SELECT id FROM chunks WHERE deleted = 0 ORDER BY pos")]
+            if not self._segments:
+                return ids, np.zeros((0, 0), dtype=np.float32)
+            matrix = np.concatenate([self._decode(v, s) for _start, _rows, v, s in self._segments])
+            return ids, matrix[~self._deleted]
+
+    def compact(self, force: bool = True):
+        """Skriver om alla levande rader till ett enda segment och tar bort raderade rader.
+
+        Med force=False görs det bara när segmenten eller de raderade raderna har blivit
+        många nog (COMPACT_MAX_SEGMENTS, COMPACT_DELETED_RATIO), eftersom omskrivningen
+        läser hela korpusen.
+        """
+        with self._lock:
+            conn = self._connection()
+            self._refresh()
+            if len(self._segments) <= 1 and not self._deleted.any():
+                return
+            if not force and len(self._segments) <= COMPACT_MAX_SEGMENTS and \
+                    self._deleted.sum() <= COMPACT_DELETED_RATIO * len(self._deleted):
+                return
+            live = np.flatnonzero(~self._deleted)
+            seg = conn.execute("SELECT COALESCE(MAX(seg), 0) + 1 FROM segments").fetchone()[0]
+            old_files = [self._segment_file(s) for (s,) in conn.execute("SELECT seg FROM segments")]
+
+            kept = [(vectors, scales, live[(live >= start) & (live < start + rows)] - start)
+                    for start, rows, vectors, scales in self._segments]
+            stored_types = {(str(vectors.dtype), scales is not None) for vectors, scales, _keep in kept}
+            if len(stored_types) == 1:
+                # Samma lagringstyp i alla segment: kopiera de levande raderna utan att avkoda dem
+                vectors = np.concatenate([np.asarray(v[keep]) for v, _s, keep in kept])
+                scales = np.concatenate([np.asarray(s[keep]) for _v, s, keep in kept]) if kept[0][1] is not None else None
+                dtype = "int8" if scales is not None else str(vectors.dtype)
+            else:
+                # Segment med olika lagringstyp kodas om till den aktuella typen
+                vectors, scales = self._encode(np.concatenate([
+                    self._decode(v[keep], None if s is None else s[keep]) for v, s, keep in kept
+                ]))
+                dtype = self.dtype
+            self._save_array(self._segment_file(seg), vectors)
+            if scales is not None:
+                self._save_array(self._segment_file(seg)[:-4] + ".scales.npy", scales)
+
+            with conn:
+                conn.execute("DELETE FROM chunks WHERE deleted = 1")
+                # Positionerna numreras om i stigande ordning; en ny position är aldrig större än den gamla
+                conn.executemany("UPDATE chunks SET pos = ? WHERE pos = ?",
+                                 [(new, int(old)) for new, old in enumerate(live)])
+                conn.execute("DELETE FROM segments")
+                conn.execute("INSERT INTO segments (seg, start, rows, dtype) VALUES (?, 0, ?, ?)",
+                             (seg, len(live), dtype))
+                self._bump_generation(conn)
+            self._segments, self._generation = [], None
+            for path in old_files:
+                for file in glob.glob(path[:-4] + "*"):
+                    os.remove(file)
+
+
+def create_vector_store(backend: str, path: str, embedding_function, dtype: str = "float16"):
+    if backend == "chroma":
+        return ChromaVectorStore(path, embedding_function)
+    if backend == "memmap":
+        return MemmapVectorStore(os.path.join(path, MEMMAP_DIRNAME), dtype)
+    raise ValueError(f"Okänd vektorbackend '{backend}', välj en av: {', '.join(VECTOR_BACKENDS)}")